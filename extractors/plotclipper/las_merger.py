@@ -0,0 +1,190 @@
+"""Merging of LAS plot shards for the plot clipper
+
+Every output folder keeps a ledger (an SQLite file) of the source LAS files already merged
+into each of its merged LAS files, so checking a source is one keyed lookup. The shards of a
+message are merged in one pass per merged file once all of them are clipped, and the merged
+file is written next to the old one and renamed into place.
+"""
+
+import os
+import fcntl
+import logging
+import sqlite3
+import subprocess
+import tempfile
+import time
+
+from collections import OrderedDict
+
+from terrautils.spatial import clip_las
+
+# The name of the ledger file kept in every folder with merged LAS files
+LEDGER_FILE_NAME = '.las_merge_ledger.sqlite'
+
+# Seconds to wait for another extractor holding the ledger lock
+LEDGER_TIMEOUT = 60
+
+# Suffix of the lock file held while a merged LAS file is merged, replaced and recorded
+LOCK_SUFFIX = '.lock'
+
+
+class LasMergeLedger(object):
+    """The persistent record of the source files merged into the merged LAS files of a folder
+    """
+    def __init__(self, out_dir):
+        """Opens (creating if needed) the ledger of a folder
+        Args:
+            out_dir(str): the folder holding the merged LAS files
+        """
+        self.path = os.path.join(out_dir, LEDGER_FILE_NAME)
+        self.conn = sqlite3.connect(self.path, timeout=LEDGER_TIMEOUT)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS merged (" +
+                          "merged_name TEXT NOT NULL, source_path TEXT NOT NULL, merged_at REAL, " +
+                          "PRIMARY KEY (merged_name, source_path))")
+        self.conn.commit()
+
+    def close(self):
+        """Closes the ledger
+        """
+        self.conn.close()
+
+    def is_merged(self, merged_path, source_path):
+        """Returns whether a source file is already merged into a merged file
+        """
+        self._import_contents_file(merged_path)
+        cursor = self.conn.execute("SELECT 1 FROM merged WHERE merged_name=? AND source_path=?",
+                                   (os.path.basename(merged_path), source_path))
+        return cursor.fetchone() is not None
+
+    def record(self, merged_path, source_paths):
+        """Records source files as merged into a merged file
+        """
+        now = time.time()
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO merged VALUES (?, ?, ?)",
+                                  [(os.path.basename(merged_path), source_path, now)
+                                   for source_path in source_paths])
+
+    def _import_contents_file(self, merged_path):
+        """Moves the entries of the _contents.txt file that used to list the merged sources into
+           the ledger, the first time a merged file is looked up
+        """
+        contents_path = merged_path.replace(".las", "_contents.txt")
+        if not os.path.exists(contents_path):
+            return
+
+        with open(contents_path, 'r') as contents:
+            source_paths = [entry.strip() for entry in contents.readlines() if entry.strip()]
+        self.record(merged_path, source_paths)
+        os.remove(contents_path)
+        logging.info("Imported %s merged sources from %s", len(source_paths), contents_path)
+
+def merge_las(in_paths, out_path):
+    """Merges LAS files into one; the result is written next to out_path and then renamed over
+       it, so readers never see a partially merged file
+    Args:
+        in_paths(list): the LAS files to merge (out_path may be one of them)
+        out_path(str): the merged LAS file to write
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(out_path), suffix=".las")
+    os.close(fd)
+    try:
+        subprocess.check_call(['pdal', 'merge'] + list(in_paths) + [tmp_path])
+        os.rename(tmp_path, out_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+class MergeLock(object):
+    """An exclusive lock on a merged LAS file, shared by every extractor process on the
+       same file system through flock on a lock file next to it
+    """
+    def __init__(self, merged_path):
+        """Initializes the lock of a merged file
+        """
+        self.path = merged_path + LOCK_SUFFIX
+        self.lock_file = None
+
+    def __enter__(self):
+        self.lock_file = open(self.path, 'a')
+        fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+        self.lock_file.close()
+        self.lock_file = None
+
+class LasMerger(object):
+    """Clips the LAS files of a message into plot shards and merges the new shards of every
+       merged file once, when the message is done
+    """
+    def __init__(self):
+        """Initializes the merger
+        """
+        self.ledgers = {}               # folder -> LasMergeLedger
+        self.pending = OrderedDict()    # merged path -> [(source path, shard path)]
+
+    def _ledger(self, merged_path):
+        """Returns the ledger of the folder of a merged file
+        """
+        out_dir = os.path.dirname(merged_path)
+        if out_dir not in self.ledgers:
+            self.ledgers[out_dir] = LasMergeLedger(out_dir)
+        return self.ledgers[out_dir]
+
+    def add(self, source_path, tuples, shard_path, merged_path):
+        """Clips a source LAS file to a plot and queues the shard for merging, unless the
+           source is already merged
+        Args:
+            source_path(str): the LAS file to clip
+            tuples(tuple): the plot bounds, as returned by geojson_to_tuples_betydb
+            shard_path(str): the plot shard to write
+            merged_path(str): the merged LAS file of the plot
+        Return:
+            True if the source was clipped and queued
+        """
+        pending = self.pending.setdefault(merged_path, [])
+        if any(source == source_path for source, _ in pending) or \
+                self._ledger(merged_path).is_merged(merged_path, source_path):
+            return False
+
+        clip_las(source_path, tuples, out_path=shard_path)
+        pending.append((source_path, shard_path))
+        return True
+
+    def merge_all(self):
+        """Merges the queued shards into their merged files, one merge per merged file, and
+           records them in the ledgers. Each merged file is locked from reading it to recording
+           the merge, so extractors merging into the same file don't overwrite each other
+        Return:
+            The list of merged files written
+        """
+        written = []
+        for merged_path, pending in self.pending.items():
+            if not pending:
+                continue
+            with MergeLock(merged_path):
+                # Another extractor may have merged the same sources since they were queued
+                ledger = self._ledger(merged_path)
+                pending = [(source_path, shard_path) for source_path, shard_path in pending
+                           if not ledger.is_merged(merged_path, source_path)]
+                if not pending:
+                    continue
+                in_paths = [shard_path for _, shard_path in pending]
+                if os.path.exists(merged_path):
+                    in_paths.insert(0, merged_path)
+                merge_las(in_paths, merged_path)
+                ledger.record(merged_path, [source_path for source_path, _ in pending])
+            written.append(merged_path)
+
+        self.pending.clear()
+        return written
+
+    def close(self):
+        """Closes the ledgers
+        """
+        for ledger in self.ledgers.values():
+            ledger.close()
+        self.ledgers.clear()
@@ -0,0 +1,151 @@
+"""Cache of plot boundaries for the plot clipper
+
+Plot boundaries are looked up by date (they can change within a season), and every date
+is loaded once and kept in two tiers:
+  - in memory: the last few PlotIndex instances, with geometries already parsed
+    and reprojected, so a hit costs nothing
+  - on disk: the boundaries as returned by BETYdb (one JSON file per key), so a
+    restarted extractor doesn't query BETYdb again
+Entries of both tiers expire after a time to live.
+
+Setting the BETYDB_LOCAL_SITES environment variable to a JSON file of plot boundaries
+(see load_local_site_boundaries) replaces BETYdb altogether, for testing without a server.
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import tempfile
+
+from collections import OrderedDict
+
+from plot_index import PlotIndex
+
+# The name of the environment variable pointing at a local stand-in for BETYdb
+BETYDB_LOCAL_SITES_ENV_NAME = 'BETYDB_LOCAL_SITES'
+
+# Default time to live of cached boundaries, in seconds
+DEFAULT_TTL = 24 * 60 * 60
+
+# Default number of plot indexes kept in memory
+DEFAULT_MEMORY_ENTRIES = 8
+
+
+def load_local_site_boundaries(sites_path):
+    """Loads plot boundaries from a local file instead of BETYdb
+    Args:
+        sites_path(str): path to either a JSON object of plot names to geojson geometries (the
+                         format get_site_boundaries returns) or a GeoJSON FeatureCollection whose
+                         features have a 'sitename' property
+    Return:
+        A dict of plot names as keys with geojson geometries as the values
+    """
+    with open(sites_path, 'r') as in_file:
+        sites = json.load(in_file)
+
+    if sites.get('type') == 'FeatureCollection':
+        return {feature['properties']['sitename']: json.dumps(feature['geometry'])
+                for feature in sites['features']}
+
+    return {name: (json.dumps(geometry) if isinstance(geometry, dict) else geometry)
+            for name, geometry in sites.items()}
+
+class PlotBoundaryCache(object):
+    """Two tier (memory LRU and on-disk) cache of PlotIndex instances
+    """
+    def __init__(self, cache_dir=None, ttl=DEFAULT_TTL, memory_entries=DEFAULT_MEMORY_ENTRIES):
+        """Initializes the cache
+        Args:
+            cache_dir(str): folder for the on-disk tier; no on-disk tier if None
+            ttl(int): seconds after which an entry is loaded again
+            memory_entries(int): number of plot indexes kept in memory
+        """
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.memory_entries = memory_entries
+        self.entries = OrderedDict()    # key -> (load time, PlotIndex), least recently used first
+
+    @staticmethod
+    def make_key(season, datestamp, source, betydb_url, opts):
+        """Returns the cache key for a set of plot boundaries. BETYdb returns the boundaries
+           valid on a date, which may change within a season, so the date is part of the key
+        Args:
+            season(str): the season name
+            datestamp(str): the date the boundaries are valid on
+            source(str): where the boundaries come from ('terraref', 'experiment' or the path
+                         of the local stand-in)
+            betydb_url(str): the BETYdb instance queried
+            opts(dict): the options passed to get_site_boundaries
+        Return:
+            A string key
+        """
+        return json.dumps([season, datestamp, source, betydb_url, sorted(opts.items())])
+
+    def get(self, key, load_fn):
+        """Returns the PlotIndex for a key, loading the boundaries with load_fn on a miss
+        Args:
+            key(str): the key as returned by make_key
+            load_fn(function): called without arguments to get the plot boundaries
+                               (plot names as keys with geojson geometries as values)
+        Return:
+            The PlotIndex instance
+        """
+        now = time.time()
+
+        entry = self.entries.pop(key, None)
+        if entry is None or now - entry[0] > self.ttl:
+            all_plots, loaded = self._read_disk(key, now)
+            if all_plots is None:
+                all_plots, loaded = load_fn(), now
+                if not all_plots:
+                    # Nothing found (or BETYdb unavailable): don't keep that for a whole TTL
+                    return PlotIndex(all_plots, fullmac=True)
+                self._write_disk(key, all_plots, loaded)
+            entry = (loaded, PlotIndex(all_plots, fullmac=True))
+
+        self.entries[key] = entry
+        while len(self.entries) > self.memory_entries:
+            self.entries.popitem(last=False)
+
+        return entry[1]
+
+    def _disk_path(self, key):
+        """Returns the path of the on-disk entry of a key
+        """
+        return os.path.join(self.cache_dir, "plots_" + hashlib.sha1(key.encode('utf-8')).hexdigest() + ".json")
+
+    def _read_disk(self, key, now):
+        """Returns the boundaries and their load time from the on-disk tier, or (None, None)
+           if there is no unexpired entry
+        """
+        if not self.cache_dir:
+            return None, None
+
+        try:
+            with open(self._disk_path(key), 'r') as in_file:
+                cached = json.load(in_file)
+        except (IOError, OSError, ValueError):
+            return None, None
+
+        if cached.get('key') != key or now - cached.get('loaded', 0) > self.ttl:
+            return None, None
+        return cached['plots'], cached['loaded']
+
+    def _write_disk(self, key, all_plots, loaded):
+        """Writes an entry to the on-disk tier; the file is renamed into place so concurrent
+           extractors never read a partial entry
+        """
+        if not self.cache_dir:
+            return
+
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(fd, 'w') as out_file:
+                json.dump({'key': key, 'loaded': loaded, 'plots': all_plots}, out_file)
+            os.rename(tmp_path, self._disk_path(key))
+        except (IOError, OSError) as ex:
+            logging.warning("Unable to cache plot boundaries in %s: %s", self.cache_dir, str(ex))
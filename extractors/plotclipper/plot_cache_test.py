@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+'''
+Test for the plot boundary cache of the plot clipper
+
+The boundaries are read from a local stand-in for BETYdb (see BETYDB_LOCAL_SITES in
+plot_cache.py), so no server is needed. GDAL is required to build the plot indexes.
+
+==============================================================================
+To run the test from the commandline, do:
+python plot_cache_test.py
+==============================================================================
+'''
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+try:
+    from plot_cache import PlotBoundaryCache, load_local_site_boundaries
+except ImportError:
+    PlotBoundaryCache = None
+
+
+def plotGeometry(west, south, east, north):
+    '''
+    Returns a rectangular plot as a geojson geometry
+    '''
+    return {"type": "Polygon",
+            "coordinates": [[[west, south], [east, south], [east, north], [west, north], [west, south]]]}
+
+PLOTS = {"MAC Field Scanner Season 6 Range 1 Column 1": plotGeometry(0.0, 0.0, 1.0, 1.0),
+         "MAC Field Scanner Season 6 Range 1 Column 2": plotGeometry(1.0, 0.0, 2.0, 1.0),
+         "MAC Field Scanner Season 6 Range 2 Column 1": plotGeometry(0.0, 1.0, 1.0, 2.0)}
+
+
+@unittest.skipIf(PlotBoundaryCache is None, "GDAL is not installed")
+class PlotBoundaryCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempDirectory = tempfile.mkdtemp()
+        self.cacheDirectory = os.path.join(self.tempDirectory, "plot_cache")
+        self.sitesPath = os.path.join(self.tempDirectory, "sites.json")
+        self.loads = []
+
+        features = [{"type": "Feature", "properties": {"sitename": name}, "geometry": geometry}
+                    for name, geometry in PLOTS.items()]
+        with open(self.sitesPath, 'w') as sitesFile:
+            json.dump({"type": "FeatureCollection", "features": features}, sitesFile)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDirectory)
+
+    def loadSites(self):
+        self.loads.append(1)
+        return load_local_site_boundaries(self.sitesPath)
+
+    def getIndex(self, cache, datestamp, season="Season 6"):
+        return cache.get(PlotBoundaryCache.make_key(season, datestamp, self.sitesPath, None, {}), self.loadSites)
+
+    def test_canLoadFeatureCollectionAndPlainObject(self):
+        self.assertEqual(sorted(load_local_site_boundaries(self.sitesPath)), sorted(PLOTS))
+
+        plainPath = os.path.join(self.tempDirectory, "plain.json")
+        with open(plainPath, 'w') as plainFile:
+            json.dump(PLOTS, plainFile)
+        plainSites = load_local_site_boundaries(plainPath)
+        self.assertEqual(sorted(plainSites), sorted(PLOTS))
+        self.assertEqual(json.loads(plainSites["MAC Field Scanner Season 6 Range 1 Column 1"]),
+                         PLOTS["MAC Field Scanner Season 6 Range 1 Column 1"])
+
+    def test_canFindIntersectingPlots(self):
+        plotIndex = self.getIndex(PlotBoundaryCache(self.cacheDirectory), "2018-05-01")
+        boundingBox = json.dumps(plotGeometry(0.2, 0.2, 1.5, 0.8))
+        self.assertEqual(sorted(plotIndex.intersecting(boundingBox)),
+                         ["MAC Field Scanner Season 6 Range 1 Column 1", "MAC Field Scanner Season 6 Range 1 Column 2"])
+
+    def test_loadsBoundariesOncePerDate(self):
+        cache = PlotBoundaryCache(self.cacheDirectory)
+        self.getIndex(cache, "2018-05-01")
+        self.getIndex(cache, "2018-05-01")
+        self.assertEqual(len(self.loads), 1)
+
+        # Boundaries may change within a season
+        self.getIndex(cache, "2018-05-02")
+        self.assertEqual(len(self.loads), 2)
+
+    def test_sharesBoundariesOnDisk(self):
+        self.getIndex(PlotBoundaryCache(self.cacheDirectory), "2018-05-01")
+        plotIndex = self.getIndex(PlotBoundaryCache(self.cacheDirectory), "2018-05-01")
+        self.assertEqual(len(self.loads), 1)
+        self.assertEqual(sorted(plotIndex.all_plots), sorted(PLOTS))
+
+    def test_loadsExpiredBoundariesAgain(self):
+        cache = PlotBoundaryCache(self.cacheDirectory, ttl=-1)
+        self.getIndex(cache, "2018-05-01")
+        self.getIndex(cache, "2018-05-01")
+        self.assertEqual(len(self.loads), 2)
+
+    def test_doesNotCacheMissingBoundaries(self):
+        cache = PlotBoundaryCache(self.cacheDirectory)
+        key = PlotBoundaryCache.make_key("Season 6", "2018-05-01", self.sitesPath, None, {})
+        self.assertEqual(cache.get(key, lambda: {}).all_plots, {})
+        self.getIndex(cache, "2018-05-01")
+        self.assertEqual(len(self.loads), 1)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
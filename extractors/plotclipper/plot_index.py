@@ -0,0 +1,135 @@
+"""Spatial index over plot boundaries for the plot clipper
+"""
+
+import json
+import logging
+import yaml
+
+from osgeo import ogr, osr
+
+
+def _is_fullmac_plot(plotname):
+    """Returns whether a plot is a full Maricopa plot (not KSU, not an East or West partial plot)
+    Args:
+        plotname(str): the name of the plot
+    Return:
+        True if the plot is kept when only full plots are wanted
+    """
+    return plotname.find("KSU") < 0 and not plotname.endswith(" E") and not plotname.endswith(" W")
+
+def _geometry_from_json(geojson):
+    """Returns the ogr geometry of a geojson string
+    Args:
+        geojson(str): the geometry as geojson (as returned by BETYdb)
+    Return:
+        The ogr.Geometry or None if it couldn't be created
+    """
+    return ogr.CreateGeometryFromJson(json.dumps(yaml.safe_load(geojson)))
+
+class PlotIndex(object):
+    """Grid index over the envelopes of all plots. The plot geometries are parsed once; a
+       lookup only visits the grid cells a bounding box covers and runs the exact polygon
+       intersection on the plots found there.
+    """
+    def __init__(self, all_plots, fullmac=True):
+        """Builds the index
+        Args:
+            all_plots(dict): plot names as keys with geojson geometries as values (see load_all_plots)
+            fullmac(bool): only index full plots (omit KSU, omit E W partial plots)
+        """
+        self.all_plots = all_plots
+        self.spatial_ref = None
+        self.plots = []         # (plot name, ogr geometry, envelope) tuples
+        self.cells = {}         # (column, row) -> indexes into self.plots
+        self.cell_width = self.cell_height = 1.0
+        self.origin = (0.0, 0.0)
+        self.max_cell = (-1, -1)
+
+        for plotname in all_plots:
+            if fullmac and not _is_fullmac_plot(plotname):
+                continue
+
+            geometry = _geometry_from_json(all_plots[plotname])
+            if geometry is None:
+                logging.warning("Unable to load geometry of plot '%s'", plotname)
+                continue
+
+            # All plots are kept in the coordinate system of the first one
+            plot_ref = geometry.GetSpatialReference()
+            if self.spatial_ref is None:
+                self.spatial_ref = plot_ref
+            elif plot_ref and not plot_ref.IsSame(self.spatial_ref):
+                geometry.Transform(osr.CoordinateTransformation(plot_ref, self.spatial_ref))
+
+            self.plots.append((plotname, geometry, geometry.GetEnvelope()))
+
+        if self.plots:
+            self._build_grid()
+
+    def _build_grid(self):
+        """Places every plot envelope into the grid cells it covers. Cells are the size of
+           the median plot, so a plot covers a handful of cells.
+        """
+        widths = sorted(envelope[1] - envelope[0] for _, _, envelope in self.plots)
+        heights = sorted(envelope[3] - envelope[2] for _, _, envelope in self.plots)
+        self.cell_width = widths[len(widths) // 2] or 1.0
+        self.cell_height = heights[len(heights) // 2] or 1.0
+        self.origin = (min(envelope[0] for _, _, envelope in self.plots),
+                       min(envelope[2] for _, _, envelope in self.plots))
+
+        self.max_cell = (int((max(envelope[1] for _, _, envelope in self.plots) - self.origin[0]) // self.cell_width),
+                         int((max(envelope[3] for _, _, envelope in self.plots) - self.origin[1]) // self.cell_height))
+
+        for idx, (_, _, envelope) in enumerate(self.plots):
+            for cell in self._cells(envelope):
+                self.cells.setdefault(cell, []).append(idx)
+
+    def _cells(self, envelope):
+        """Returns the grid cells covered by an envelope, limited to the extent of the plots
+        Args:
+            envelope(tuple): (min x, max x, min y, max y)
+        Return:
+            Generator of (column, row) tuples
+        """
+        min_col = max(int((envelope[0] - self.origin[0]) // self.cell_width), 0)
+        max_col = min(int((envelope[1] - self.origin[0]) // self.cell_width), self.max_cell[0])
+        min_row = max(int((envelope[2] - self.origin[1]) // self.cell_height), 0)
+        max_row = min(int((envelope[3] - self.origin[1]) // self.cell_height), self.max_cell[1])
+        for col in range(min_col, max_col + 1):
+            for row in range(min_row, max_row + 1):
+                yield (col, row)
+
+    def intersecting(self, bounding_box):
+        """Returns the plots overlapping a bounding box; a drop-in replacement for
+           terrautils.spatial.find_plots_intersect_boundingbox on the indexed plots
+        Args:
+            bounding_box(str): the bounding box as geojson
+        Return:
+            A dict of plot names as keys with geojson geometries as the values
+        """
+        bbox_poly = ogr.CreateGeometryFromJson(str(bounding_box))
+        if bbox_poly is None or not self.plots:
+            return {}
+
+        # Look up in the coordinate system of the plots
+        bbox_ref = bbox_poly.GetSpatialReference()
+        if bbox_ref and self.spatial_ref and not bbox_ref.IsSame(self.spatial_ref):
+            bbox_poly = bbox_poly.Clone()
+            bbox_poly.Transform(osr.CoordinateTransformation(bbox_ref, self.spatial_ref))
+
+        envelope = bbox_poly.GetEnvelope()
+        candidates = set()
+        for cell in self._cells(envelope):
+            candidates.update(self.cells.get(cell, ()))
+
+        intersecting_plots = {}
+        for idx in sorted(candidates):
+            plotname, geometry, plot_envelope = self.plots[idx]
+            if plot_envelope[0] > envelope[1] or plot_envelope[1] < envelope[0] or \
+               plot_envelope[2] > envelope[3] or plot_envelope[3] < envelope[2]:
+                continue
+            intersection = bbox_poly.Intersection(geometry)
+            if intersection is not None and not intersection.IsEmpty():
+                intersecting_plots[plotname] = self.all_plots[plotname]
+
+        return intersecting_plots
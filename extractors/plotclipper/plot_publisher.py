@@ -0,0 +1,282 @@
+"""Publishing of plot outputs to Clowder for the plot clipper
+"""
+
+import time
+import logging
+import threading
+
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
+import pyclowder.files as clowder_file
+import pyclowder.utils
+
+from pyclowder.datasets import submit_extraction
+from terrautils.extractors import build_metadata, build_dataset_hierarchy_crawl, check_file_in_dataset, \
+     upload_to_dataset, get_datasetid_by_name
+
+# The number of uploads (and dataset lookups) running at the same time
+DEFAULT_UPLOAD_THREADS = 4
+
+# Seconds a leaf dataset ID is cached, and the number of IDs cached
+DEFAULT_DATASET_TTL = 60 * 60
+DEFAULT_DATASET_ENTRIES = 10000
+
+
+def _is_not_found(ex):
+    """Returns whether an exception is a Clowder API 404 response
+    """
+    response = getattr(ex, 'response', None)
+    return response is not None and getattr(response, 'status_code', None) == 404
+
+class UploadError(RuntimeError):
+    """Raised once a message's uploads are done if any of them failed
+    """
+    pass
+
+class DatasetIdCache(object):
+    """Leaf dataset names to Clowder IDs, kept between messages: entries expire after a time
+       to live, the least recently used are dropped beyond a number of entries, and an entry
+       is evicted when its dataset turns out to be gone
+    """
+    def __init__(self, ttl=DEFAULT_DATASET_TTL, max_entries=DEFAULT_DATASET_ENTRIES):
+        """Initializes the cache
+        Args:
+            ttl(int): seconds after which an ID is looked up again
+            max_entries(int): the number of IDs kept
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()    # leaf dataset name -> (time cached, ID), least recently used first
+        self.lock = threading.Lock()
+
+    def get(self, leaf_name):
+        """Returns the cached ID of a dataset, or None if it isn't cached or expired
+        """
+        with self.lock:
+            entry = self.entries.pop(leaf_name, None)
+            if entry is None or time.time() - entry[0] > self.ttl:
+                return None
+            self.entries[leaf_name] = entry
+            return entry[1]
+
+    def set(self, leaf_name, dsid):
+        """Caches the ID of a dataset
+        """
+        with self.lock:
+            self.entries.pop(leaf_name, None)
+            self.entries[leaf_name] = (time.time(), dsid)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def evict(self, leaf_name):
+        """Drops the ID of a dataset, e.g. after it was deleted
+        """
+        with self.lock:
+            self.entries.pop(leaf_name, None)
+
+
+class PlotPublisher(object):
+    """Collects the outputs of one message by plot dataset and publishes them in three steps:
+       every leaf dataset is resolved once (from a cache shared between messages, or with one
+       lookup and, if missing, one hierarchy crawl), files and their metadata are uploaded by a
+       bounded pool of threads, and extractions are submitted once per dataset
+    """
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, extractor, connector, host, secret_key, dataset_ids, threads=DEFAULT_UPLOAD_THREADS):
+        """Initializes the publisher
+        Args:
+            extractor(TerrarefExtractor): the extractor publishing (Clowder credentials, overwrite flag)
+            connector(obj): the message queue connector instance
+            host(str): the URI of the Clowder host
+            secret_key(str): used with the host API
+            dataset_ids(DatasetIdCache): cache of leaf dataset IDs, kept between messages
+            threads(int): the number of uploads running at the same time
+        """
+        self.extractor = extractor
+        self.connector = connector
+        self.host = host
+        self.secret_key = secret_key
+        self.dataset_ids = dataset_ids
+        self.threads = threads
+
+        self.hierarchies = OrderedDict()    # leaf dataset name -> hierarchy tuple
+        self.files = OrderedDict()          # (leaf dataset name, path) -> file metadata content or None
+        self.extractions = OrderedDict()    # (leaf dataset name, extractor name) -> None
+        self.resolved = {}                  # leaf dataset name -> ID used for this message
+        self.new_dataset_fn = None
+        self.resolve_lock = threading.Lock()
+        self.errors = []
+
+    def add_file(self, hierarchy, path, content=None):
+        """Queues a file for upload to a plot dataset
+        Args:
+            hierarchy(tuple): (season, experiment, plot display name, year, month, day, leaf dataset name)
+            path(str): the file to upload
+            content(dict): file metadata content to upload with the file, if any
+        Return:
+            True if the file wasn't queued for this dataset already
+        """
+        leaf_name = hierarchy[-1]
+        self.hierarchies[leaf_name] = hierarchy
+        if (leaf_name, path) in self.files:
+            return False
+        self.files[(leaf_name, path)] = content
+        return True
+
+    def add_extraction(self, hierarchy, extractor_name):
+        """Queues an extraction to submit on a plot dataset once its files are uploaded
+        Args:
+            hierarchy(tuple): as for add_file
+            extractor_name(str): the name of the extractor to submit the dataset to
+        """
+        self.hierarchies[hierarchy[-1]] = hierarchy
+        self.extractions[(hierarchy[-1], extractor_name)] = None
+
+    def resolve_datasets(self, new_dataset_fn=None):
+        """Finds or creates every leaf dataset with queued work. Names not in the cache are
+           looked up concurrently; the missing ones are then created one at a time, as their
+           hierarchies share parent collections
+        Args:
+            new_dataset_fn(function): called with the ID of every dataset created (or, when
+                                      overwriting, of every dataset found or cached)
+        """
+        self.new_dataset_fn = new_dataset_fn
+        overwrite = self.extractor.overwrite_ok
+        unknown = []
+        for leaf_name in self.hierarchies:
+            dsid = self.dataset_ids.get(leaf_name)
+            if dsid:
+                if overwrite and new_dataset_fn:
+                    new_dataset_fn(dsid)
+                self.resolved[leaf_name] = dsid
+            else:
+                unknown.append(leaf_name)
+
+        if unknown:
+            pool = ThreadPool(max(1, min(self.threads, len(unknown))))
+            try:
+                found = pool.map(lambda leaf_name: get_datasetid_by_name(self.host, self.secret_key, leaf_name), unknown)
+            finally:
+                pool.close()
+                pool.join()
+
+            for leaf_name, dsid in zip(unknown, found):
+                self._resolve(leaf_name, dsid)
+
+    def _resolve(self, leaf_name, dsid=None):
+        """Creates a leaf dataset if it wasn't found and caches its ID
+        Args:
+            leaf_name(str): the name of the leaf dataset
+            dsid(str): the ID the dataset was found with, None if it wasn't found
+        Return:
+            The dataset ID
+        """
+        if not dsid:
+            season, experiment, plot_display_name, year, month, day, _ = self.hierarchies[leaf_name]
+            dsid = build_dataset_hierarchy_crawl(self.host, self.secret_key, self.extractor.clowder_user,
+                                                 self.extractor.clowder_pass, self.extractor.clowderspace,
+                                                 season, experiment, plot_display_name, year, month, day,
+                                                 leaf_ds_name=leaf_name)
+            if self.new_dataset_fn:
+                self.new_dataset_fn(dsid)
+        elif self.extractor.overwrite_ok and self.new_dataset_fn:
+            self.new_dataset_fn(dsid)
+        self.dataset_ids.set(leaf_name, dsid)
+        self.resolved[leaf_name] = dsid
+        return dsid
+
+    def _resolve_again(self, leaf_name, stale_dsid):
+        """Looks up (or creates) a leaf dataset whose cached ID turned out to be gone; the
+           uploads to the same dataset share the result
+        Return:
+            The new dataset ID
+        """
+        with self.resolve_lock:
+            if self.resolved.get(leaf_name) != stale_dsid:
+                return self.resolved[leaf_name]
+            logging.info("Dataset %s of %s is gone; looking it up again", stale_dsid, leaf_name)
+            self.dataset_ids.evict(leaf_name)
+            return self._resolve(leaf_name, get_datasetid_by_name(self.host, self.secret_key, leaf_name))
+
+    def _upload(self, task):
+        """Uploads one file and its metadata; runs on the upload threads. If the dataset is
+           gone (deleted since its ID was cached) it is resolved again and the upload retried
+        Return:
+            The Clowder file ID, None if the file was already in the dataset or failed
+        """
+        (leaf_name, path), content = task
+        dsid = self.resolved[leaf_name]
+        try:
+            try:
+                return self._upload_to(dsid, path, content)
+            except Exception as ex:     # pylint: disable=broad-except
+                if not _is_not_found(ex):
+                    raise
+                return self._upload_to(self._resolve_again(leaf_name, dsid), path, content)
+        except Exception as ex:     # pylint: disable=broad-except
+            self.errors.append("%s: %s" % (path, str(ex)))
+            return None
+
+    def _upload_to(self, dsid, path, content):
+        """Uploads one file and its metadata to a dataset
+        Return:
+            The Clowder file ID, None if the file was already in the dataset
+        """
+        overwrite = self.extractor.overwrite_ok
+        found_in_dest = check_file_in_dataset(self.connector, self.host, self.secret_key, dsid, path,
+                                              remove=overwrite)
+        if found_in_dest and not overwrite:
+            return None
+
+        fileid = upload_to_dataset(self.connector, self.host, self.extractor.clowder_user,
+                                   self.extractor.clowder_pass, dsid, path)
+        if content is not None:
+            meta = build_metadata(self.host, self.extractor.extractor_info, fileid, content, 'file')
+            clowder_file.upload_metadata(self.connector, self.host, self.secret_key, fileid, meta)
+        return fileid
+
+    def publish(self, new_dataset_fn=None):
+        """Resolves the datasets, uploads the queued files and submits the queued extractions
+        Args:
+            new_dataset_fn(function): see resolve_datasets
+        Return:
+            The list of URLs of the uploaded files
+        Exceptions:
+            UploadError is raised after the extractions are submitted if any upload failed
+        """
+        self.resolve_datasets(new_dataset_fn)
+
+        uploaded_file_ids = []
+        if self.files:
+            pool = ThreadPool(max(1, min(self.threads, len(self.files))))
+            try:
+                for fileid in pool.imap(self._upload, self.files.items()):
+                    if fileid:
+                        uploaded_file_ids.append(self.host + ("" if self.host.endswith("/") else "/") +
+                                                 "files/" + fileid)
+            finally:
+                pool.close()
+                pool.join()
+
+        for leaf_name, extractor_name in self.extractions:
+            submit_extraction(self.connector, self.host, self.secret_key, self.resolved[leaf_name],
+                              extractor_name)
+
+        if self.errors:
+            for error in self.errors:
+                logging.error("Failed to upload %s", error)
+            raise UploadError("%s of %s uploads to plot datasets failed; first: %s" %
+                               (len(self.errors), len(self.files), self.errors[0]))
+
+        return uploaded_file_ids
+
+    def summarize(self, resource, uploaded_file_ids):
+        """Sends the one status update of the message
+        Args:
+            resource(dict): the resource of the message
+            uploaded_file_ids(list): as returned by publish
+        """
+        message = "Uploaded %s files to %s plot datasets" % (len(uploaded_file_ids), len(self.hierarchies))
+        self.connector.status_update(pyclowder.utils.StatusMessage.processing,
+                                     {"type": "dataset", "id": resource['id']}, message)
@@ -0,0 +1,149 @@
+"""Clipping of one raster into many plot shards for the plot clipper
+"""
+
+import os
+import logging
+import threading
+import multiprocessing
+
+from math import ceil, floor
+from multiprocessing.pool import ThreadPool
+
+from osgeo import gdal
+
+# The number of shards written at the same time (GDAL releases the GIL while writing)
+DEFAULT_CLIP_THREADS = min(multiprocessing.cpu_count(), 8)
+
+
+def _plot_window(geotransform, bounds, raster_size):
+    """Returns the pixel window of a plot, limited to the raster, the way gdal_translate -projwin
+       rounds it
+    Args:
+        geotransform(tuple): the north-up geotransform of the raster
+        bounds(tuple): the plot bounds (min y, max y, min x, max x) in the raster coordinate system
+        raster_size(tuple): the (columns, rows) of the raster
+    Return:
+        The (x offset, y offset, x end, y end) of the window or None if it is outside the raster
+    """
+    x_off = int(floor((bounds[2] - geotransform[0]) / geotransform[1] + 0.001))
+    x_end = int(ceil((bounds[3] - geotransform[0]) / geotransform[1] - 0.001))
+    y_off = int(floor((bounds[1] - geotransform[3]) / geotransform[5] + 0.001))
+    y_end = int(ceil((bounds[0] - geotransform[3]) / geotransform[5] - 0.001))
+
+    x_off, y_off = max(x_off, 0), max(y_off, 0)
+    x_end, y_end = min(x_end, raster_size[0]), min(y_end, raster_size[1])
+    if x_off >= x_end or y_off >= y_end:
+        return None
+    return (x_off, y_off, x_end, y_end)
+
+def _shard_data_type(band_types):
+    """Returns the data type of the shards: GeoTIFF bands all share one type, so bands of
+       different types are written with a type that holds the values of all of them
+    Args:
+        band_types(list): the GDAL data type of every band
+    Return:
+        The GDAL data type
+    """
+    data_type = band_types[0]
+    for band_type in band_types[1:]:
+        data_type = gdal.DataTypeUnion(data_type, band_type)
+    return data_type
+
+def clip_raster_to_plots(rast_path, plot_bounds, compress=True, threads=DEFAULT_CLIP_THREADS):
+    """Clips a raster into one file per plot. The raster is opened once; the window of every
+       plot is read from it on its own (so only the plots being written are in memory) and the
+       shards are written in parallel
+    Args:
+        rast_path(str): path to the raster to clip
+        plot_bounds(dict): output paths as keys with plot bounds (min y, max y, min x, max x),
+                           as returned by geojson_to_tuples_betydb, as values
+        compress(bool): write the shards LZW compressed
+        threads(int): the number of shards written at the same time
+    Return:
+        The list of output paths written
+    """
+    if not plot_bounds:
+        return []
+
+    src = gdal.Open(rast_path)
+    if src is None:
+        raise RuntimeError("Unable to open raster " + rast_path)
+
+    options = ['COMPRESS=LZW'] if compress else []
+    geotransform = src.GetGeoTransform()
+
+    if geotransform[2] != 0 or geotransform[4] != 0:
+        # Rotated rasters are clipped one plot at a time, still from the single open dataset
+        logging.debug("Raster %s is not north-up; clipping plots one at a time", rast_path)
+        written = []
+        for out_path, bounds in plot_bounds.items():
+            dst = gdal.Translate(out_path, src, projWin=[bounds[2], bounds[1], bounds[3], bounds[0]],
+                                 creationOptions=options)
+            if dst is None:
+                logging.warning("Unable to clip %s to %s", rast_path, out_path)
+                continue
+            dst = None      # Closing the dataset writes it
+            written.append(out_path)
+        return written
+
+    raster_size = (src.RasterXSize, src.RasterYSize)
+    windows = {}
+    for out_path, bounds in plot_bounds.items():
+        window = _plot_window(geotransform, bounds, raster_size)
+        if window is None:
+            logging.debug("Plot for %s is outside of %s", out_path, rast_path)
+        else:
+            windows[out_path] = window
+    if not windows:
+        return []
+
+    bands = []
+    for band_idx in range(1, src.RasterCount + 1):
+        band = src.GetRasterBand(band_idx)
+        color_table = band.GetRasterColorTable()
+        bands.append((band.DataType, band.GetNoDataValue(), color_table.Clone() if color_table else None,
+                      band.GetColorInterpretation()))
+    data_type = _shard_data_type([band[0] for band in bands])
+    projection = src.GetProjection()
+
+    # A GDAL dataset can't be read from several threads at once
+    read_lock = threading.Lock()
+
+    def write_shard(out_path):
+        """Reads the window of one plot, every band in its own data type, and writes its shard
+        """
+        x_off, y_off, x_end, y_end = windows[out_path]
+        with read_lock:
+            shard = [src.GetRasterBand(band_idx + 1).ReadAsArray(x_off, y_off, x_end - x_off, y_end - y_off)
+                     for band_idx in range(len(bands))]
+
+        out_dir = os.path.dirname(out_path)
+        if out_dir and not os.path.isdir(out_dir):
+            try:
+                os.makedirs(out_dir)
+            except OSError:
+                pass    # Created by another thread
+
+        dst = gdal.GetDriverByName('GTiff').Create(out_path, x_end - x_off, y_end - y_off, len(bands),
+                                                   data_type, options)
+        dst.SetGeoTransform((geotransform[0] + x_off * geotransform[1], geotransform[1], 0,
+                             geotransform[3] + y_off * geotransform[5], 0, geotransform[5]))
+        dst.SetProjection(projection)
+        for band_idx, (_, nodata, color_table, color_interp) in enumerate(bands):
+            dst_band = dst.GetRasterBand(band_idx + 1)
+            dst_band.WriteArray(shard[band_idx])
+            dst_band.SetColorInterpretation(color_interp)
+            if nodata is not None:
+                dst_band.SetNoDataValue(nodata)
+            if color_table:
+                dst_band.SetRasterColorTable(color_table)
+        dst = None      # Closing the dataset writes (and compresses) it
+        return out_path
+
+    pool = ThreadPool(max(1, min(threads, len(windows))))
+    try:
+        return pool.map(write_shard, sorted(windows))
+    finally:
+        pool.close()
+        pool.join()
+        src = None
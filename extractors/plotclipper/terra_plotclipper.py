@@ -13,21 +13,24 @@ import osr
 from osgeo import ogr
 from numpy import nan
 
-import pyclowder.files as clowder_file
 import pyclowder.datasets as clowder_dataset
-import pyclowder.utils
 
 from pyclowder.utils import CheckMessage
-from pyclowder.datasets import upload_metadata, remove_metadata, submit_extraction
+from pyclowder.datasets import upload_metadata, remove_metadata
 from terrautils.extractors import TerrarefExtractor, confirm_clowder_info, \
-     build_metadata, build_dataset_hierarchy_crawl, file_exists, check_file_in_dataset, \
-     timestamp_to_terraref, file_filtered_in, upload_to_dataset, get_datasetid_by_name
+     build_metadata, file_exists, timestamp_to_terraref, file_filtered_in
 from terrautils.betydb import get_site_boundaries
-from terrautils.spatial import geojson_to_tuples_betydb, find_plots_intersect_boundingbox, \
-     get_las_extents, clip_raster, clip_las, convert_json_geometry, geometry_to_geojson
+from terrautils.spatial import geojson_to_tuples_betydb, \
+     get_las_extents, convert_json_geometry, geometry_to_geojson
 from terrautils.metadata import prepare_pipeline_metadata
 from terrautils.imagefile import file_is_image_type, image_get_geobounds, get_epsg
 
+from plot_cache import PlotBoundaryCache, BETYDB_LOCAL_SITES_ENV_NAME, DEFAULT_TTL, \
+     load_local_site_boundaries
+from raster_clipper import clip_raster_to_plots
+from plot_publisher import PlotPublisher, DatasetIdCache, UploadError
+from las_merger import LasMerger
+
 # The name of the BETYdb URL environment variable
 BETYDB_URL_ENV_NAME = 'BETYDB_URL'
 
@@ -154,16 +157,32 @@ class PlotClipper(TerrarefExtractor):
 
         # Our default values
         identify_binary = os.getenv('IDENTIFY_BINARY', '/usr/bin/identify')
+        plot_cache_dir = os.getenv('PLOT_CACHE_DIR', '/home/extractor/sites/plot_cache')
+        plot_cache_ttl = int(os.getenv('PLOT_CACHE_TTL', DEFAULT_TTL))
 
         # Add any additional arguments to parser
         self.parser.add_argument('--identify-binary', nargs='?', dest='identify_binary',
                                  default=identify_binary,
                                  help='Identify executable used to for image type capture ' +
                                  '(default=' + identify_binary + ')')
+        self.parser.add_argument('--plot-cache-dir', nargs='?', dest='plot_cache_dir',
+                                 default=plot_cache_dir,
+                                 help='Folder caching plot boundaries between runs, empty to disable ' +
+                                 '(default=' + plot_cache_dir + ')')
+        self.parser.add_argument('--plot-cache-ttl', type=int, dest='plot_cache_ttl',
+                                 default=plot_cache_ttl,
+                                 help='Seconds cached plot boundaries are used before querying BETYdb again ' +
+                                 '(default=' + str(plot_cache_ttl) + ')')
 
         # parse command line and load default logging configuration
         self.setup(sensor='plotclipper')
 
+        # Plot indexes by season and BETYdb configuration
+        self.plot_cache = PlotBoundaryCache(self.args.plot_cache_dir or None, self.args.plot_cache_ttl)
+
+        # Plot dataset IDs by name, so each is looked up in Clowder only once
+        self.leaf_dataset_ids = DatasetIdCache()
+
     # List of file extensions we will probably see that we don't need to check for being
     # an image type
     @property
@@ -233,6 +252,27 @@ class PlotClipper(TerrarefExtractor):
         # Return what we've found
         return found_files
 
+    def get_betydb_opts(self):
+        """Returns the BETYdb query options configured for this extractor in the
+           experiment metadata
+        Returns:
+            A dict of the options to pass to get_site_boundaries
+        """
+        opts = {}
+        if self.experiment_metadata and 'extractors' in self.experiment_metadata:
+            extractor_json = self.experiment_metadata['extractors']
+            if self.sensor_name in extractor_json:
+                if 'betydb_opts' in extractor_json[self.sensor_name]:
+                    opts_list = extractor_json[self.sensor_name]['betydb_opts'].split(',')
+                    for one_opt in opts_list:
+                        idx = one_opt.find('=')
+                        if idx < 0:
+                            opts[one_opt] = ''
+                        elif idx > 0:
+                            opts[one_opt[0:idx]] = one_opt[idx+1:]
+                        # We ignore any options starting with '='
+        return opts
+
     def load_all_plots(self, datestamp):
         """Loads all the plots as requested from the appropriate source
         Args:
@@ -240,29 +280,43 @@ class PlotClipper(TerrarefExtractor):
         Returns:
             A dict of plot names as keys with geometries as the values
         """
+        # A local stand-in for BETYdb overrides everything else
+        local_sites = os.environ.get(BETYDB_LOCAL_SITES_ENV_NAME)
+        if local_sites:
+            return load_local_site_boundaries(local_sites)
+
         # Handle TERRA REF first
         if self.terraref_metadata:
             return get_site_boundaries(datestamp, city='Maricopa')
 
         # Look for configured site information
         if self.experiment_metadata:
-            opts = {}
-            if 'extractors' in self.experiment_metadata:
-                extractor_json = self.experiment_metadata['extractors']
-                if self.sensor_name in extractor_json:
-                    if 'betydb_opts' in extractor_json[self.sensor_name]:
-                        opts_list = extractor_json[self.sensor_name]['betydb_opts'].split(',')
-                        for one_opt in opts_list:
-                            idx = one_opt.find('=')
-                            if idx < 0:
-                                opts[one_opt] = ''
-                            elif idx > 0:
-                                opts[one_opt[0:idx]] = one_opt[idx+1:]
-                            # We ignore any options starting with '='
-            return get_site_boundaries(datestamp, **opts)
+            return get_site_boundaries(datestamp, **self.get_betydb_opts())
 
         return {}
 
+    def get_plot_index(self, datestamp, season_name):
+        """Returns the spatial index over the plots valid on a date. The plots are loaded with
+           load_all_plots once per date and cached in memory and on disk for later messages
+           with the same BETYdb configuration
+        Args:
+            datestamp(str): The date to use in TERRA REF format
+            season_name(str): The name of the season the date belongs to
+        Returns:
+            The PlotIndex instance
+        """
+        local_sites = os.environ.get(BETYDB_LOCAL_SITES_ENV_NAME)
+        if local_sites:
+            source = local_sites
+        elif self.terraref_metadata:
+            source = 'terraref'
+        else:
+            source = 'experiment'
+        cache_key = self.plot_cache.make_key(season_name, datestamp, source, os.environ.get(BETYDB_URL_ENV_NAME),
+                                             self.get_betydb_opts())
+
+        return self.plot_cache.get(cache_key, lambda: self.load_all_plots(datestamp))
+
     # pylint: disable=too-many-arguments
     def update_dataset_extractor_metadata(self, connector, host, key, dsid, metadata,\
                                           extractor_name):
@@ -355,9 +409,11 @@ class PlotClipper(TerrarefExtractor):
             else:
                 target_scan = ""
 
-            all_plots = self.load_all_plots(datestamp)
+            plot_index = self.get_plot_index(datestamp, season_name)
             file_filters = self.get_file_filters()
-            uploaded_file_ids = []
+            publisher = PlotPublisher(self, connector, host, secret_key, self.leaf_dataset_ids)
+            las_merger = LasMerger()
+            merged_files = []
 
             for filename in files_to_process:
 
@@ -370,16 +426,31 @@ class PlotClipper(TerrarefExtractor):
                 file_bounds = files_to_process[filename]["bounds"]
                 sensor_name = files_to_process[filename]["sensor"]
 
-                overlap_plots = find_plots_intersect_boundingbox(file_bounds, all_plots, fullmac=True)
+                overlap_plots = plot_index.intersecting(file_bounds)
                 num_plots = len(overlap_plots)
 
                 if num_plots > 0:
                     self.log_info(resource, "Attempting to clip %s into %s plot shards" % \
                                                                                 (filename, len(overlap_plots)))
                     file_spatial_ref = get_spatial_reference_from_json(file_bounds)
+                    plot_tuples = {}
+                    out_files = {}
                     for plotname in overlap_plots:
                         plot_bounds = convert_json_geometry(overlap_plots[plotname], file_spatial_ref)
-                        tuples = geojson_to_tuples_betydb(yaml.safe_load(plot_bounds))
+                        plot_tuples[plotname] = geojson_to_tuples_betydb(yaml.safe_load(plot_bounds))
+                        out_files[plotname] = self.sensors.create_sensor_path(timestamp, plot=plotname,
+                                                                              subsensor=sensor_name,
+                                                                              filename=filename)
+
+                    # If file is a geoTIFF, clip all the plots from one read of the image
+                    clipped_files = set()
+                    if filename.endswith(".tif"):
+                        clip_bounds = {out_files[plotname]: plot_tuples[plotname] for plotname in overlap_plots
+                                       if not file_exists(out_files[plotname]) or self.overwrite_ok}
+                        clipped_files.update(clip_raster_to_plots(file_path, clip_bounds, compress=True))
+
+                    for plotname in overlap_plots:
+                        tuples = plot_tuples[plotname]
 
                         plot_display_name = self.sensors.get_display_name(sensor=sensor_name) + " (By Plot)"
                         leaf_dataset = plot_display_name + ' - ' + plotname + " - " + datestamp
@@ -387,93 +458,60 @@ class PlotClipper(TerrarefExtractor):
                                                             (season_name, experiment_name, plot_display_name,
                                                              timestamp[:4], timestamp[5:7], timestamp[8:10],
                                                              leaf_dataset))
-                        ds_exists = get_datasetid_by_name(host, secret_key, leaf_dataset)
-                        target_dsid = build_dataset_hierarchy_crawl(host, secret_key, self.clowder_user,
-                                                                    self.clowder_pass, self.clowderspace, season_name,
-                                                                    experiment_name, plot_display_name, timestamp[:4],
-                                                                    timestamp[5:7], timestamp[8:10],
-                                                                    leaf_ds_name=leaf_dataset)
-                        if (self.overwrite_ok or not ds_exists) and self.experiment_metadata:
-                            self.update_dataset_extractor_metadata(connector, host, secret_key,
-                                                                   target_dsid,
-                                                                   prepare_pipeline_metadata(self.experiment_metadata),
-                                                                   self.extractor_info['name'])
-
-                        out_file = self.sensors.create_sensor_path(timestamp, plot=plotname, subsensor=sensor_name,
-                                                                   filename=filename)
+                        hierarchy = (season_name, experiment_name, plot_display_name,
+                                     timestamp[:4], timestamp[5:7], timestamp[8:10], leaf_dataset)
+
+                        out_file = out_files[plotname]
                         if not os.path.exists(os.path.dirname(out_file)):
                             os.makedirs(os.path.dirname(out_file))
 
-                        if filename.endswith(".tif") and (not file_exists(out_file) or self.overwrite_ok):
-                            # If file is a geoTIFF, simply clip it and upload it to Clowder
-                            clip_raster(file_path, tuples, out_path=out_file, compress=True)
-
-                            found_in_dest = check_file_in_dataset(connector, host, secret_key, target_dsid, out_file,
-                                                                  remove=self.overwrite_ok)
-                            if not found_in_dest or self.overwrite_ok:
-                                content = {
-                                    "comment": "Clipped from image file '" + filename + "'"
-                                }
-                                if filename in image_ids:
-                                    content['imageFileId'] = image_ids[filename]
-                                fileid = upload_to_dataset(connector, host, self.clowder_user, self.clowder_pass, \
-                                                           target_dsid, out_file)
-                                meta = build_metadata(host, self.extractor_info, fileid, content, 'file')
-                                clowder_file.upload_metadata(connector, host, secret_key, fileid, meta)
-                                uploaded_file_ids.append(host + ("" if host.endswith("/") else "/") + "files/" + fileid)
-                                connector.status_update(pyclowder.utils.StatusMessage.done, \
-                                                        {"type": "file", "id": fileid}, "Done uploading file")
-                                connector.status_update(pyclowder.utils.StatusMessage.done, \
-                                                        {"type": "dataset", "id": target_dsid}, "Done updating dataset")
+                        if filename.endswith(".tif") and out_file in clipped_files:
+                            # If file is a geoTIFF, upload the clipped shard to Clowder
+                            content = {
+                                "comment": "Clipped from image file '" + filename + "'"
+                            }
+                            if filename in image_ids:
+                                content['imageFileId'] = image_ids[filename]
+                            publisher.add_file(hierarchy, out_file, content)
                             self.created += 1
                             self.bytes += os.path.getsize(out_file)
 
                         elif filename.endswith(".las"):
                             # If file is LAS, we can merge with any existing scan+plot output safely
                             merged_out = os.path.join(os.path.dirname(out_file), target_scan+"_merged.las")
-                            merged_txt = merged_out.replace(".las", "_contents.txt")
-
-                            already_merged = False
-                            if os.path.exists(merged_txt):
-                                # Check if contents
-                                with open(merged_txt, 'r') as contents:
-                                    for entry in contents.readlines():
-                                        if entry.strip() == file_path:
-                                            already_merged = True
-                                            break
-                            if not already_merged:
-                                clip_las(file_path, tuples, out_path=out_file, merged_path=merged_out)
-                                with open(merged_txt, 'a') as contents:
-                                    contents.write(file_path+"\n")
+                            las_merger.add(file_path, tuples, out_file, merged_out)
 
                             # Upload the individual plot shards for optimizing las2height later
-                            found_in_dest = check_file_in_dataset(connector, host, secret_key, target_dsid, out_file,
-                                                                  remove=self.overwrite_ok)
-                            if not found_in_dest or self.overwrite_ok:
-                                fileid = upload_to_dataset(connector, host, self.clowder_user, self.clowder_pass, \
-                                                           target_dsid, out_file)
-                                uploaded_file_ids.append(host + ("" if host.endswith("/") else "/") + "files/" + fileid)
-                                connector.status_update(pyclowder.utils.StatusMessage.done, \
-                                                        {"type": "file", "id": fileid}, "Done uploading file")
+                            publisher.add_file(hierarchy, out_file)
                             self.created += 1
                             self.bytes += os.path.getsize(out_file)
 
-                            # Upload the merged result if necessary
-                            found_in_dest = check_file_in_dataset(connector, host, secret_key, target_dsid, merged_out,
-                                                                  remove=self.overwrite_ok)
-                            if not found_in_dest or self.overwrite_ok:
-                                fileid = upload_to_dataset(connector, host, self.clowder_user, self.clowder_pass, \
-                                                           target_dsid, merged_out)
-                                uploaded_file_ids.append(host + ("" if host.endswith("/") else "/") + "files/" + fileid)
-                                connector.status_update(pyclowder.utils.StatusMessage.done, \
-                                                        {"type": "file", "id": fileid}, "Done uploading file")
-                            self.created += 1
-                            self.bytes += os.path.getsize(merged_out)
-                            connector.status_update(pyclowder.utils.StatusMessage.done, \
-                                                    {"type": "dataset", "id": target_dsid}, "Done updating dataset")
+                            # Upload the merged result once all shards of the message are merged
+                            if publisher.add_file(hierarchy, merged_out):
+                                merged_files.append(merged_out)
 
                             # Trigger las2height extractor
-                            submit_extraction(connector, host, secret_key, target_dsid, "terra.3dscanner.las2height")
+                            publisher.add_extraction(hierarchy, "terra.3dscanner.las2height")
+
+            # Merge the new LAS shards of every plot in one pass
+            try:
+                las_merger.merge_all()
+            finally:
+                las_merger.close()
+            for merged_out in merged_files:
+                self.created += 1
+                self.bytes += os.path.getsize(merged_out)
+
+            # Resolve all plot datasets, upload to them and report once for the whole message
+            def new_plot_dataset(target_dsid):
+                """Adds the pipeline metadata to a newly created (or overwritten) plot dataset
+                """
+                if self.experiment_metadata:
+                    self.update_dataset_extractor_metadata(connector, host, secret_key, target_dsid,
+                                                           prepare_pipeline_metadata(self.experiment_metadata),
+                                                           self.extractor_info['name'])
+            uploaded_file_ids = publisher.publish(new_plot_dataset)
+            publisher.summarize(resource, uploaded_file_ids)
 
             # Tell Clowder this is completed so subsequent file updates don't daisy-chain
             try:
@@ -488,6 +526,10 @@ class PlotClipper(TerrarefExtractor):
                 upload_metadata(connector, host, secret_key, resource['id'], extractor_md)
             except Exception as ex:     # pylint: disable=broad-except
                 self.log_error(resource, "Exception updating dataset metadata: " + str(ex))
+        except UploadError as ex:
+            # Let the failed message be reported (and retried) instead of marked completed
+            self.log_error(resource, "Exception uploading plot files: " + str(ex))
+            raise
         except Exception as ex:     # pylint: disable=broad-except
             self.log_error(resource, "Exception processing request: " + str(ex))
         finally:
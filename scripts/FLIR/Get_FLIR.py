@@ -5,12 +5,20 @@ Created on Aug 23, 2016
 '''
 
 import os, json, sys
+import argparse
 import multiprocessing
+try:
+    from os import scandir
+except ImportError:
+    from scandir import scandir # Python 2: pip install scandir
 from glob import glob
 import numpy as np
 from PIL import Image
 from math import cos, pi
 from osgeo import gdal, osr
+from flir_raster import map_frame, normalize_to_uint8
+from flir_geotiff import write_geotiff, read_manifest, write_manifest
+from flir_tiles import build_vrt, create_tiles
 
 ZERO_ZERO = (33.0745,-111.97475)
 
@@ -18,49 +26,76 @@ tif_list_file = 'tif_list.txt'
 
 TILE_FOLDER_NAME = 'flir_tiles'
 
-def main(base_dir):
+GEOTIFF_LAYOUT = 'rgb' # or 'paletted' for a single band with a grayscale color table, a third of the size
+GEOTIFF_COMPRESS = 'DEFLATE' # or 'LZW'
+
+def main(base_dir, processes=None, tiles=False):
     
     print "Starting binary to image conversion..."
-    full_day_convert(base_dir)
+    full_day_convert(base_dir, processes)
     print "Completed binary to image conversion..."
     
+    if not tiles:
+        return
 
     ## Create VRT from every GeoTIFF
-    #print "Starting VRT creation..."
-    #createVrt(base_dir)
-    #print "Completed VRT creation..."
+    print "Starting VRT creation..."
+    createVrt(base_dir)
+    print "Completed VRT creation..."
 
     ## Generate tiles from VRT
-    #print "Starting map tile creation..."
-    #createMapTiles(base_dir,multiprocessing.cpu_count())
-    #print "Completed map tile creation..."
+    print "Starting map tile creation..."
+    createMapTiles(base_dir, processes or multiprocessing.cpu_count())
+    print "Completed map tile creation..."
     
     ## Generate google map html template
-    #print "Starting google map html creation..."
-    #generate_googlemaps(base_dir)
-    #print "Completed google map html creation..."
+    print "Starting google map html creation..."
+    generate_googlemaps(base_dir)
+    print "Completed google map html creation..."
     
     
     return
 
-def full_day_convert(in_dir):
-
+def full_day_convert(in_dir, processes=None):
+    # Convert every scan of the day in a pool of worker processes (one per CPU by default),
+    # then write the list of TIFFs for the day from the paths the workers return
+    scan_dirs = list(find_scan_dirs(in_dir))
+    
+    pool = multiprocessing.Pool(processes)
     try:
-        os.remove(os.path.join(in_dir, tif_list_file)) # start from a fresh list of TIFFs for the day
-    except OSError:
-        pass
+        tif_paths = [tif_path for tif_path in pool.imap_unordered(convert_scan, scan_dirs, chunksize=8) if tif_path]
+    finally:
+        pool.close()
+        pool.join()
     
-    list_dirs = os.walk(in_dir)
+    write_manifest(os.path.join(in_dir, tif_list_file), tif_paths) # start from a fresh list of TIFFs for the day
     
-    for root, dirs, files in list_dirs:
-        for d in dirs:
-            full_path = os.path.join(in_dir, d)
-            if not os.path.isdir(full_path):
-                continue
-            
-            get_flir(full_path, in_dir)
+    return tif_paths
+
+def find_scan_dirs(in_dir):
+    # Yield every directory under in_dir holding an _ir.bin file, using one scandir() pass per directory;
+    # the map tile pyramid written into the day folder is not walked
+    sub_dirs = []
+    has_bin = False
+    for entry in scandir(in_dir):
+        if entry.is_dir():
+            if entry.name != TILE_FOLDER_NAME:
+                sub_dirs.append(entry.path)
+        elif entry.name.endswith('_ir.bin'):
+            has_bin = True
     
-    return
+    if has_bin:
+        yield in_dir
+    for sub_dir in sorted(sub_dirs):
+        for scan_dir in find_scan_dirs(sub_dir):
+            yield scan_dir
+
+def convert_scan(in_dir):
+    # Pool worker: scans converted already are skipped (see get_flir); an error in one scan is reported and must not stop the rest of the day
+    try:
+        return get_flir(in_dir)
+    except Exception as ex:
+        fail('Failed to convert "%s": %s' % (in_dir, str(ex)))
 
 def createVrt(base_dir):
     # Create virtual tif for the files in this folder
@@ -68,29 +103,30 @@ def createVrt(base_dir):
     print "\tCreating virtual TIF..."
     try:
         vrtPath = os.path.join(base_dir,'virtualTif.vrt')
-        tif_file = os.path.join(base_dir, tif_list_file)
-        cmd = 'gdalbuildvrt -srcnodata "-99 -99 -99" -overwrite -input_file_list ' + tif_file +' ' + vrtPath
-        os.system(cmd)
+        build_vrt(vrtPath, read_manifest(os.path.join(base_dir, tif_list_file)))
     except Exception as ex:
         fail("\tFailed to create virtual tif: " + str(ex))
 
 def createMapTiles(base_dir,NUM_THREADS):
-    # Create map tiles from the virtual tif
-    # For now, just creating w/ local coordinate system. In the future, can make these actually georeferenced.
+    # Create map tiles from the virtual tif; only tiles touched by GeoTIFFs added since the last run are rendered
     print "\tCreating map tiles..."
     try:
         vrtPath = os.path.join(base_dir,'virtualTif.vrt')
-        cmd = 'python gdal2tiles_parallel.py --processes=' + str(NUM_THREADS) + ' -l -n -e -f JPEG -z "18-28" -s EPSG:4326 ' + vrtPath + ' ' + os.path.join(base_dir,TILE_FOLDER_NAME)
-        os.system(cmd)
+        create_tiles(vrtPath, read_manifest(os.path.join(base_dir, tif_list_file)), os.path.join(base_dir,TILE_FOLDER_NAME), processes=NUM_THREADS)
     except Exception as ex:
         fail("Failed to generate map tiles: " + str(ex))
 
 
-def get_flir(in_dir, base_dir):
+def get_flir(in_dir):
     
     metafile, binfile = find_files(in_dir)
     if metafile == [] or binfile == [] :
-        return
+        return None
+    
+    # A GeoTIFF newer than its inputs is kept, so its mtime (and its tiles) stay unchanged
+    tif_path = binfile[:-3] + 'tif'
+    if is_up_to_date(tif_path, (binfile, metafile)):
+        return tif_path
     
     metadata = lower_keys(load_json(metafile))
     
@@ -104,60 +140,36 @@ def get_flir(in_dir, base_dir):
     
     Image.fromarray(im_color).save(out_png)
     
-    tif_path = binfile[:-3] + 'tif'
-    create_geotiff(im_color, gps_bounds, tif_path, base_dir)
+    if not create_geotiff(im_color, gps_bounds, tif_path):
+        return None
     
-    return
+    return tif_path
 
-def create_geotiff(np_arr, gps_bounds, out_file_path, base_dir):
+def is_up_to_date(out_file_path, in_file_paths):
+    # Whether out_file_path exists and is newer than every input
     try:
-        nrows,ncols = np.shape(np_arr)
-        # gps_bounds: (lat_min, lat_max, lng_min, lng_max)
-        xres = (gps_bounds[3] - gps_bounds[2])/float(ncols)
-        yres = (gps_bounds[1] - gps_bounds[0])/float(nrows)
-        geotransform = (gps_bounds[2],xres,0,gps_bounds[1],0,-yres) #(top left x, w-e pixel resolution, rotation (0 if North is up), top left y, rotation (0 if North is up), n-s pixel resolution)
-
-        output_path = out_file_path
-
-        output_raster = gdal.GetDriverByName('GTiff').Create(output_path, ncols, nrows, 3, gdal.GDT_Byte)
-
-        output_raster.SetGeoTransform(geotransform) # specify coordinates
-        srs = osr.SpatialReference() # establish coordinate encoding
-        srs.ImportFromEPSG(4326) # specifically, google mercator
-        output_raster.SetProjection( srs.ExportToWkt() ) # export coordinate system to file
-
-        # TODO: Something wonky w/ uint8s --> ending up w/ lots of gaps in data (white pixels)
-        output_raster.GetRasterBand(1).WriteArray(np_arr.astype('uint8')) # write red channel to raster file
-        output_raster.GetRasterBand(1).FlushCache()
-        output_raster.GetRasterBand(1).SetNoDataValue(-99)
-        
-        output_raster.GetRasterBand(2).WriteArray(np_arr.astype('uint8')) # write green channel to raster file
-        output_raster.GetRasterBand(2).FlushCache()
-        output_raster.GetRasterBand(2).SetNoDataValue(-99)
-
-        output_raster.GetRasterBand(3).WriteArray(np_arr.astype('uint8')) # write blue channel to raster file
-        output_raster.GetRasterBand(3).FlushCache()
-        output_raster.GetRasterBand(3).SetNoDataValue(-99)
-
+        out_mtime = os.path.getmtime(out_file_path)
+    except OSError:
+        return False
+    return all(os.path.getmtime(in_file_path) < out_mtime for in_file_path in in_file_paths)
 
-        # for test: once we've saved the image, make sure to append this path to our list of TIFs
-        tif_file = os.path.join(base_dir, tif_list_file)
-        f = open(tif_file,'a+')
-        f.write(output_path + '\n')
+def create_geotiff(np_arr, gps_bounds, out_file_path):
+    # Returns whether the GeoTIFF was written; a partly written file is removed
+    try:
+        write_geotiff(np_arr, gps_bounds, out_file_path, layout=GEOTIFF_LAYOUT, compress=GEOTIFF_COMPRESS)
+        return True
     except Exception as ex:
         fail('Error creating GeoTIFF: ' + str(ex))
+        if os.path.exists(out_file_path):
+            os.remove(out_file_path)
+        return False
 
 def load_flir_data(file_path):
     
     try:
-        im = np.fromfile(file_path, np.dtype('<u2')).reshape([480, 640])
-        Gmin = im.min()
-        Gmax = im.max()
-        At = ((im-Gmin) * 256 /(Gmax - Gmin))
-        
-        return At.astype('u1')
+        return normalize_to_uint8(map_frame(file_path))
     except Exception as ex:
-        fail('Error processing image "%s": %s' % (str(ex)))
+        fail('Error processing image "%s": %s' % (file_path, str(ex)))
 
 def get_bounding_box(center_position, fov):
     # NOTE: ZERO_ZERO is the southeast corner of the field. Position values increase to the northwest (so +y-position = +latitude, or more north and +x-position = -longitude, or more west)
@@ -324,6 +336,9 @@ def fail(reason):
 
 if __name__ == "__main__":
 
-    if len(sys.argv) != 2:
-        fail('Usage: python %s <input_folder>' % sys.argv[0])
-    retcode = main(sys.argv[1])
+    parser = argparse.ArgumentParser(description='Convert the FLIR scans of a day to GeoTIFFs, and optionally map tiles')
+    parser.add_argument('input_folder', help='folder of the scans of a day')
+    parser.add_argument('processes', nargs='?', type=int, default=None, help='number of worker processes (default: one per CPU)')
+    parser.add_argument('--tiles', action='store_true', help='also build the VRT, map tiles and google map page')
+    args = parser.parse_args()
+    retcode = main(args.input_folder, args.processes, tiles=args.tiles)
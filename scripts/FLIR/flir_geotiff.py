@@ -0,0 +1,102 @@
+'''
+Created on Oct 19, 2026
+
+GeoTIFF output for Get_FLIR.py:
+  - write_geotiff writes a normalized (uint8) FLIR frame as one tiled, compressed GeoTIFF
+    with internal overviews, either as a single paletted band or as 3 (RGB) bands
+  - read_manifest / write_manifest manage the list of GeoTIFFs of a day (tif_list.txt),
+    which gdalbuildvrt and the tiling step read
+'''
+
+import os
+import tempfile
+from osgeo import gdal, osr
+
+# GTiff creation options shared by every band layout
+CREATION_OPTIONS = {
+    'DEFLATE': ['TILED=YES', 'BLOCKXSIZE=256', 'BLOCKYSIZE=256', 'COMPRESS=DEFLATE', 'ZLEVEL=6', 'PREDICTOR=2'],
+    'LZW':     ['TILED=YES', 'BLOCKXSIZE=256', 'BLOCKYSIZE=256', 'COMPRESS=LZW', 'PREDICTOR=2'],
+}
+
+BAND_LAYOUTS = ('paletted', 'rgb')
+
+# Internal overview levels; a 640 x 480 frame is reduced to a single 256 x 256 block at level 4
+OVERVIEW_LEVELS = [2, 4]
+
+
+def grayscale_color_table():
+    # Palette mapping every uint8 value to the gray of the same intensity
+    color_table = gdal.ColorTable()
+    for value in range(256):
+        color_table.SetColorEntry(value, (value, value, value, 255))
+    return color_table
+
+def write_geotiff(np_arr, gps_bounds, out_file_path, layout='rgb', compress='DEFLATE', overview_levels=OVERVIEW_LEVELS):
+    # np_arr is a 2D uint8 frame; gps_bounds as returned by Get_FLIR.get_bounding_box.
+    # 'paletted' writes one band with a grayscale color table, 'rgb' writes the same
+    # buffer to the red, green and blue bands. Both are tiled, compressed and carry
+    # internal overviews, so mosaics and tiling read only the blocks and levels they need.
+    assert layout in BAND_LAYOUTS, 'Unknown band layout %s (expected one of %s)' % (layout, ', '.join(BAND_LAYOUTS))
+
+    nrows, ncols = np_arr.shape
+    xres = (gps_bounds[3] - gps_bounds[2])/float(ncols)
+    yres = (gps_bounds[1] - gps_bounds[0])/float(nrows)
+    geotransform = (gps_bounds[2],xres,0,gps_bounds[1],0,-yres) #(top left x, w-e pixel resolution, rotation (0 if North is up), top left y, rotation (0 if North is up), n-s pixel resolution)
+
+    options = list(CREATION_OPTIONS[compress])
+    if layout == 'paletted':
+        band_count = 1 # the color table set below makes it a palette TIFF
+    else:
+        band_count = 3
+        options.append('PHOTOMETRIC=RGB')
+
+    output_raster = gdal.GetDriverByName('GTiff').Create(out_file_path, ncols, nrows, band_count, gdal.GDT_Byte, options)
+    try:
+        output_raster.SetGeoTransform(geotransform) # specify coordinates
+        srs = osr.SpatialReference() # establish coordinate encoding
+        srs.ImportFromEPSG(4326)
+        output_raster.SetProjection(srs.ExportToWkt()) # export coordinate system to file
+
+        if layout == 'paletted':
+            output_raster.GetRasterBand(1).SetRasterColorTable(grayscale_color_table())
+            output_raster.GetRasterBand(1).SetRasterColorInterpretation(gdal.GCI_PaletteIndex)
+
+        for band_index in range(1, band_count + 1):
+            output_raster.GetRasterBand(band_index).WriteArray(np_arr)
+
+        if overview_levels:
+            output_raster.BuildOverviews('NEAREST' if layout == 'paletted' else 'AVERAGE', list(overview_levels))
+    finally:
+        output_raster = None # closing the dataset flushes it to disk
+
+    return out_file_path
+
+
+def read_manifest(manifest_path):
+    # GeoTIFF paths listed in a manifest, or an empty list if there is none yet
+    try:
+        with open(manifest_path, 'r') as f:
+            return [line.strip() for line in f if line.strip()]
+    except IOError:
+        return []
+
+def write_manifest(manifest_path, tif_paths):
+    # Replace the manifest with the sorted, de-duplicated tif_paths; the new list is written
+    # to a temporary file and renamed, so readers never see a partial manifest
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(manifest_path), dir=manifest_dir)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            for tif_path in sorted(set(tif_paths)):
+                f.write(tif_path + '\n')
+        # mkstemp creates the file readable by the owner only; give it the mode of a new file
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp_path, 0o666 & ~umask)
+        os.rename(tmp_path, manifest_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    return manifest_path
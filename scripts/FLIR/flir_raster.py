@@ -0,0 +1,122 @@
+'''
+Created on Oct 19, 2026
+
+Decoding of FLIR _ir.bin frames (640 x 480 little-endian uint16 counts) for Get_FLIR.py:
+  - map_frame memory-maps a frame instead of reading it into a new array
+  - normalize_to_uint8 stretches the counts onto 0..255 in one lookup pass
+  - raw_to_temperature converts the counts to radiometric temperature (float32, degree Celsius)
+
+Usage (per-frame benchmark):
+python flir_raster.py <path to _ir.bin> [number of frames]
+'''
+
+import sys, time
+import numpy as np
+
+FRAME_SHAPE = (480, 640)
+
+# Planck constants determined by FLIR (see FlirRawToTemperature.m)
+PLANCK_R  = 15976.1
+PLANCK_B  = 1417.3
+PLANCK_F  = 1.00
+PLANCK_J0 = 3597
+PLANCK_J1 = 73.549
+
+# Atmospheric transmission constants by FLIR
+ATM_X  = 1.9
+ATM_A1 = 0.006569
+ATM_B1 = -0.002276
+ATM_A2 = 0.01262
+ATM_B2 = -0.00667
+
+# Constants for the water vapour content from relative humidity and air temperature
+H2O_K1 = 1.56E+00
+H2O_K2 = 6.94E-02
+H2O_K3 = -2.78E-04
+H2O_K4 = 6.85E-07
+
+
+def map_frame(file_path, shape=FRAME_SHAPE):
+    # Memory-map a raw frame read-only; pixels are paged in by the first pass over them
+    return np.memmap(file_path, dtype='<u2', mode='r', shape=shape)
+
+def normalize_to_uint8(raw, out=None):
+    # Stretch the counts linearly so the coldest pixel is 0 and the hottest is 255.
+    # Every count in [min, max] is mapped through a uint8 lookup table built with integer
+    # arithmetic ((count - min) * 255 // (max - min)), so the frame is read once more and
+    # the max pixel is 255 instead of overflowing to 256 and wrapping to 0.
+    # out (uint8, frame shape) can be passed to reuse one buffer across frames.
+    if out is None:
+        out = np.empty(raw.shape, dtype=np.uint8)
+
+    g_min, g_max = int(raw.min()), int(raw.max())
+    if g_max == g_min:
+        out.fill(0)
+        return out
+
+    lut = np.zeros(g_max + 1, dtype=np.uint8)
+    lut[g_min:] = np.arange(g_max - g_min + 1, dtype=np.uint32) * 255 // (g_max - g_min)
+
+    return np.take(lut, raw, out=out)
+
+def raw_to_temperature(raw, air_temp=22.0, rel_humidity=0.1, distance=2.5, emissivity=0.98, out=None):
+    # Radiometric temperature in degree Celsius (float32), following FlirRawToTemperature.m.
+    # air_temp (degree Celsius) and rel_humidity (0 - 1) should come from the gantry;
+    # the ambient (reflected) temperature is assumed to be the air temperature.
+    h2o = rel_humidity * np.exp(H2O_K1 + H2O_K2*air_temp + H2O_K3*air_temp**2 + H2O_K4*air_temp**3)
+    tao = ATM_X * np.exp(-np.sqrt(distance/2) * (ATM_A1 + ATM_B1*np.sqrt(h2o))) + \
+          (1 - ATM_X) * np.exp(-np.sqrt(distance/2) * (ATM_A2 + ATM_B2*np.sqrt(h2o)))
+
+    theo_atm_rad = PLANCK_R*PLANCK_J1 / (np.exp(PLANCK_B / (air_temp + 273.15)) - PLANCK_F) + PLANCK_J0
+
+    # Total radiation = object radiation + atmosphere radiation + ambient reflection radiation,
+    # which is linear in the raw counts: raw * gain + offset
+    gain   = emissivity * tao
+    offset = (1 - tao) * theo_atm_rad + (1 - emissivity) * tao * theo_atm_rad
+
+    if out is None:
+        out = np.empty(raw.shape, dtype=np.float32)
+
+    # B / log(R / (corrected - J0) * J1 + F) - 273.15, evaluated in place
+    np.multiply(raw, np.float32(gain), out=out)
+    out += np.float32(offset - PLANCK_J0)
+    np.divide(np.float32(PLANCK_R * PLANCK_J1), out, out=out)
+    out += np.float32(PLANCK_F)
+    np.log(out, out=out)
+    np.divide(np.float32(PLANCK_B), out, out=out)
+    out -= np.float32(273.15)
+
+    return out
+
+
+def _legacy_normalize(file_path):
+    # The previous decoding in Get_FLIR.load_flir_data, kept for the benchmark
+    im = np.fromfile(file_path, np.dtype('<u2')).reshape(FRAME_SHAPE)
+    g_min, g_max = im.min(), im.max()
+    return ((im - g_min) * 256 / (g_max - g_min)).astype('u1')
+
+def benchmark(file_path, frames=100):
+    # Milliseconds per frame for the previous and the current decoding of one _ir.bin
+    out_u1 = np.empty(FRAME_SHAPE, dtype=np.uint8)
+    out_f4 = np.empty(FRAME_SHAPE, dtype=np.float32)
+
+    timings = []
+    for name, decode in (("fromfile + float64 normalize", lambda: _legacy_normalize(file_path)),
+                         ("memmap + uint8 lookup",        lambda: normalize_to_uint8(map_frame(file_path), out=out_u1)),
+                         ("memmap + float32 temperature", lambda: raw_to_temperature(map_frame(file_path), out=out_f4))):
+        start = time.time()
+        for _ in range(frames):
+            decode()
+        timings.append((name, (time.time() - start) * 1000.0 / frames))
+
+    return timings
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) not in (2, 3):
+        sys.stderr.write('Usage: python %s <ir_bin_file> [number_of_frames]\n' % sys.argv[0])
+        sys.exit(1)
+
+    for name, milliseconds in benchmark(sys.argv[1], int(sys.argv[2]) if len(sys.argv) == 3 else 100):
+        sys.stdout.write('%-30s %8.3f ms/frame\n' % (name, milliseconds))
@@ -0,0 +1,169 @@
+'''
+Created on Oct 19, 2026
+
+Mosaic and map tiles for the FLIR GeoTIFFs of a day, without shelling out to
+gdalbuildvrt / gdal2tiles_parallel.py:
+  - build_vrt mosaics the GeoTIFFs of the manifest into a VRT through the GDAL API
+  - create_tiles renders the TMS (Google maps, y flipped) JPEG pyramid of the VRT in
+    spherical mercator with a process pool; every worker opens the VRT once
+  - only tiles touched by a GeoTIFF footprint are rendered and fully empty tiles are not written
+  - GeoTIFFs already tiled are recorded with their mtime next to the tiles, so a re-run
+    only renders the tiles touched by the GeoTIFFs added or re-converted since
+'''
+
+import os
+import multiprocessing
+from math import ceil, log, pi, tan
+import numpy as np
+from PIL import Image
+from osgeo import gdal
+
+from flir_geotiff import read_manifest, write_manifest
+
+TILE_SIZE = 256
+
+ZOOM_LEVELS = range(18, 29)
+
+# GeoTIFFs whose tiles are already rendered, one "<path>\t<mtime>" per line, kept in the tile folder
+TILED_LIST_FILE = 'tiled_list.txt'
+
+_EARTH_RADIUS = 6378137
+_ORIGIN_SHIFT = pi * _EARTH_RADIUS
+
+
+def lonlat_to_meters(lon, lat):
+    # WGS84 longitude/latitude to spherical mercator (EPSG:3857) meters
+    mx = lon * _ORIGIN_SHIFT / 180.0
+    my = log(tan((90 + lat) * pi / 360.0)) / (pi / 180.0) * _ORIGIN_SHIFT / 180.0
+    return mx, my
+
+def resolution(zoom):
+    # Meters per pixel at a zoom level
+    return 2 * _ORIGIN_SHIFT / TILE_SIZE / 2**zoom
+
+def meters_to_tile(mx, my, zoom):
+    # TMS tile (y counted from the south) holding a point
+    tile_meters = TILE_SIZE * resolution(zoom)
+    return int(ceil((mx + _ORIGIN_SHIFT) / tile_meters) - 1), int(ceil((my + _ORIGIN_SHIFT) / tile_meters) - 1)
+
+def tile_bounds(tx, ty, zoom):
+    # (min x, min y, max x, max y) of a TMS tile in meters
+    tile_meters = TILE_SIZE * resolution(zoom)
+    return (tx * tile_meters - _ORIGIN_SHIFT, ty * tile_meters - _ORIGIN_SHIFT,
+            (tx + 1) * tile_meters - _ORIGIN_SHIFT, (ty + 1) * tile_meters - _ORIGIN_SHIFT)
+
+def footprint(tif_path):
+    # (lon min, lat min, lon max, lat max) of a north-up GeoTIFF, read from its header only
+    dataset = gdal.Open(tif_path)
+    x0, xres, _, y0, _, yres = dataset.GetGeoTransform()
+    x1, y1 = x0 + xres * dataset.RasterXSize, y0 + yres * dataset.RasterYSize
+    dataset = None
+    return min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)
+
+def affected_tiles(footprints, zoom_levels=ZOOM_LEVELS):
+    # Every (zoom, x, y) tile that intersects at least one footprint
+    tiles = set()
+    for lon_min, lat_min, lon_max, lat_max in footprints:
+        mx_min, my_min = lonlat_to_meters(lon_min, lat_min)
+        mx_max, my_max = lonlat_to_meters(lon_max, lat_max)
+        for zoom in zoom_levels:
+            tx_min, ty_min = meters_to_tile(mx_min, my_min, zoom)
+            tx_max, ty_max = meters_to_tile(mx_max, my_max, zoom)
+            for tx in range(tx_min, tx_max + 1):
+                for ty in range(ty_min, ty_max + 1):
+                    tiles.add((zoom, tx, ty))
+    return sorted(tiles)
+
+
+def build_vrt(vrt_path, tif_paths):
+    # Mosaic the GeoTIFFs into one VRT; the alpha band marks where no GeoTIFF has data
+    vrt = gdal.BuildVRT(vrt_path, list(tif_paths), addAlpha=True)
+    if vrt is None:
+        raise RuntimeError('Failed to build %s' % vrt_path)
+    vrt = None # closing the dataset writes the VRT
+    return vrt_path
+
+
+# VRT opened once by every tiling worker
+_vrt = None
+
+def _open_vrt(vrt_path):
+    global _vrt
+    _vrt = gdal.Open(vrt_path)
+
+def _render_tile(args):
+    # Pool worker: render one tile of the shared VRT; fully empty tiles are not written
+    (zoom, tx, ty), tile_dir = args
+
+    tile = gdal.Warp('', _vrt, format='MEM', dstSRS='EPSG:3857', outputBounds=tile_bounds(tx, ty, zoom),
+                     width=TILE_SIZE, height=TILE_SIZE, dstAlpha=True, resampleAlg='bilinear')
+    bands = tile.ReadAsArray()
+    tile = None
+
+    alpha = bands[-1]
+    if not alpha.any():
+        return None
+
+    gray_or_rgb = bands[:-1]
+    if len(gray_or_rgb) == 1: # paletted GeoTIFFs carry a grayscale color table
+        gray_or_rgb = np.repeat(gray_or_rgb, 3, axis=0)
+    rgb = np.dstack(gray_or_rgb[:3])
+
+    # tile_dir/zoom/x/y.jpg, with the TMS y the google map template expects
+    tile_path = os.path.join(tile_dir, str(zoom), str(tx), '%d.jpg' % ty)
+    try:
+        os.makedirs(os.path.dirname(tile_path))
+    except OSError:
+        pass
+    Image.fromarray(rgb).save(tile_path, 'JPEG', quality=85)
+    return tile_path
+
+def read_tiled_list(tiled_list):
+    # {GeoTIFF path: mtime when it was tiled}; entries without an mtime map to None
+    tiled = {}
+    for line in read_manifest(tiled_list):
+        tif_path, _, mtime = line.rpartition('\t')
+        try:
+            tiled[tif_path] = float(mtime)
+        except ValueError:
+            tiled[line] = None
+    return tiled
+
+def write_tiled_list(tiled_list, tiled):
+    write_manifest(tiled_list, ['%s\t%r' % (tif_path, mtime) for tif_path, mtime in tiled.items() if mtime is not None])
+
+def create_tiles(vrt_path, tif_paths, tile_dir, zoom_levels=ZOOM_LEVELS, processes=None, incremental=True):
+    # Render the tiles of tif_paths; with incremental=True only the GeoTIFFs not tiled yet, or
+    # modified since they were, are considered, and only the tiles they touch are re-rendered
+    # (from the whole mosaic)
+    tiled_list = os.path.join(tile_dir, TILED_LIST_FILE)
+    tiled = read_tiled_list(tiled_list) if incremental else {}
+
+    # mtimes are taken before rendering, so GeoTIFFs rewritten meanwhile are tiled again next time;
+    # listed GeoTIFFs that don't exist (any more) are left out
+    mtimes = {}
+    for tif_path in tif_paths:
+        try:
+            mtimes[tif_path] = os.path.getmtime(tif_path)
+        except OSError:
+            continue
+    new_tifs = [tif_path for tif_path in tif_paths if tif_path in mtimes and tiled.get(tif_path) != mtimes[tif_path]]
+    if not new_tifs:
+        return []
+
+    if not os.path.isdir(tile_dir):
+        os.makedirs(tile_dir)
+
+    tiles = affected_tiles([footprint(tif_path) for tif_path in new_tifs], zoom_levels)
+
+    pool = multiprocessing.Pool(processes, initializer=_open_vrt, initargs=(vrt_path,))
+    try:
+        tile_paths = [tile_path for tile_path in pool.imap_unordered(_render_tile, ((tile, tile_dir) for tile in tiles), chunksize=64)
+                      if tile_path]
+    finally:
+        pool.close()
+        pool.join()
+
+    tiled.update(mtimes)
+    write_tiled_list(tiled_list, tiled)
+    return tile_paths
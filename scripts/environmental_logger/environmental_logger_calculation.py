@@ -1,6 +1,6 @@
 import numpy as np
 
-__all__ = ["AREA", "FLX_SNS", "calculateDownwellingSpectralFlux"]
+__all__ = ["AREA", "FLX_SNS", "FLX_SNS_SI", "DARK_REFERENCE", "calculateBandwidth", "calculateDownwellingSpectralFlux"]
 
 #Fibre optic collection surface area is pi * (fiber diameter squared) / 4
 AREA = np.pi * (3900.0 * 1.0e-6) ** 2 / 4.0  # [m2]
@@ -255,12 +255,36 @@ DARK_MEASUREMENTS = \
      1500, 1501, 1499, 1500, 1501, 1500, 1500, 1500, 1499, 1502, 1500, 1499, 1502, 1502, 1500, 1498, 1500, 1501, 1500, 1499, 1500, 1500, 1502, 1499, 
      1499, 1500, 1502, 1499, 1497, 1501, 1501, 1501, 1497, 1499, 1502, 1501, 1497, 1499, 1500, 1500]
 
+# Calibration arrays, built once at import (float32, matching the flx_spc_dwn variable)
+Spectrometer_Integration_Time_In_Microseconds = 5000.0 # [us]
+Spectrometer_Integration_Time                 = Spectrometer_Integration_Time_In_Microseconds * 1.0e-6 # [s]
+
+FLX_SNS_SI     = np.asarray(FLX_SNS, dtype=np.float32) * np.float32(1.0e-6) # [J cnt-1]
+DARK_REFERENCE = np.asarray(DARK_MEASUREMENTS, dtype=np.float32) # [cnt]
+
+# flx_sns / (area * integration time), the per-band factor turning dark-corrected counts into flux
+_FLUX_FACTOR = (FLX_SNS_SI / np.float32(AREA * Spectrometer_Integration_Time)).astype(np.float32)
+
+def calculateBandwidth(wvl_lgr):
+    '''
+    This function will calculate the bandwidth (wavelength spread) of every band.
+    Inner bands span the distance between the midpoints of their neighbouring band-centers;
+    the first and last band are mirrored around their band-center.
+    '''
+    wvl_lgr = np.asarray(wvl_lgr, dtype=np.float64)
+    wvl_ntf = (wvl_lgr[:-1] + wvl_lgr[1:]) / 2.0 # midpoints of adjacent band-centers
+
+    return np.concatenate(([2 * (wvl_ntf[0] - wvl_lgr[0])],
+                           np.diff(wvl_ntf),
+                           [2 * (wvl_lgr[-1] - wvl_ntf[-1])]))
+
 def calculateDownwellingSpectralFlux(wvl_lgr, spectrum, delta):
     '''
     This function will calculate the downwelling spectral flux.
-    A desired type for wvl_lgr would be a single 1D list, and spectrum
-    should be a nested 2D list. The area for spectrometer and integration
-    time are default.
+    A desired type for wvl_lgr would be a single 1D array, and spectrum
+    should be a 2D (time, wavelength) array. The area for spectrometer and integration
+    time are default. Returns the spectral flux (time, wavelength) and the
+    flux (time,).
 
     This function is based on the following algorithm, provided by Solmaz in 
     https://github.com/terraref/reference-data/issues/30#issuecomment-253000597
@@ -281,21 +305,14 @@ def calculateDownwellingSpectralFlux(wvl_lgr, spectrum, delta):
     '''
 
 
-    Spectrometer_Integration_Time_In_Microseconds = 5000.0 # [us]
-    Spectrometer_Integration_Time                 = Spectrometer_Integration_Time_In_Microseconds * 1.0e-6 # [s]
-
-    # wvl_ntf  = [np.average([wvl_lgr[i], wvl_lgr[i+1]]) for i in range(len(wvl_lgr)-1)]
-    # delta    = [wvl_ntf[i+1] - wvl_ntf[i] for i in range(len(wvl_ntf) - 1)]
-    # delta.insert(0,  2*(wvl_ntf[0]  - wvl_lgr[0]))
-    # delta.insert(-1, 2*(wvl_lgr[-1] - wvl_ntf[-1]))
-
     # Using dark reference to calibrate the original sperctrum value
 
-    # General formula used in calculating downwelling spectral flux:
+    # General formula used in calculating downwelling spectral flux, broadcast over all the times at once:
     # Downwelling Spectral Flux = (spectrum [cnt] - dark [cnt]) * flx_sns [J cnt-1]  / bandwidth [m] / area [m2] / time [s]
-    downwellingSpectralFlux = np.array(FLX_SNS) * 1.0e-6 * (np.array(spectrum) - np.array(DARK_MEASUREMENTS)) / np.array(delta) / AREA / Spectrometer_Integration_Time # [J m-2 m-1 s-1] = [W m-2 m-1]
+    delta                   = np.asarray(delta, dtype=np.float32)
+    downwellingSpectralFlux = (np.asarray(spectrum, dtype=np.float32) - DARK_REFERENCE) * (_FLUX_FACTOR / delta) # [J m-2 m-1 s-1] = [W m-2 m-1]
 
-    # downwellingFlux is the summation (integration) of downwelling flux
-    downwellingFlux = np.sum(downwellingSpectralFlux)
+    # downwellingFlux is the summation (integration) of downwelling spectral flux over the bandwidths, one per time
+    downwellingFlux = downwellingSpectralFlux.dot(delta)
 
-    return downwellingSpectralFlux, downwellingFlux  
\ No newline at end of file
+    return downwellingSpectralFlux, downwellingFlux
@@ -10,15 +10,20 @@ Prerequisite:
 1. Python (2.7+ recommended)
 2. netCDF4 module for Python (and its dependencies)
 3. numpy (For array calculations, make sure the numpy has the same Python verison as other modules)
+4. ijson (optional, for streaming the JSON; without it the file is loaded whole)
 ----------------------------------------------------------------------------------------
 
 Usage: Give full path to environmental_logger_json2netcdf.py, or place it in PYTHONPATH, then:
 
 python environmental_logger_json2netcdf.py drc_in drc_out # Process all files in drc_in
 python environmental_logger_json2netcdf.py  fl_in drc_out # Process only fl_in
+python environmental_logger_json2netcdf.py drc_in drc_out daily # Append all files in drc_in to one file per day
 where drc_in is input directory, drc_out is output directory, fl_in is input file
 Input  filenames must have '.json' extension
 Output filenames are replace '.json' with '.nc'
+In daily mode the readings are appended to drc_out/YYYY-MM-DD_environmentlogger.nc of the day of each reading
+instead, kept in time order; readings whose timestamp is already in that file are skipped, so a file can be
+re-ingested safely
 
 UCI test:
 python ${HOME}/terraref/computing-pipeline/scripts/hyperspectral/environmental_logger_json2netcdf.py ${DATA}/terraref/environmentlogger_test.json ${DATA}/terraref
@@ -55,6 +60,10 @@ If the output folder does not exist, environmental_logger_json2netcdf.py creates
           2. Reinstate the integration time and sensor area (based on the discussion about the dimension of the flux sensitivity)
           3. Clean up based on Professor Zender's adjustment
 20160526: All units are now in SI
+20261019: The JSON is streamed into preallocated NumPy column arrays in a single pass (environmental_logger_reader.py)
+          instead of being loaded whole and walked by one list comprehension per variable
+          Bandwidths and fluxes are computed with whole-array NumPy operations; flx_dwn is now one value per time
+          Add the daily-aggregate mode, which extends the unlimited time dimension of one file per day
 
 ----------------------------------------------------------------------------------------
 Note:
@@ -71,9 +80,11 @@ import json
 import time
 import sys
 import os
-from datetime import date, datetime
+import fcntl
+from datetime import date, datetime, timedelta
 from netCDF4 import Dataset
 from environmental_logger_calculation import *
+from environmental_logger_reader import *
 
 _UNIT_DICTIONARY = {u'm': {"original":"meter", "SI":"meter", "power":1}, 
                     u"hPa": {"original":"hectopascal", "SI":"pascal", "power":1e2},
@@ -98,10 +109,9 @@ _TIMESTAMP = lambda: time.strftime("%a %b %d %H:%M:%S %Y",  time.localtime(int(t
 
 def JSONHandler(fileLocation):
     '''
-    Main JSON handler, write JSON file to a Python list with standard JSON module
+    Main JSON handler, stream the JSON file into column arrays (see environmental_logger_reader.py)
     '''
-    with open(fileLocation, 'r') as fileHandler:
-        return json.loads(fileHandler.read())
+    return readEnvironmentLogger(fileLocation, translateTime)
 
 
 def renameTheValue(name):
@@ -116,203 +126,263 @@ def renameTheValue(name):
     return name.replace(" ", "_")
 
 
-def getSpectrometerInformation(arrayOfJSON):
+def translateTime(timeString):
     '''
-    Collect information from spectrometer with special care
-    these information contain:
-    1. max fixed intensity
-    2. integration time
+    Translate the time the metadata included as the days offset to the basetime.
     '''
-    maxFixedIntensity = [int(intensityMembers["spectrometer"]["maxFixedIntensity"])\
-                         for intensityMembers in arrayOfJSON]
-    integrationTime   = [int(integrateMembers["spectrometer"]["integration time in ?s"])\
-                         for integrateMembers in arrayOfJSON]
+    timeUnpack = datetime.strptime(timeString, "%Y.%m.%d-%H:%M:%S").timetuple()
+    timeSplit  = date(year=timeUnpack.tm_year, month=timeUnpack.tm_mon, day=timeUnpack.tm_mday) - _UNIX_BASETIME
 
-    return maxFixedIntensity, integrationTime
+    return (timeSplit.total_seconds() + timeUnpack.tm_hour * 3600.0 + timeUnpack.tm_min * 60.0 + timeUnpack.tm_sec) / (3600.0 * 24.0)
 
 
-def getListOfWeatherStationValue(arrayOfJSON, dataName):
+def createLayout(netCDFHandler, loggerData):
+    '''
+    Create the groups, dimensions and variables of an empty netCDF file and write
+    everything that does not depend on time (fixed infos and calibration constants) once.
+    '''
+    loggerFixedInfos = loggerData.fixedInfos
+
+    for infos, atttributes in loggerFixedInfos.items():
+        infosGroup = netCDFHandler.createGroup(infos)
+        for subInfos in atttributes:
+            setattr(infosGroup, renameTheValue("".join((infos, subInfos))), loggerFixedInfos[infos][subInfos])
+
+    netCDFHandler.createDimension("time", None)
+    timeVariable = netCDFHandler.createVariable("time", 'f8', ('time',))
+    setattr(timeVariable, "units",    "days since 1970-01-01 00:00:00")
+    setattr(timeVariable, "calender", "gregorian")
+
+    #writing the data from spectrometer
+    wvl_lgr           = loggerData.wavelength
+    spectrometerGroup = netCDFHandler.groups["spectrometer"]
+
+    netCDFHandler.createDimension("wvl_lgr", len(wvl_lgr))
+    wavelengthVariable = spectrometerGroup.createVariable("wvl_lgr", "f4", ("wvl_lgr",))
+    spectrumVariable   = spectrometerGroup.createVariable("spectrum", "f4", ("time", "wvl_lgr"))
+    intensityVariable  = spectrometerGroup.createVariable("maxFixedIntensity", "f4", ("time",))
+
+    #TODO
+    #TODO add stanard names into the environmental loggers
+    wavelengthVariable[:] = wvl_lgr
+    setattr(wavelengthVariable, "units", "meter")
+    setattr(wavelengthVariable, "long_name", "wavelengths")
+    setattr(wavelengthVariable, "notes", "these wavelengths are all the same in different collections from the environmental logger. Ranging from 337.7 to 824 nm.")
+    setattr(spectrumVariable, "units", "placeholder")
+    setattr(spectrumVariable, "long_name", "spectrum")
+    setattr(spectrumVariable, "notes", "placeholder")
+    setattr(intensityVariable, "units", "placeholder")
+    setattr(intensityVariable, "long_name", "max_fixed_intensity")
+    setattr(intensityVariable, "notes", "placeholder")
+
+    # Add data from hyperspectral_calibration.nco
+    netCDFHandler.createVariable("wvl_dlt", 'f8', ("wvl_lgr",))[:] = calculateBandwidth(wvl_lgr)
+    setattr(netCDFHandler.variables['wvl_dlt'], 'units', 'meter')
+    setattr(netCDFHandler.variables['wvl_dlt'], 'notes',"Bandwidth, also called dispersion, is between 0.455-0.495 nm across all channels. Values computed as differences between midpoints of adjacent band-centers.")
+    setattr(netCDFHandler.variables['wvl_dlt'], 'long_name', "Bandwidth of environmental sensor")
+
+    netCDFHandler.createVariable("flx_sns", "f4", ("wvl_lgr",))[:] = FLX_SNS_SI
+    setattr(netCDFHandler.variables['flx_sns'],'units', 'watt meter-2 count-1')
+    setattr(netCDFHandler.variables['flx_sns'],'long_name','Flux sensitivity of each band (irradiance per count)')
+    setattr(netCDFHandler.variables['flx_sns'], 'provenance', "EnvironmentalLogger calibration information from file S05673_08062015.IrradCal provided by TinoDornbusch and discussed here: https://github.com/terraref/reference-data/issues/30#issuecomment-217518434")
+
+    netCDFHandler.createVariable("flx_spc_dwn", 'f4', ('time','wvl_lgr'))
+    setattr(netCDFHandler.variables['flx_spc_dwn'],'units', 'watt meter-2 meter-1')
+    setattr(netCDFHandler.variables['flx_spc_dwn'], 'long_name', 'Downwelling Spectral Irradiance')
+
+    # Downwelling Flux = summation of (delta lambda(_wvl_dlt) * downwellingSpectralFlux)
+    netCDFHandler.createVariable("flx_dwn", 'f4', ('time',))
+    setattr(netCDFHandler.variables["flx_dwn"], "units", "watt meter-2")
+    setattr(netCDFHandler.variables['flx_dwn'], 'long_name', 'Downwelling Irradiance')
+
+    # #Other Constants used in calculation
+    # #Integration Time
+    netCDFHandler.createVariable("time_integration", 'f4')[...] = float(loggerData.integrationTime[0]) / 1.0e-6
+    setattr(netCDFHandler.variables["time_integration"], "units", "second")
+    setattr(netCDFHandler.variables['time_integration'], 'long_name', 'Spectrometer integration time')
+
+    # #Spectrometer area
+    netCDFHandler.createVariable("area_sensor", "f4")[...] = AREA
+    setattr(netCDFHandler.variables["area_sensor"], "units", "meter2")
+    setattr(netCDFHandler.variables['area_sensor'], 'long_name', 'Spectrometer Area')
+
+
+def _columnVariables(group, name, columns):
     '''
-    Collect data from weather station objects which have "value" member
-    these data are:
-    1. values
-    2. units
-    3. raw values
+    Return the value and raw value variables of one column, creating them if the file does not have them yet
     '''
-    return [float(valueMembers["weather_station"][dataName]['value'])\
-            for valueMembers in arrayOfJSON],\
-           [_UNIT_DICTIONARY[valueMembers["weather_station"][dataName]['unit']]["SI"]\
-            for valueMembers in arrayOfJSON],\
-           [float(valueMembers["weather_station"][dataName]['rawValue'])\
-            for valueMembers in arrayOfJSON] 
+    if name not in group.variables:
+        setattr(group.createVariable(name, "f4", ("time", )), "units", _UNIT_DICTIONARY[columns.unit]["SI"])
+        group.createVariable("".join(("raw_", name)), "f4", ("time", ))
 
+    return group.variables[name], group.variables["".join(("raw_", name))]
 
-def handleSpectrometer(JSONArray):
+
+def _timeVariables(netCDFHandler):
     '''
-    This function will return the wavelength (1D array), spectrum (2D array) and maxFixedIntensity (1D array) in spectrometer readings
+    Yield every variable of the file (root and groups) whose first dimension is time
     '''
+    for group in [netCDFHandler] + list(netCDFHandler.groups.values()):
+        for variable in group.variables.values():
+            if variable.dimensions and variable.dimensions[0] == "time":
+                yield variable
 
-    wvl_lgr           = JSONArray[0]["spectrometer"]["wavelength"]
-    spectrum          = [valueMembers["spectrometer"]["spectrum"]\
-                         for valueMembers in JSONArray]
-    maxFixedIntensity = [float(valueMembers["spectrometer"]["maxFixedIntensity"])\
-                         for valueMembers in JSONArray]
 
-    return wvl_lgr, spectrum, maxFixedIntensity
+def _variableKey(variable):
+    return (variable.group().path, variable.name)
 
 
-def sensorVariables(JSONArray, sensors):
+def appendReadings(netCDFHandler, loggerData):
+    '''
+    Write the readings of loggerData into the file, keeping the time axis in order.
+    Readings whose timestamp is already written (or repeated within loggerData) are skipped.
+    Readings later than every written one are appended; earlier ones are merged in, which
+    rewrites the rows from the first of them on.
+    Returns the number of readings written.
     '''
-    return the variables start with "sensor"
-    these are:
-    1. values
-    2. units
-    3. raw values
+    timeVariable = netCDFHandler.variables["time"]
+    offset       = len(timeVariable)
+
+    # index of written times; only the readings that are new get computed and written
+    newReadings = np.flatnonzero(~np.in1d(loggerData.time, timeVariable[:offset])) if offset else np.arange(loggerData.size)
+    # a timestamp repeated within loggerData is written once (its first reading), in time order
+    newReadings = newReadings[np.unique(loggerData.time[newReadings], return_index=True)[1]]
+
+    count = len(newReadings)
+    if not count:
+        return 0
+
+    newValues = dict()  # (group path, variable name) -> values of the new readings
+    newTimes  = loggerData.time[newReadings]
+    newValues[_variableKey(timeVariable)] = newTimes
+
+    weatherStationGroup = netCDFHandler.groups["weather_station"]
+    for data, columns in loggerData.weatherStation.items(): #writing the data from weather station
+        valueVariable, rawValueVariable = _columnVariables(weatherStationGroup, data, columns)
+        newValues[_variableKey(valueVariable)]    = columns.value[newReadings]
+        newValues[_variableKey(rawValueVariable)] = columns.rawValue[newReadings]
+
+    for data, columns in loggerData.sensors.items(): # par sensor or co2 sensor
+        targetGroup = netCDFHandler.groups["par_sensor"] if data.endswith("par") else netCDFHandler.groups["co2_sensor"]
+        sensorValueVariable, sensorRawValueVariable = _columnVariables(targetGroup, renameTheValue(data), columns)
+        newValues[_variableKey(sensorValueVariable)]    = columns.value[newReadings]
+        newValues[_variableKey(sensorRawValueVariable)] = columns.rawValue[newReadings]
+
+    spectrometerGroup = netCDFHandler.groups["spectrometer"]
+    spectrum          = loggerData.spectrum[newReadings]
+    newValues[_variableKey(spectrometerGroup.variables["spectrum"])]          = spectrum
+    newValues[_variableKey(spectrometerGroup.variables["maxFixedIntensity"])] = loggerData.maxFixedIntensity[newReadings]
+
+    # Downwelling Flux = summation of (delta lambda(_wvl_dlt) * downwellingSpectralFlux), one per time
+    # Details in environmental_logger_calculation.py
+    downwellingSpectralFlux, downwellingFlux = calculateDownwellingSpectralFlux(loggerData.wavelength, spectrum,
+                                                                                netCDFHandler.variables["wvl_dlt"][:])
+    newValues[_variableKey(netCDFHandler.variables["flx_spc_dwn"])] = downwellingSpectralFlux
+    newValues[_variableKey(netCDFHandler.variables["flx_dwn"])]     = downwellingFlux
+
+    # The written times are in order, so the new readings go after the last one earlier than them
+    start = int(np.searchsorted(timeVariable[:offset], newTimes[0])) if offset else 0
+    order = np.argsort(np.concatenate((timeVariable[start:offset], newTimes)), kind="mergesort")
+
+    for variable in _timeVariables(netCDFHandler):
+        values = newValues.get(_variableKey(variable))
+        if values is None: # a variable the readings have no values for
+            values = np.ma.masked_all((count,) + variable.shape[1:], dtype=variable.dtype)
+        if start < offset:
+            values = np.ma.concatenate((variable[start:offset], values))[order]
+        variable[start:offset + count] = values
+
+    return count
+
+
+def main(loggerData, outputFileName, wavelength=None, spectrum=None, downwellingSpectralFlux=None, recordTime=None, commandLine=None):
+    '''
+    Main netCDF handler, write data to the netCDF file indicated.
     '''
+    with Dataset(outputFileName, 'w', format='NETCDF4') as netCDFHandler:
+        createLayout(netCDFHandler, loggerData)
+        appendReadings(netCDFHandler, loggerData)
 
-    return [float(valueMembers[sensors]['value'])
-            for valueMembers in JSONArray],\
-           [_UNIT_DICTIONARY[valueMembers[sensors]['unit']]["SI"]
-            for valueMembers in JSONArray],\
-           [float(valueMembers[sensors]['rawValue'])
-            for valueMembers in JSONArray]
+        netCDFHandler.history = "".join((recordTime, ': python ', commandLine))
 
 
-def translateTime(timeString):
+def appendToDailyFile(loggerData, outputFileName, recordTime=None, commandLine=None):
     '''
-    Translate the time the metadata included as the days offset to the basetime.
+    Daily-aggregate netCDF handler: open the day's file in append mode (creating it for the
+    first reading of the day) and add the readings not written yet. The file is locked
+    meanwhile, so concurrent ingests of the same day wait for each other.
     '''
-    timeUnpack = datetime.strptime(timeString, "%Y.%m.%d-%H:%M:%S").timetuple()
-    timeSplit  = date(year=timeUnpack.tm_year, month=timeUnpack.tm_mon, day=timeUnpack.tm_mday) - _UNIX_BASETIME
+    with open("".join((outputFileName, ".lock")), 'a') as lockFile:
+        fcntl.flock(lockFile, fcntl.LOCK_EX)
 
-    return (timeSplit.total_seconds() + timeUnpack.tm_hour * 3600.0 + timeUnpack.tm_min * 60.0 + timeUnpack.tm_sec) / (3600.0 * 24.0)
+        if not os.path.isfile(outputFileName):
+            with Dataset(outputFileName, 'w', format='NETCDF4') as netCDFHandler:
+                createLayout(netCDFHandler, loggerData)
 
+        with Dataset(outputFileName, 'a') as netCDFHandler:
+            count = appendReadings(netCDFHandler, loggerData)
+            if count:
+                history = "".join((recordTime, ': python ', commandLine))
+                if "history" in netCDFHandler.ncattrs():
+                    history = "\n".join((history, netCDFHandler.history))
+                netCDFHandler.history = history
 
-def main(JSONArray, outputFileName, wavelength=None, spectrum=None, downwellingSpectralFlux=None, recordTime=None, commandLine=None):
+    return count
+
+
+def splitByDay(loggerData):
     '''
-    Main netCDF handler, write data to the netCDF file indicated.
+    Split the readings of loggerData by the day of their own timestamp; returns a list of
+    EnvironmentLoggerData, one per day, in order
     '''
-    with Dataset(outputFileName, 'w', format='NETCDF4') as netCDFHandler:
-        loggerFixedInfos = JSONArray["environment_sensor_fixed_infos"]
-        loggerReadings   = JSONArray["environment_sensor_readings"]
-
-        for infos, atttributes in loggerFixedInfos.items():
-            infosGroup = netCDFHandler.createGroup(infos)
-            for subInfos in atttributes:
-                setattr(infosGroup, renameTheValue("".join((infos, subInfos))), loggerFixedInfos[infos][subInfos])
-
-        netCDFHandler.createDimension("time", None)
-
-        weatherStationGroup = netCDFHandler.groups["weather_station"]
-        spectrometerGroup   = netCDFHandler.groups["spectrometer"]
-        for data in loggerReadings[0]["weather_station"]: #writing the data from weather station
-            value, unit, rawValue           = getListOfWeatherStationValue(loggerReadings, data)
-            valueVariable, rawValueVariable = weatherStationGroup.createVariable(data,                   "f4", ("time", )),\
-                                            weatherStationGroup.createVariable("".join(("raw_",data)), "f4", ("time", ))
-                
-            valueVariable[:]    = value
-            rawValueVariable[:] = rawValue
-            setattr(valueVariable, "units", unit[0])
-
-        wvl_lgr, spectrum, maxFixedIntensity = handleSpectrometer(loggerReadings) #writing the data from spectrometer
-
-        netCDFHandler.createDimension("wvl_lgr", len(wvl_lgr))
-        wavelengthVariable = spectrometerGroup.createVariable("wvl_lgr", "f4", ("wvl_lgr",))
-        spectrumVariable   = spectrometerGroup.createVariable("spectrum", "f4", ("time", "wvl_lgr"))
-        intensityVariable  = spectrometerGroup.createVariable("maxFixedIntensity", "f4", ("time",))
-
-        #TODO
-        #TODO add stanard names into the environmental loggers
-        wavelengthVariable[:] = wvl_lgr
-        setattr(wavelengthVariable, "units", "meter")
-        setattr(wavelengthVariable, "long_name", "wavelengths")
-        setattr(wavelengthVariable, "notes", "these wavelengths are all the same in different collections from the environmental logger. Ranging from 337.7 to 824 nm.")
-        spectrumVariable[:,:] = spectrum
-        setattr(spectrumVariable, "units", "placeholder")
-        setattr(spectrumVariable, "long_name", "spectrum")
-        setattr(spectrumVariable, "notes", "placeholder")
-        intensityVariable[:]  = maxFixedIntensity
-        setattr(intensityVariable, "units", "placeholder")
-        setattr(intensityVariable, "long_name", "max_fixed_intensity")
-        setattr(intensityVariable, "notes", "placeholder")
-
-        timeVariable = netCDFHandler.createVariable("time", 'f8', ('time',))
-        timeVariable[:] = [translateTime(data["timestamp"]) for data in loggerReadings]
-        setattr(timeVariable, "units",    "days since 1970-01-01 00:00:00")
-        setattr(timeVariable, "calender", "gregorian")
-
-        for data in loggerReadings[0]:
-            if data.startswith("sensor"): # par sensor or co2 sensor
-                targetGroup = netCDFHandler.groups["par_sensor"] if data.endswith("par") else netCDFHandler.groups["co2_sensor"]
-
-                sensorValue, sensorUnit, sensorRaw = sensorVariables(loggerReadings, data)
-                sensorValueVariable                = targetGroup.createVariable(renameTheValue(data),                    "f4", ("time", ))
-                sensorRawValueVariable             = targetGroup.createVariable("".join(("raw_", renameTheValue(data))), "f4", ("time", ))
-
-                sensorValueVariable[:]    = sensorValue
-                sensorRawValueVariable[:] = sensorRaw
-                setattr(sensorValueVariable, "units", sensorUnit[0])
-
-        wvl_ntf  = [np.average([wvl_lgr[i], wvl_lgr[i+1]]) for i in range(len(wvl_lgr)-1)]
-        delta    = [wvl_ntf[i+1] - wvl_ntf[i] for i in range(len(wvl_ntf) - 1)]
-        delta.insert(0, 2*(wvl_ntf[0] - wvl_lgr[0]))
-        delta.insert(-1, 2*(wvl_lgr[-1] - wvl_ntf[-1]))
-
-        # Downwelling Flux = summation of (delta lambda(_wvl_dlt) * downwellingSpectralFlux)
-        # Details in CalculationWorks.py
-        downwellingSpectralFlux, downwellingFlux = calculateDownwellingSpectralFlux(wvl_lgr, spectrum, delta)
-
-        # Add data from hyperspectral_calibration.nco
-        netCDFHandler.createVariable("wvl_dlt", 'f8', ("wvl_lgr",))[:] = delta
-        setattr(netCDFHandler.variables['wvl_dlt'], 'units', 'meter')
-        setattr(netCDFHandler.variables['wvl_dlt'], 'notes',"Bandwidth, also called dispersion, is between 0.455-0.495 nm across all channels. Values computed as differences between midpoints of adjacent band-centers.")
-        setattr(netCDFHandler.variables['wvl_dlt'], 'long_name', "Bandwidth of environmental sensor")
-
-        netCDFHandler.createVariable("flx_sns", "f4", ("wvl_lgr",))[:] = np.array(FLX_SNS) * 1e-6
-        setattr(netCDFHandler.variables['flx_sns'],'units', 'watt meter-2 count-1')
-        setattr(netCDFHandler.variables['flx_sns'],'long_name','Flux sensitivity of each band (irradiance per count)')
-        setattr(netCDFHandler.variables['flx_sns'], 'provenance', "EnvironmentalLogger calibration information from file S05673_08062015.IrradCal provided by TinoDornbusch and discussed here: https://github.com/terraref/reference-data/issues/30#issuecomment-217518434")
-
-        netCDFHandler.createVariable("flx_spc_dwn", 'f4', ('time','wvl_lgr'))[:,:] = downwellingSpectralFlux
-        setattr(netCDFHandler.variables['flx_spc_dwn'],'units', 'watt meter-2 meter-1')
-        setattr(netCDFHandler.variables['flx_spc_dwn'], 'long_name', 'Downwelling Spectral Irradiance')
-
-        # Downwelling Flux = summation of (delta lambda(_wvl_dlt) * downwellingSpectralFlux)
-        netCDFHandler.createVariable("flx_dwn", 'f4')[...] = downwellingFlux
-        setattr(netCDFHandler.variables["flx_dwn"], "units", "watt meter-2")
-        setattr(netCDFHandler.variables['flx_dwn'], 'long_name', 'Downwelling Irradiance')
-
-        # #Other Constants used in calculation
-        # #Integration Time
-        netCDFHandler.createVariable("time_integration", 'f4')[...] = float(loggerReadings[0]["spectrometer"]["integration time in us"]) / 1.0e-6
-        setattr(netCDFHandler.variables["time_integration"], "units", "second")
-        setattr(netCDFHandler.variables['time_integration'], 'long_name', 'Spectrometer integration time')
-
-        # #Spectrometer area
-        netCDFHandler.createVariable("area_sensor", "f4")[...] = AREA
-        setattr(netCDFHandler.variables["area_sensor"], "units", "meter2")
-        setattr(netCDFHandler.variables['area_sensor'], 'long_name', 'Spectrometer Area')
+    days = np.floor(loggerData.time).astype(np.int64)
+    return [loggerData.select(np.flatnonzero(days == day)) for day in np.unique(days)]
 
-        netCDFHandler.history = "".join((recordTime, ': python ', commandLine))
+
+def dailyFileName(loggerData):
+    '''
+    Name of the daily-aggregate file the readings in loggerData belong to (the day of the first
+    reading; see splitByDay for readings of several days)
+    '''
+    day = _UNIX_BASETIME + timedelta(days=int(loggerData.time[0]))
+    return "".join((day.isoformat(), "_environmentlogger.nc"))
 
 
-def mainProgramTrigger(fileInputLocation, fileOutputLocation):
+def mainProgramTrigger(fileInputLocation, fileOutputLocation, daily=False):
     '''
     This function will trigger the whole script
     '''
-    startPoint = time.clock()
-    if not os.path.exists(fileOutputLocation) and not fileOutputLocation.endswith('.nc'):
+    startPoint  = time.clock()
+    commandLine = " ".join(sys.argv[1:])
+    if not os.path.exists(fileOutputLocation) and (daily or not fileOutputLocation.endswith('.nc')):
         os.mkdir(fileOutputLocation)  # Create folder
 
-    if not os.path.isdir(fileInputLocation) or fileOutputLocation.endswith('.nc'):
+    if daily:
+        if os.path.isdir(fileInputLocation):
+            inputFiles = sorted(os.path.join(filePath, members) for filePath, fileDirectory, fileName in os.walk(fileInputLocation)
+                                for members in fileName if members.endswith('.json'))
+        else:
+            inputFiles = [fileInputLocation]
+
+        for inputFile in inputFiles:
+            print "\nProcessing", "".join((inputFile, '....')),"\n", "-" * (len(inputFile) + 15)
+            tempJSONMasterList = JSONHandler(inputFile)
+            if not tempJSONMasterList.size:
+                continue
+            for dayData in splitByDay(tempJSONMasterList): # a file may span midnight
+                outputFileName = os.path.join(fileOutputLocation, dailyFileName(dayData))
+                count = appendToDailyFile(dayData, outputFileName, recordTime=_TIMESTAMP(), commandLine=commandLine)
+                print "Appended", count, "new readings to", outputFileName, "\n", "-" * (len(inputFile) + 15)
+
+    elif not os.path.isdir(fileInputLocation) or fileOutputLocation.endswith('.nc'):
         print "\nProcessing", "".join((fileInputLocation, '....')),"\n", "-" * (len(fileInputLocation) + 15)
         tempJSONMasterList = JSONHandler(fileInputLocation)
         if not os.path.isdir(fileOutputLocation):
-            main(tempJSONMasterList, fileOutputLocation, recordTime=_TIMESTAMP(), commandLine="".join((sys.argv[1], ' ', sys.argv[2])))
+            main(tempJSONMasterList, fileOutputLocation, recordTime=_TIMESTAMP(), commandLine=commandLine)
         else:
             outputFileName = os.path.split(fileInputLocation)[-1]
             print "Exported to", fileOutputLocation, "\n", "-" * (len(fileInputLocation) + 15)
-            main(tempJSONMasterList, os.path.join(fileOutputLocation,  "".join((outputFileName.strip('.json'), '.nc'))), recordTime=_TIMESTAMP(), commandLine="".join((sys.argv[1], ' ', sys.argv[2])))
+            main(tempJSONMasterList, os.path.join(fileOutputLocation,  "".join((outputFileName.strip('.json'), '.nc'))), recordTime=_TIMESTAMP(), commandLine=commandLine)
     else:    
         for filePath, fileDirectory, fileName in os.walk(fileInputLocation):
             for members in fileName:
@@ -321,10 +391,10 @@ def mainProgramTrigger(fileInputLocation, fileOutputLocation):
                     outputFileName = "".join((members.strip('.json'), '.nc'))
                     tempJSONMasterList = JSONHandler(os.path.join(filePath, members))
                     print "Exported to", str(os.path.join(fileOutputLocation, outputFileName)), "\n", "-" * (len(fileInputLocation) + 15)
-                    main(tempJSONMasterList, os.path.join(fileOutputLocation, outputFileName), recordTime=_TIMESTAMP(), commandLine="".join((sys.argv[1], ' ', sys.argv[2])))
+                    main(tempJSONMasterList, os.path.join(fileOutputLocation, outputFileName), recordTime=_TIMESTAMP(), commandLine=commandLine)
     
     endPoint = time.clock()
     print "Done. Execution time: {:.3f} seconds\n".format(endPoint-startPoint)
 
 if __name__ == '__main__':
-    mainProgramTrigger(sys.argv[1], sys.argv[2])
+    mainProgramTrigger(sys.argv[1], sys.argv[2], daily=len(sys.argv) > 3 and sys.argv[3] == "daily")
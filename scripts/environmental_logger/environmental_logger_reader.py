@@ -0,0 +1,203 @@
+'''
+environmental_logger_reader.py
+
+----------------------------------------------------------------------------------------
+This module reads an EnvironmentLogger JSON file in a single streaming pass and
+collects every reading into NumPy column arrays:
+1. time (days since the UNIX basetime)
+2. value and raw value of every weather station variable
+3. value and raw value of the PAR and CO2 sensors ("sensor par", "sensor co2")
+4. spectrometer spectrum (2D), maxFixedIntensity and integration time
+
+Only one reading is held as Python objects at any time, so memory stays proportional
+to the output arrays instead of to the JSON tree.
+----------------------------------------------------------------------------------------
+Prerequisite:
+1. numpy
+2. ijson (optional; without it the whole file is loaded with the standard json module)
+----------------------------------------------------------------------------------------
+'''
+import json
+import decimal
+import numpy as np
+from collections import OrderedDict
+
+try:
+    import ijson
+    from ijson.common import ObjectBuilder
+except ImportError:
+    ijson = None
+
+__all__ = ["EnvironmentLoggerData", "readEnvironmentLogger"]
+
+_FIXED_INFOS_PREFIX = "environment_sensor_fixed_infos"
+_READINGS_PREFIX    = "environment_sensor_readings.item"
+
+# Readings are appended into arrays of this initial length, which double whenever they are full
+_INITIAL_CAPACITY = 512
+
+
+class _ValueColumns(object):
+    '''
+    value, raw value (float32) and unit of one {"value", "rawValue", "unit"} member
+    '''
+
+    def __init__(self, capacity, unit):
+        self.unit     = unit
+        self.value    = np.full(capacity, np.nan, dtype=np.float32)
+        self.rawValue = np.full(capacity, np.nan, dtype=np.float32)
+
+    def resize(self, size):
+        self.value, self.rawValue = _resize(self.value, size), _resize(self.rawValue, size)
+
+
+class EnvironmentLoggerData(object):
+    '''
+    Fixed infos and column arrays of one EnvironmentLogger JSON file
+    '''
+
+    def __init__(self):
+        self.fixedInfos        = OrderedDict()
+        self.size              = 0
+        self.capacity          = _INITIAL_CAPACITY
+        self.time              = np.empty(self.capacity, dtype=np.float64)
+        self.weatherStation    = OrderedDict()
+        self.sensors           = OrderedDict()
+        self.wavelength        = None
+        self.spectrum          = None
+        self.maxFixedIntensity = np.empty(self.capacity, dtype=np.float32)
+        self.integrationTime   = np.empty(self.capacity, dtype=np.float32)
+
+    def append(self, reading, translateTime):
+        '''
+        Copy one reading (a parsed JSON object) into the next row of every column
+        '''
+        if self.size == self.capacity:
+            self._resize(self.capacity * 2)
+        row = self.size
+
+        self.time[row] = translateTime(reading["timestamp"])
+
+        for name, member in reading["weather_station"].items():
+            self._fill(self.weatherStation, name, member, row)
+
+        for name, member in reading.items():
+            if name.startswith("sensor"): # par sensor or co2 sensor
+                self._fill(self.sensors, name, member, row)
+
+        spectrometer = reading["spectrometer"]
+        if self.spectrum is None:
+            self.wavelength = np.asarray(spectrometer["wavelength"], dtype=np.float32)
+            self.spectrum   = np.empty((self.capacity, len(self.wavelength)), dtype=np.float32)
+        self.spectrum[row, :]       = spectrometer["spectrum"]
+        self.maxFixedIntensity[row] = float(spectrometer["maxFixedIntensity"])
+        self.integrationTime[row]   = float(spectrometer.get("integration time in us",
+                                                             spectrometer.get("integration time in ?s", np.nan)))
+        self.size += 1
+
+    def select(self, rows):
+        '''
+        Return a new EnvironmentLoggerData holding only the readings at the given row indexes
+        '''
+        selected                   = EnvironmentLoggerData()
+        selected.fixedInfos        = self.fixedInfos
+        selected.size              = selected.capacity = len(rows)
+        selected.time              = self.time[rows]
+        selected.wavelength        = self.wavelength
+        selected.spectrum          = None if self.spectrum is None else self.spectrum[rows]
+        selected.maxFixedIntensity = self.maxFixedIntensity[rows]
+        selected.integrationTime   = self.integrationTime[rows]
+        for source, target in ((self.weatherStation, selected.weatherStation), (self.sensors, selected.sensors)):
+            for name, columns in source.items():
+                target[name]          = _ValueColumns(0, columns.unit)
+                target[name].value    = columns.value[rows]
+                target[name].rawValue = columns.rawValue[rows]
+        return selected
+
+    def finish(self):
+        '''
+        Trim every column to the number of readings collected
+        '''
+        self._resize(self.size)
+        return self
+
+    def _fill(self, columns, name, member, row):
+        if name not in columns:
+            columns[name] = _ValueColumns(self.capacity, member["unit"])
+        columns[name].value[row]    = float(member["value"])
+        columns[name].rawValue[row] = float(member["rawValue"])
+
+    def _resize(self, capacity):
+        self.time              = _resize(self.time, capacity)
+        self.maxFixedIntensity = _resize(self.maxFixedIntensity, capacity)
+        self.integrationTime   = _resize(self.integrationTime, capacity)
+        if self.spectrum is not None:
+            self.spectrum = _resize(self.spectrum, capacity)
+        for columns in list(self.weatherStation.values()) + list(self.sensors.values()):
+            columns.resize(capacity)
+        self.capacity = capacity
+
+
+def _resize(array, length):
+    '''
+    Return array with its first axis changed to length; new rows are NaN
+    '''
+    if len(array) == length:
+        return array
+    resized = np.full((length,) + array.shape[1:], np.nan, dtype=array.dtype)
+    resized[:min(length, len(array))] = array[:length]
+    return resized
+
+
+def _iterateObjects(fileHandler):
+    '''
+    Yield (prefix, object) for the fixed infos and for every reading, building them one at a time
+    '''
+    if ijson is None:
+        master = json.load(fileHandler)
+        yield _FIXED_INFOS_PREFIX, master[_FIXED_INFOS_PREFIX]
+        for reading in master["environment_sensor_readings"]:
+            yield _READINGS_PREFIX, reading
+        return
+
+    builder, builderPrefix = None, None
+    for prefix, event, value in _parseEvents(fileHandler):
+        if builder is None:
+            if event != "start_map" or prefix not in (_FIXED_INFOS_PREFIX, _READINGS_PREFIX):
+                continue
+            builder, builderPrefix = ObjectBuilder(), prefix
+
+        builder.event(event, value)
+
+        if event == "end_map" and prefix == builderPrefix:
+            yield builderPrefix, builder.value
+            builder = None
+
+
+def _parseEvents(fileHandler):
+    '''
+    ijson parse events with numbers as floats instead of decimal.Decimal, which netCDF4 can't
+    store as attributes
+    '''
+    try:
+        return ijson.parse(fileHandler, use_float=True)
+    except TypeError: # ijson before 3.1 has no use_float
+        return ((prefix, event, float(value) if isinstance(value, decimal.Decimal) else value)
+                for prefix, event, value in ijson.parse(fileHandler))
+
+
+def readEnvironmentLogger(fileLocation, translateTime):
+    '''
+    Read an EnvironmentLogger JSON file into an EnvironmentLoggerData in one pass;
+    translateTime converts the "timestamp" strings into numbers
+    '''
+    loggerData = EnvironmentLoggerData()
+
+    with open(fileLocation, 'rb') as fileHandler:
+        for prefix, member in _iterateObjects(fileHandler):
+            if prefix == _FIXED_INFOS_PREFIX:
+                loggerData.fixedInfos = member
+            else:
+                loggerData.append(member, translateTime)
+
+    return loggerData.finish()
@@ -15,31 +15,34 @@ python environmental_logger_unittest.py <testing JSON location>
 
 import unittest
 import sys
+import json
+import shutil
+import tempfile
+import environmental_logger_reader
 from environmental_logger_json2netcdf import *
 
-fileLocation = sys.argv[1]
+fileLocation = sys.argv[1] if len(sys.argv) > 1 else ""
 
 
 class environmental_logger_json2netcdfUnitTest(unittest.TestCase):
 
 	def setUp(self):
-		self.testCase = JSONHandler(fileLocation)
+		self.testCase = JSONHandler(fileLocation) if os.path.isfile(fileLocation) else None
 
 	@unittest.skipIf(not os.path.isfile(fileLocation),
 					 "the testing JSON file does not exist")
 	def test_canGetAWellFormattedJSON(self):
 		'''
-		This test checks if the EnvironmentalLogger received a legal JSON file. Since
-		JSONHandler just simply pass the JSON to built-in JSON module and is guaranteed
-		to be noexcept, any error in this test case would be cause by a badly formatted 
-		JSON
+		This test checks if the EnvironmentalLogger received a legal JSON file, which the
+		reader turns into an EnvironmentLoggerData with one time per reading. Any error
+		in this test case would be caused by a badly formatted JSON
 
 		Skipped if the file does not exist
 		'''
 
-		self.setUp()
-		self.assertEqual(len(self.testCase), 4)
-		self.assertIs(type(self.testCase[0]), list)
+		self.assertIsInstance(self.testCase, EnvironmentLoggerData)
+		self.assertTrue(self.testCase.fixedInfos)
+		self.assertEqual(self.testCase.time.shape, (self.testCase.size,))
 
 	@unittest.skipIf(not os.path.isfile(fileLocation),
 					 "the testing JSON file does not exist")
@@ -51,9 +54,8 @@ class environmental_logger_json2netcdfUnitTest(unittest.TestCase):
 		Skipped if the file does not exist		
 		'''
 
-		self.setUp()
-		self.assertEqual(len(self.testCase[1]), 1024)
-		self.assertIsInstance(self.testCase[1][0], float)
+		self.assertEqual(len(self.testCase.wavelength), 1024)
+		self.assertIsInstance(self.testCase.wavelength[0], np.floating)
 
 
 	@unittest.skipIf(not os.path.isfile(fileLocation),
@@ -61,55 +63,249 @@ class environmental_logger_json2netcdfUnitTest(unittest.TestCase):
 	def test_canGetExpectedNumberOfSpectrum(self):
 		'''
 		This test checks if the environmental_logger_json2netcdf can get the spectrum by
-		testing whether it is a 2D-array (It is implemented as a 2D-array)
+		testing whether it is a 2D-array with one row per reading
 
 		Skipped if the file does not exist		
 		'''
 
-		self.setUp()
-		self.assertEqual(len(self.testCase), 4)
-		self.assertEqual(len(self.testCase[2]), 39)
+		self.assertEqual(self.testCase.spectrum.shape, (39, 1024))
 
 	@unittest.skipIf(not os.path.isfile(fileLocation),
 					 "the testing JSON file does not exist")
-	def test_canGetAListOfValueFromImportedJSON(self):
+	def test_canGetAColumnOfValueFromImportedJSON(self):
 		'''
-		This test checks if the environmental_logger_json2netcdf can get any value from 
-		the JSON (as a list)
+		This test checks if the environmental_logger_json2netcdf can get the values of
+		every weather station variable (as a column with one value per reading)
 
 		Skipped if the file does not exist		
 		'''
 
-		self.setUp()
-		testingJSON = [JSONMembers[u"environment_sensor_set_reading"] for JSONMembers in self.testCase[0]]
-		self.assertIsInstance(getListOfValue(testingJSON, u"weatherStationAirPressure"), list)
-		self.assertIsInstance(getListOfValue(testingJSON, u"weatherStationAirPressure")[0], float)
-		self.assertEqual(len(getListOfValue(testingJSON, u"weatherStationAirPressure")), 39)
+		self.assertTrue(self.testCase.weatherStation)
+		for name, columns in self.testCase.weatherStation.items():
+			self.assertEqual(columns.value.shape, (39,))
+			self.assertIsInstance(columns.value[0], np.floating)
 
 	@unittest.skipIf(not os.path.isfile(fileLocation),
 					 "the testing JSON file does not exist")
-	def test_canGetAListOfRawValueFromImportedJSON(self):
+	def test_canGetAColumnOfRawValueFromImportedJSON(self):
 		'''
-		This test checks if the environmental_logger_json2netcdf can get any raw value from 
-		the JSON (as a list)
+		This test checks if the environmental_logger_json2netcdf can get the raw values of
+		every weather station variable (as a column with one value per reading)
 
 		Skipped if the file does not exist		
 		'''
 
-		self.setUp()
-		testingJSON = [JSONMembers[u"environment_sensor_set_reading"] for JSONMembers in self.testCase[0]]
-		self.assertIsInstance(getListOfRawValue(testingJSON, u"weatherStationAirPressure"), list)
-		self.assertIsInstance(getListOfRawValue(testingJSON, u"weatherStationAirPressure")[0], float)
-		self.assertEqual(len(getListOfRawValue(testingJSON, u"weatherStationAirPressure")), 39)
+		for name, columns in self.testCase.weatherStation.items():
+			self.assertEqual(columns.rawValue.shape, (39,))
+			self.assertIsInstance(columns.rawValue[0], np.floating)
 
 
 	def test_canTranslateIntoLegalName(self):
-		pass
+		self.assertEqual(renameTheValue("sensor par"), "Sensor_Photosynthetically_Active_Radiation")
 		
 
 	def tearDown(self):
 		pass
 
 
+def writeFixtureJSON(jsonLocation, timestamps):
+	'''
+	Write a small EnvironmentLogger JSON with one reading per timestamp
+	'''
+	wavelength = [float(w) for w in np.linspace(337.7, 824.0, len(FLX_SNS))]
+	readings   = list()
+	for index, timestamp in enumerate(timestamps):
+		readings.append({"timestamp": timestamp,
+						 "weather_station": {"airPressure": {"value": 1013.25 + index, "rawValue": 1013.25 + index, "unit": "hPa"},
+											 "temperature": {"value": 21.5, "rawValue": 21.5, "unit": "DegCelsius"}},
+						 "sensor par": {"value": 812.5, "rawValue": 812.5, "unit": "umol/(m^2*s)"},
+						 "sensor co2": {"value": 402, "rawValue": 402, "unit": "ppm"},
+						 "spectrometer": {"wavelength": wavelength,
+										  "spectrum": [2000 + index + i % 7 for i in range(len(wavelength))],
+										  "maxFixedIntensity": 16383,
+										  "integration time in us": 5000}})
+
+	master = {"environment_sensor_fixed_infos": {"weather_station": {"height": 2.5, "name": "Thies Clima"},
+												 "spectrometer": {"serial": "STS-VIS", "slit": 0.025},
+												 "par_sensor": {"height": 2.0},
+												 "co2_sensor": {"height": 2.0}},
+			  "environment_sensor_readings": readings}
+	with open(jsonLocation, 'w') as jsonFile:
+		json.dump(master, jsonFile)
+
+
+class environmental_logger_readerUnitTest(unittest.TestCase):
+
+	def setUp(self):
+		self.tempDirectory = tempfile.mkdtemp()
+		self.jsonLocation  = os.path.join(self.tempDirectory, "2016-04-07_12-00-07_environmentlogger.json")
+		writeFixtureJSON(self.jsonLocation, ["2016.04.07-12:00:07", "2016.04.07-12:00:09", "2016.04.07-12:00:11"])
+
+	def tearDown(self):
+		shutil.rmtree(self.tempDirectory)
+
+	def convertFixture(self):
+		'''
+		Convert the fixture JSON to netCDF and check what was written
+		'''
+		netCDFLocation = os.path.join(self.tempDirectory, "environmentlogger.nc")
+		main(JSONHandler(self.jsonLocation), netCDFLocation, recordTime="test", commandLine="test")
+
+		with Dataset(netCDFLocation) as netCDFHandler:
+			self.assertEqual(len(netCDFHandler.variables["time"]), 3)
+			self.assertAlmostEqual(netCDFHandler.variables["time"][0], translateTime("2016.04.07-12:00:07"))
+			self.assertEqual(netCDFHandler.groups["weather_station"].weather_stationheight, 2.5)
+			np.testing.assert_allclose(netCDFHandler.groups["weather_station"].variables["airPressure"][:],
+									   [1013.25, 1014.25, 1015.25])
+			self.assertEqual(netCDFHandler.groups["spectrometer"].variables["spectrum"].shape, (3, len(FLX_SNS)))
+			self.assertEqual(netCDFHandler.variables["flx_dwn"].shape, (3,))
+
+	@unittest.skipIf(environmental_logger_reader.ijson is None, "ijson is not installed")
+	def test_canConvertFixtureWithIjson(self):
+		'''
+		This test converts the fixture streamed by ijson, whose numbers must reach the
+		netCDF attributes as floats
+		'''
+
+		self.convertFixture()
+
+	def test_canConvertFixtureWithoutIjson(self):
+		'''
+		This test converts the fixture loaded whole by the json module, as when ijson is not installed
+		'''
+
+		streamingParser = environmental_logger_reader.ijson
+		environmental_logger_reader.ijson = None
+		try:
+			self.convertFixture()
+		finally:
+			environmental_logger_reader.ijson = streamingParser
+
+
+class environmental_logger_dailyUnitTest(unittest.TestCase):
+
+	def setUp(self):
+		self.tempDirectory = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.tempDirectory)
+
+	def appendFixture(self, timestamps):
+		'''
+		Append the readings of a fixture JSON to the daily files, the way the daily mode does
+		'''
+		jsonLocation = os.path.join(self.tempDirectory, "environmentlogger.json")
+		writeFixtureJSON(jsonLocation, timestamps)
+		for dayData in splitByDay(JSONHandler(jsonLocation)):
+			appendToDailyFile(dayData, os.path.join(self.tempDirectory, dailyFileName(dayData)),
+							  recordTime="test", commandLine="test")
+
+	def readTimes(self, fileName):
+		with Dataset(os.path.join(self.tempDirectory, fileName)) as netCDFHandler:
+			return netCDFHandler.variables["time"][:], netCDFHandler.groups["weather_station"].variables["airPressure"][:]
+
+	def test_readingsAfterMidnightGoToTheNextDay(self):
+		'''
+		This test checks that a file spanning midnight is split into the files of both days
+		'''
+
+		self.appendFixture(["2016.04.07-23:59:58", "2016.04.07-23:59:59", "2016.04.08-00:00:01"])
+		self.assertEqual(len(self.readTimes("2016-04-07_environmentlogger.nc")[0]), 2)
+		self.assertEqual(len(self.readTimes("2016-04-08_environmentlogger.nc")[0]), 1)
+
+	def test_outOfOrderReadingsKeepTimeInOrder(self):
+		'''
+		This test checks that readings ingested after later ones are merged into time order,
+		together with their values, and that re-ingested readings are skipped
+		'''
+
+		self.appendFixture(["2016.04.07-12:00:05", "2016.04.07-12:00:07"])
+		self.appendFixture(["2016.04.07-12:00:01", "2016.04.07-12:00:06", "2016.04.07-12:00:07"])
+
+		times, airPressure = self.readTimes("2016-04-07_environmentlogger.nc")
+		expected = [translateTime(timestamp) for timestamp in
+					["2016.04.07-12:00:01", "2016.04.07-12:00:05", "2016.04.07-12:00:06", "2016.04.07-12:00:07"]]
+		np.testing.assert_allclose(times, expected)
+		np.testing.assert_allclose(airPressure, [1013.25, 1013.25, 1014.25, 1014.25])
+
+
+def referenceBandwidth(wvl_lgr):
+	'''
+	Element-by-element bandwidth, written the way it was computed before the vectorization
+	'''
+	wvl_ntf = [(wvl_lgr[i] + wvl_lgr[i+1]) / 2.0 for i in range(len(wvl_lgr) - 1)]
+	delta   = [wvl_ntf[i+1] - wvl_ntf[i] for i in range(len(wvl_ntf) - 1)]
+	delta.insert(0, 2*(wvl_ntf[0] - wvl_lgr[0]))
+	delta.append(2*(wvl_lgr[-1] - wvl_ntf[-1]))
+	return delta
+
+
+def referenceDownwellingFlux(spectrum, delta):
+	'''
+	Element-by-element downwelling spectral flux and flux, one row per time
+	'''
+	spectralFlux, flux = list(), list()
+	for row in spectrum:
+		spectralFluxRow = [FLX_SNS[i] * 1.0e-6 * (float(row[i]) - float(DARK_REFERENCE[i])) / delta[i] / AREA / 5000.0e-6
+						   for i in range(len(row))]
+		spectralFlux.append(spectralFluxRow)
+		flux.append(sum(spectralFluxRow[i] * delta[i] for i in range(len(row))))
+	return spectralFlux, flux
+
+
+class environmental_logger_calculationUnitTest(unittest.TestCase):
+
+	def setUp(self):
+		self.wavelength = np.linspace(337.0, 824.0, len(FLX_SNS))
+		self.spectrum   = np.random.RandomState(20161019).randint(1450, 9000, size=(3, len(FLX_SNS))).astype(np.float32)
+
+	def test_bandwidthMatchesReference(self):
+		'''
+		This test checks if the vectorized bandwidth equals the element-by-element one,
+		including the mirrored first and last bands
+		'''
+
+		delta = calculateBandwidth(self.wavelength)
+		self.assertEqual(delta.shape, (len(self.wavelength),))
+		np.testing.assert_allclose(delta, referenceBandwidth(list(self.wavelength)), rtol=1e-12)
+
+	def test_downwellingFluxMatchesReference(self):
+		'''
+		This test checks if the broadcast spectral flux and the per-time flux equal
+		the element-by-element ones
+		'''
+
+		delta = calculateBandwidth(self.wavelength)
+		spectralFlux, flux = calculateDownwellingSpectralFlux(self.wavelength, self.spectrum, delta)
+		referenceSpectralFlux, referenceFlux = referenceDownwellingFlux(self.spectrum, list(delta))
+
+		self.assertEqual(spectralFlux.shape, self.spectrum.shape)
+		self.assertEqual(flux.shape, (len(self.spectrum),))
+		np.testing.assert_allclose(spectralFlux, referenceSpectralFlux, rtol=1e-5)
+		np.testing.assert_allclose(flux, referenceFlux, rtol=1e-4)
+
+	@unittest.skipIf(not os.path.isfile(fileLocation),
+					 "the testing JSON file does not exist")
+	def test_downwellingFluxMatchesReferenceOnTestingJSON(self):
+		'''
+		This test repeats the comparison on the wavelengths and spectrum of the testing JSON
+
+		Skipped if the file does not exist
+		'''
+
+		loggerData = JSONHandler(fileLocation)
+		delta = calculateBandwidth(loggerData.wavelength)
+		spectralFlux, flux = calculateDownwellingSpectralFlux(loggerData.wavelength, loggerData.spectrum, delta)
+		referenceSpectralFlux, referenceFlux = referenceDownwellingFlux(loggerData.spectrum, list(delta))
+
+		np.testing.assert_allclose(delta, referenceBandwidth(list(loggerData.wavelength.astype(np.float64))), rtol=1e-12)
+		np.testing.assert_allclose(spectralFlux, referenceSpectralFlux, rtol=1e-5)
+		np.testing.assert_allclose(flux, referenceFlux, rtol=1e-4)
+
+
 if __name__ == "__main__":
-	unittest.TextTestRunner(verbosity=2).run(unittest.TestLoader().loadTestsFromTestCase(environmental_logger_json2netcdfUnitTest))
+	testLoader = unittest.TestLoader()
+	unittest.TextTestRunner(verbosity=2).run(unittest.TestSuite([testLoader.loadTestsFromTestCase(environmental_logger_json2netcdfUnitTest),
+																 testLoader.loadTestsFromTestCase(environmental_logger_readerUnitTest),
+																 testLoader.loadTestsFromTestCase(environmental_logger_dailyUnitTest),
+																 testLoader.loadTestsFromTestCase(environmental_logger_calculationUnitTest)]))
@@ -0,0 +1,138 @@
+import os
+import re
+import json
+import time
+import logging
+import tempfile
+import threading
+try:
+    from os import scandir
+except ImportError:
+    from scandir import scandir
+
+import counts
+
+"""
+Index of filesystem counts (timestamp, plot and regex types, see counts.py) by target and date.
+
+Every entry keeps the mtime of the directories it was counted from, so a directory is only
+listed again once its mtime changes; for unchanged dates a count costs one stat (plus one
+per timestamp directory for timestamp-level regex counts).
+"""
+
+# Directories modified this recently are counted but not indexed, since a change within the
+# same mtime tick would go unnoticed
+MTIME_SETTLE_SECONDS = 2
+
+
+def compile_count_regexes(count_defs):
+    """Return dict of every regex in the count definitions, compiled, by pattern."""
+    regexes = {}
+    for sensor in count_defs:
+        for target_def in count_defs[sensor].values():
+            if "regex" in target_def and target_def["regex"] not in regexes:
+                regexes[target_def["regex"]] = re.compile(target_def["regex"])
+    return regexes
+
+class CountIndex(object):
+    def __init__(self, index_path=None, count_defs=counts.SENSOR_COUNT_DEFINITIONS):
+        self.index_path = index_path
+        self.regexes = compile_count_regexes(count_defs)
+        self.entries = {}
+        self.changed = False
+        self.lock = threading.Lock()
+        # Held while writing, so jobs of several sensors saving at once don't interleave
+        self.save_lock = threading.Lock()
+
+        if index_path and os.path.isfile(index_path):
+            try:
+                with open(index_path, 'r') as f:
+                    self.entries = json.load(f)
+            except (IOError, ValueError) as e:
+                logging.info("Could not load count index %s: %s" % (index_path, e))
+
+    def save(self):
+        """Write the index to disk if it changed; the file is written next to it and renamed into place."""
+        if not self.index_path or not self.changed:
+            return
+        with self.save_lock:
+            with self.lock:
+                entries = dict(self.entries)
+                self.changed = False
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.index_path)),
+                                            prefix=os.path.basename(self.index_path), suffix=".tmp")
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(entries, f)
+                os.rename(tmp_path, self.index_path)
+            except Exception:
+                self.changed = True
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+
+    def count(self, target_count, target_def, date):
+        """Return count of a timestamp, plot or regex target for a date, or None if its directory doesn't exist."""
+        date_dir = os.path.join(target_def["path"], date)
+        try:
+            date_mtime = os.stat(date_dir).st_mtime
+        except OSError:
+            return None
+
+        key = "%s/%s" % (target_count, date)
+        entry = self.entries.get(key)
+        if entry and entry["path"] != date_dir:
+            entry = None
+        now = time.time()
+
+        if target_def["type"] == "regex":
+            new_entry = self._count_regex(date_dir, date_mtime, self.regexes[target_def["regex"]], entry, now)
+        else:
+            if entry and entry["mtime"] == date_mtime:
+                return entry["count"]
+            # TODO: Only count non-empty directories
+            new_entry = {"path": date_dir, "mtime": date_mtime, "count": len(os.listdir(date_dir))}
+
+        total = new_entry["count"] + sum(sub[1] for sub in new_entry.get("subdirs", {}).values())
+        if new_entry is not entry:
+            with self.lock:
+                if now - date_mtime > MTIME_SETTLE_SECONDS:
+                    self.entries[key] = new_entry
+                else:
+                    self.entries.pop(key, None)
+                self.changed = True
+        return total
+
+    def _count_regex(self, date_dir, date_mtime, regex, entry, now):
+        """Return index entry of files matching regex in a date directory and its timestamp directories."""
+        cached_subdirs = entry["subdirs"] if entry else {}
+
+        if entry and entry["mtime"] == date_mtime:
+            # Same files and timestamp directories; only check the timestamp directories
+            subdirs = {}
+            for name in cached_subdirs:
+                subdirs[name] = self._count_subdir(os.path.join(date_dir, name), regex, cached_subdirs[name], now)
+            if subdirs == cached_subdirs:
+                return entry
+            return {"path": date_dir, "mtime": date_mtime, "count": entry["count"], "subdirs": subdirs}
+
+        count = 0
+        subdirs = {}
+        for date_content in scandir(date_dir):
+            if date_content.is_dir():
+                # This is timestamp-level search
+                subdirs[date_content.name] = self._count_subdir(date_content.path, regex,
+                                                                cached_subdirs.get(date_content.name), now)
+            elif regex.match(date_content.name):
+                # No timestamp (e.g. fullfield)
+                count += 1
+        return {"path": date_dir, "mtime": date_mtime, "count": count, "subdirs": subdirs}
+
+    def _count_subdir(self, ts_dir, regex, cached, now):
+        """Return [mtime, count] of files matching regex in a timestamp directory, reusing cached if unchanged."""
+        ts_mtime = os.stat(ts_dir).st_mtime
+        if cached and cached[0] == ts_mtime:
+            return cached
+        count = len([f for f in os.listdir(ts_dir) if regex.match(f)])
+        # A [None, count] entry is recounted next time
+        return [ts_mtime if now - ts_mtime > MTIME_SETTLE_SECONDS else None, count]
@@ -0,0 +1,210 @@
+import threading
+import datetime
+import logging
+from collections import OrderedDict
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+
+"""
+Scheduler running count jobs (one sensor over a range of dates) on a pool of worker threads.
+
+The dates of a job are split into chunks that any worker can count, so jobs for different
+sensors and the chunks of one long job all run at the same time. Work shared by the dates of
+a job (such as one grouped PSQL query for the whole range) is done once, before its chunks
+are queued. The results of a job are upserted into the SQLite count store in one transaction,
+under a lock per sensor, so jobs of the same sensor write (and bump its version and save the
+count index) one after the other instead of waiting on the database lock. A job submitted
+while an identical one (same sensor and dates) is queued or running is coalesced into it.
+"""
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Number of finished jobs kept for the status endpoint
+JOB_HISTORY = 100
+
+
+class CountScheduler(object):
+    def __init__(self, count_date_fn, write_fn, connect_fn, prepare_fn=None, workers=4, chunk_days=7):
+        """Start the worker threads.
+
+        count_date_fn(sensor, date, psql_conn, context) returns (row, psql_conn) for one date
+        write_fn(sensor, rows) stores an OrderedDict of date -> row for a sensor
+        connect_fn() returns a new PSQL connection; every worker keeps its own
+        prepare_fn(sensor, dates, psql_conn) returns (context, psql_conn) for all dates of a job
+        """
+        self.count_date_fn = count_date_fn
+        self.prepare_fn = prepare_fn
+        self.write_fn = write_fn
+        self.connect_fn = connect_fn
+        self.chunk_days = chunk_days
+
+        self.tasks = Queue()
+        self.jobs = OrderedDict()
+        self.sensor_locks = {}
+        self.lock = threading.Lock()
+        self.next_id = 1
+
+        for i in range(workers):
+            worker = threading.Thread(target=self._work, name="counter-%s" % i)
+            worker.daemon = True
+            worker.start()
+
+    def submit(self, sensor, dates):
+        """Queue a count job and return its id, or the id of the identical job already queued or running."""
+        with self.lock:
+            for job_id, job in self.jobs.items():
+                if job["status"] in [QUEUED, RUNNING] and job["sensor"] == sensor and job["dates"] == dates:
+                    logging.info("Count of %s for %s - %s already scheduled as job %s" % (
+                        sensor, dates[0], dates[-1], job_id))
+                    return job_id
+
+            job_id = str(self.next_id)
+            self.next_id += 1
+            chunks = [dates[i:i+self.chunk_days] for i in range(0, len(dates), self.chunk_days)]
+            self.jobs[job_id] = {
+                "sensor": sensor,
+                "dates": dates,
+                "status": QUEUED,
+                "submitted": _now(),
+                "started": None,
+                "finished": None,
+                "dates_counted": 0,
+                "error": None,
+                "pending": len(chunks),
+                "chunks": chunks,
+                "context": None,
+                "rows": {},
+                "done_event": threading.Event()
+            }
+            if sensor not in self.sensor_locks:
+                self.sensor_locks[sensor] = threading.Lock()
+            self._trim_history()
+
+        logging.info("Scheduled count of %s for %s dates as job %s" % (sensor, len(dates), job_id))
+        if not chunks:
+            self._finish(job_id)
+        elif self.prepare_fn:
+            self.tasks.put((job_id, None))
+        else:
+            self._queue_chunks(job_id)
+        return job_id
+
+    def wait(self, job_ids):
+        """Block until the given jobs are finished."""
+        for job_id in job_ids:
+            job = self.jobs.get(job_id)
+            if job:
+                job["done_event"].wait()
+
+    def status(self, job_id=None):
+        """Return status of one job (None if unknown), or of all known jobs by id."""
+        with self.lock:
+            if job_id is not None:
+                return _public(self.jobs[job_id]) if job_id in self.jobs else None
+            return OrderedDict((jid, _public(job)) for jid, job in self.jobs.items())
+
+    def _queue_chunks(self, job_id):
+        for chunk in self.jobs[job_id]["chunks"]:
+            self.tasks.put((job_id, chunk))
+
+    def _work(self):
+        local_conn = None
+        while True:
+            job_id, dates = self.tasks.get()
+            with self.lock:
+                job = self.jobs.get(job_id)
+                if job is None:
+                    # Only finished jobs (no queued tasks) are trimmed; a stray task must not end the worker
+                    logging.warning("Skipping task of unknown count job %s" % job_id)
+                    self.tasks.task_done()
+                    continue
+                if job["status"] == QUEUED:
+                    job["status"] = RUNNING
+                    job["started"] = _now()
+
+            if dates is None:
+                # Preparation task of a job; its chunks can only be counted afterwards
+                try:
+                    if local_conn is None:
+                        local_conn = self.connect_fn()
+                    job["context"], local_conn = self.prepare_fn(job["sensor"], job["dates"], local_conn)
+                except Exception:
+                    logging.exception("Preparing count job %s failed; counting dates one by one" % job_id)
+                    local_conn = None
+                self._queue_chunks(job_id)
+                self.tasks.task_done()
+                continue
+
+            rows = {}
+            try:
+                if local_conn is None:
+                    local_conn = self.connect_fn()
+                for date in dates:
+                    if job["status"] == FAILED:
+                        break
+                    rows[date], local_conn = self.count_date_fn(job["sensor"], date, local_conn, job["context"])
+            except Exception as e:
+                logging.exception("Count job %s failed" % job_id)
+                local_conn = None
+                with self.lock:
+                    job["status"] = FAILED
+                    job["error"] = str(e)
+
+            with self.lock:
+                job["rows"].update(rows)
+                job["dates_counted"] += len(rows)
+                job["pending"] -= 1
+                last_chunk = job["pending"] == 0
+            if last_chunk:
+                self._finish(job_id)
+            self.tasks.task_done()
+
+    def _finish(self, job_id):
+        """Write the rows of a job once all its chunks are counted."""
+        job = self.jobs[job_id]
+        try:
+            if job["rows"]:
+                rows = OrderedDict((date, job["rows"][date]) for date in job["dates"] if date in job["rows"])
+                with self.sensor_locks[job["sensor"]]:
+                    self.write_fn(job["sensor"], rows)
+        except Exception as e:
+            logging.exception("Writing counts of job %s failed" % job_id)
+            job["error"] = str(e)
+            job["status"] = FAILED
+
+        with self.lock:
+            if job["status"] != FAILED:
+                job["status"] = DONE
+            job["finished"] = _now()
+            job["rows"] = {}
+            job["context"] = None
+        job["done_event"].set()
+
+    def _trim_history(self):
+        # A job is FAILED as soon as one chunk fails, but only finished once none of its chunks are queued
+        finished = [jid for jid, job in self.jobs.items() if job["finished"] is not None]
+        for jid in finished[:max(0, len(finished) - JOB_HISTORY)]:
+            del self.jobs[jid]
+
+
+def _now():
+    return datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+def _public(job):
+    return {
+        "sensor": job["sensor"],
+        "start": job["dates"][0] if job["dates"] else None,
+        "end": job["dates"][-1] if job["dates"] else None,
+        "status": job["status"],
+        "submitted": job["submitted"],
+        "started": job["started"],
+        "finished": job["finished"],
+        "dates": len(job["dates"]),
+        "dates_counted": job["dates_counted"],
+        "error": job["error"]
+    }
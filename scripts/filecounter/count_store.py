@@ -0,0 +1,149 @@
+import os
+import time
+import sqlite3
+import logging
+from collections import OrderedDict
+import pandas as pd
+
+import counts
+
+"""
+SQLite store of counts keyed by (sensor, target, date).
+
+Count jobs upsert only the dates they counted; the CSV downloads and dashboard views are
+built from indexed queries over the dates they show, in the same column layout the per-sensor
+CSVs had (date, then each target count followed by its percentage of the parent if it has one).
+"""
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS counts (sensor TEXT NOT NULL, target TEXT NOT NULL, date TEXT NOT NULL, " +
+    "count INTEGER, percent REAL, updated REAL, PRIMARY KEY (sensor, target, date))",
+    "CREATE INDEX IF NOT EXISTS counts_sensor_date_idx ON counts (sensor, date)",
+    "CREATE TABLE IF NOT EXISTS versions (sensor TEXT PRIMARY KEY, version INTEGER)"
+]
+
+
+class CountStore(object):
+    def __init__(self, db_path, count_defs=counts.SENSOR_COUNT_DEFINITIONS):
+        self.db_path = db_path
+        self.count_defs = count_defs
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir and not os.path.isdir(db_dir):
+            os.makedirs(db_dir)
+        conn = self._connect()
+        with conn:
+            for statement in SCHEMA:
+                conn.execute(statement)
+        conn.close()
+
+    def _connect(self):
+        # One connection per call, as the Flask views and the count workers run on separate threads
+        return sqlite3.connect(self.db_path, timeout=60)
+
+    def columns(self, sensor):
+        """Return column names of a sensor table: date, then each target and its percentage if it has a parent."""
+        cols = ["date"]
+        targets = self.count_defs[sensor]
+        for target_count in targets:
+            cols.append(target_count)
+            if "parent" in targets[target_count]:
+                cols.append(target_count + '%')
+        return cols
+
+    def upsert(self, sensor, rows):
+        """Store counts and percentages by date, as returned by count_date, replacing existing values."""
+        now = time.time()
+        targets = self.count_defs[sensor]
+        records = []
+        for date in rows:
+            date_counts, percentages = rows[date]
+            for target_count in targets:
+                records.append((sensor, target_count, date, date_counts[target_count],
+                                percentages.get(target_count), now))
+
+        conn = self._connect()
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO counts VALUES (?, ?, ?, ?, ?, ?)", records)
+            self._bump_version(conn, sensor)
+        conn.close()
+
+    def _bump_version(self, conn, sensor):
+        conn.execute("INSERT OR IGNORE INTO versions VALUES (?, 0)", (sensor,))
+        conn.execute("UPDATE versions SET version=version+1 WHERE sensor=?", (sensor,))
+
+    def version(self, sensor):
+        """Return number that changes whenever counts of a sensor are stored or deleted."""
+        conn = self._connect()
+        found = conn.execute("SELECT version FROM versions WHERE sensor=?", (sensor,)).fetchone()
+        conn.close()
+        return found[0] if found else 0
+
+    def has_counts(self, sensor):
+        conn = self._connect()
+        found = conn.execute("SELECT 1 FROM counts WHERE sensor=? LIMIT 1", (sensor,)).fetchone() is not None
+        conn.close()
+        return found
+
+    def delete(self, sensor):
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM counts WHERE sensor=?", (sensor,))
+            self._bump_version(conn, sensor)
+        conn.close()
+
+    def dataframe(self, sensor, start=None, end=None, last_days=None):
+        """Return pandas DataFrame of counts of a sensor by date, optionally limited to a date range or the last days."""
+        query = "SELECT date, target, count, percent FROM counts WHERE sensor=?"
+        params = [sensor]
+        if start:
+            query += " AND date >= ?"
+            params.append(start)
+        if end:
+            query += " AND date <= ?"
+            params.append(end)
+        if last_days:
+            query += " AND date IN (SELECT DISTINCT date FROM counts WHERE sensor=? ORDER BY date DESC LIMIT ?)"
+            params.extend([sensor, last_days])
+        query += " ORDER BY date"
+
+        targets = self.count_defs[sensor]
+        by_date = OrderedDict()
+        conn = self._connect()
+        for date, target_count, count, percent in conn.execute(query, params):
+            if target_count not in targets:
+                continue
+            row = by_date.setdefault(date, {"date": date})
+            row[target_count] = count
+            if "parent" in targets[target_count]:
+                row[target_count + '%'] = percent
+        conn.close()
+
+        df = pd.DataFrame(list(by_date.values()), columns=self.columns(sensor))
+        # Dates counted before a target was added to the definitions have no value for it
+        for column in df.columns[1:]:
+            df[column] = df[column].fillna(0)
+            if not column.endswith('%'):
+                df[column] = df[column].astype(int)
+        return df
+
+    def import_csv(self, sensor, csv_path):
+        """Load counts of a sensor from a CSV written by earlier versions, if its columns still match."""
+        df = pd.read_csv(csv_path, index_col=False)
+        if list(df.columns.values) != self.columns(sensor):
+            logging.info("Not importing %s, columns don't match the count definitions of %s" % (csv_path, sensor))
+            return 0
+
+        targets = self.count_defs[sensor]
+        rows = OrderedDict()
+        for _, csv_row in df.iterrows():
+            date_counts = {}
+            percentages = {}
+            for target_count in targets:
+                date_counts[target_count] = int(csv_row[target_count])
+                if "parent" in targets[target_count]:
+                    percentages[target_count] = float(csv_row[target_count + '%'])
+            rows[str(csv_row["date"])[:10]] = (date_counts, percentages)
+        self.upsert(sensor, rows)
+        logging.info("Imported %s dates of %s from %s" % (len(rows), sensor, csv_path))
+        return len(rows)
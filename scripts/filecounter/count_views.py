@@ -0,0 +1,92 @@
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+
+"""
+Rendering of the count tables of the dashboard.
+
+Rendered pages are cached by view, sensor, parameters and count store version of the sensor,
+so a page is only rendered again once new counts are stored; the cache key doubles as the ETag
+of the page. Percentage cell colors are computed for whole columns at once, and long seasons
+are split into pages.
+"""
+
+# Dates per page of the season views
+PAGE_SIZE = 31
+
+# Rendered pages kept in memory
+CACHE_ENTRIES = 64
+
+
+def percent_colors(values):
+    """Return array of cell styles for an array of percentages (0-100), as color_percents does for one."""
+    values = np.asarray(values, dtype=float)
+    colors = np.select([values == 100, values >= 99, values >= 95], ['green', 'greenyellow', 'yellow'], 'lightcoral')
+    return np.char.add('background-color: ', colors.astype(str))
+
+def render_count_table(df, percent_columns):
+    """Return html table of a count DataFrame, with percentage columns colored."""
+    columns = list(df.columns.values)
+    cells = [df[col].astype(str).values for col in columns]
+    styles = {}
+    for col in percent_columns:
+        styles[col] = percent_colors(df[col].values)
+
+    html = ['<table border="1"><thead><tr><th></th>']
+    html += ['<th>%s</th>' % col for col in columns]
+    html.append('</tr></thead><tbody>')
+    for row_idx in range(len(df)):
+        html.append('<tr><th>%s</th>' % df.index[row_idx])
+        for col_idx, col in enumerate(columns):
+            if col in styles:
+                html.append('<td style="%s">%s</td>' % (styles[col][row_idx], cells[col_idx][row_idx]))
+            else:
+                html.append('<td>%s</td>' % cells[col_idx][row_idx])
+        html.append('</tr>')
+    html.append('</tbody></table>')
+    return ''.join(html)
+
+def paginate(df, page, page_size=PAGE_SIZE):
+    """Return (rows of the page, page number, number of pages) of a DataFrame; pages start at 1."""
+    pages = max(1, int(np.ceil(len(df) / float(page_size))))
+    page = min(max(1, page), pages)
+    return df.iloc[(page-1)*page_size:page*page_size], page, pages
+
+def render_page_links(url, page, pages):
+    """Return html links to the other pages of a view, empty if there is only one page."""
+    if pages <= 1:
+        return ''
+    links = []
+    for p in range(1, pages+1):
+        if p == page:
+            links.append('<b>%s</b>' % p)
+        else:
+            links.append('<a href="%s?page=%s">%s</a>' % (url, p, p))
+    return '<div>Page: %s</div>' % ' '.join(links)
+
+
+class ViewCache(object):
+    def __init__(self, max_entries=CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def etag(key):
+        return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+    def get(self, key, render_fn):
+        """Return (etag, html) of a view, calling render_fn() to render it if it isn't cached."""
+        with self.lock:
+            if key in self.entries:
+                entry = self.entries.pop(key)
+                self.entries[key] = entry
+                return entry
+
+        entry = (self.etag(key), render_fn())
+        with self.lock:
+            self.entries[key] = entry
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return entry
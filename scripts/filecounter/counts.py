@@ -11,7 +11,9 @@ Types:
 Other fields:
     path:       path containing date directories for timestamp or regex counts
     regex:      regular expression to execute on date directory for regex counts
-    query:      postgres query to execute for psql counts
+    query_count:    postgres query counting rows of one date (bound to the date) for psql counts
+    query_grouped:  postgres query counting rows by date between two dates (bound to the start and end date)
+    query_list:     postgres query listing the rows of one date (bound to the date) for psql counts
     parent:     previous count definition for % generation (e.g. bin2tif's parent is stereoTop)
 """
 uamac_root = "/home/clowder/sites/ua-mac/"
@@ -45,8 +47,9 @@ SENSOR_COUNT_DEFINITIONS = {
         # rulechecker & fieldmosaic products
         ("ruledb_rgbff", {
             "type": "psql",
-            "query_count": "select count(distinct file_path) from extractor_ids where output->>'rule'='Full Field' and output->>'sensor'='RGB GeoTIFFs' and output->>'date'='%s';",
-            "query_list": "select distinct file_path from extractor_ids where output->>'rule'='Full Field' and output->>'sensor'='RGB GeoTIFFs' and output->>'date'='%s';",
+            "query_count": "select count(distinct file_path) from extractor_ids where output->>'rule'='Full Field' and output->>'sensor'='RGB GeoTIFFs' and output->>'date'=%s;",
+            "query_grouped": "select output->>'date', count(distinct file_path) from extractor_ids where output->>'rule'='Full Field' and output->>'sensor'='RGB GeoTIFFs' and output->>'date' between %s and %s group by output->>'date';",
+            "query_list": "select distinct file_path from extractor_ids where output->>'rule'='Full Field' and output->>'sensor'='RGB GeoTIFFs' and output->>'date'=%s;",
             "parent": "rgb_geotiff",
             "extractor": "ncsa.rulechecker.terra"}),
         ("rgbff", {
@@ -55,8 +58,9 @@ SENSOR_COUNT_DEFINITIONS = {
             "regex": ".*_rgb.tif"}),
         ("ruledb_nrmacff", {
             "type": "psql",
-            "query_count": "select count(distinct file_path) from extractor_ids where output->>'rule'='Full Field' and output->>'sensor'='RGB GeoTIFFs NRMAC' and output->>'date'='%s';",
-            "query_list": "select distinct file_path from extractor_ids where output->>'rule'='Full Field' and output->>'sensor'='RGB GeoTIFFs NRMAC' and output->>'date'='%s';",
+            "query_count": "select count(distinct file_path) from extractor_ids where output->>'rule'='Full Field' and output->>'sensor'='RGB GeoTIFFs NRMAC' and output->>'date'=%s;",
+            "query_grouped": "select output->>'date', count(distinct file_path) from extractor_ids where output->>'rule'='Full Field' and output->>'sensor'='RGB GeoTIFFs NRMAC' and output->>'date' between %s and %s group by output->>'date';",
+            "query_list": "select distinct file_path from extractor_ids where output->>'rule'='Full Field' and output->>'sensor'='RGB GeoTIFFs NRMAC' and output->>'date'=%s;",
             # Parent count is still rgb_geotiff because we are putting NRMAC in same datasets as those
             "parent": "rgb_geotiff",
             "extractor": "ncsa.rulechecker.terra"}),
@@ -66,8 +70,9 @@ SENSOR_COUNT_DEFINITIONS = {
             "regex": ".*_nrmac.tif"}),
         ("ruledb_maskff", {
             "type": "psql",
-            "query_count": "select count(distinct file_path) from extractor_ids where output->>'rule'='Full Field' and output->>'sensor'='RGB GeoTIFFs Masked' and output->>'date'='%s';",
-            "query_list": "select distinct file_path from extractor_ids where output->>'rule'='Full Field' and output->>'sensor'='RGB GeoTIFFs Masked' and output->>'date'='%s';",
+            "query_count": "select count(distinct file_path) from extractor_ids where output->>'rule'='Full Field' and output->>'sensor'='RGB GeoTIFFs Masked' and output->>'date'=%s;",
+            "query_grouped": "select output->>'date', count(distinct file_path) from extractor_ids where output->>'rule'='Full Field' and output->>'sensor'='RGB GeoTIFFs Masked' and output->>'date' between %s and %s group by output->>'date';",
+            "query_list": "select distinct file_path from extractor_ids where output->>'rule'='Full Field' and output->>'sensor'='RGB GeoTIFFs Masked' and output->>'date'=%s;",
             # Parent count is still rgb_geotiff because we are putting rgb_mask in same datasets as those
             "parent": "rgb_geotiff",
             "extractor": "ncsa.rulechecker.terra"}),
@@ -104,8 +109,9 @@ SENSOR_COUNT_DEFINITIONS = {
         # rulechecker & fieldmosaic products
         ("ruledb_flirff", {
             "type": "psql",
-            "query_count": "select count(distinct file_path) from extractor_ids where output->>'rule'='Full Field' and output->>'sensor'='Thermal IR GeoTIFFs' and output->>'date'='%s';",
-            "query_list": "select distinct file_path from extractor_ids where output->>'rule'='Full Field' and output->>'sensor'='Thermal IR GeoTIFFs' and output->>'date'='%s';",
+            "query_count": "select count(distinct file_path) from extractor_ids where output->>'rule'='Full Field' and output->>'sensor'='Thermal IR GeoTIFFs' and output->>'date'=%s;",
+            "query_grouped": "select output->>'date', count(distinct file_path) from extractor_ids where output->>'rule'='Full Field' and output->>'sensor'='Thermal IR GeoTIFFs' and output->>'date' between %s and %s group by output->>'date';",
+            "query_list": "select distinct file_path from extractor_ids where output->>'rule'='Full Field' and output->>'sensor'='Thermal IR GeoTIFFs' and output->>'date'=%s;",
             "parent": "ir_geotiff",
             "extractor": "ncsa.rulechecker.terra"}),
         ("flirff", {
@@ -1,40 +1,51 @@
 import os
 import json
 import thread
+import threading
 import collections
 import time
 import datetime
 import psycopg2
-import re
 import requests
 import logging, logging.config, logstash
-import pandas as pd
-from flask import Flask, render_template, send_file, request, url_for, redirect, make_response
+from flask import Flask, render_template, request, url_for, redirect, make_response
 from flask_wtf import FlaskForm as Form
 from wtforms import TextField, TextAreaField, validators, StringField, SubmitField, DateField, SelectMultipleField, widgets
 from wtforms.fields.html5 import DateField
 from wtforms.validators import DataRequired
 
 from pyclowder.connectors import Connector
-from pyclowder.datasets import submit_extraction, get_file_list
+from pyclowder.datasets import submit_extraction
 from pyclowder.files import submit_extraction as submit_file_extraction
 from terrautils.extractors import load_json_file
 from terrautils.sensors import Sensors
 
 import utils
 import counts
+import count_index
+import count_scheduler
+import count_store
+import count_views
+import resubmitter
 
 
 config = {}
 app_dir = '/home/filecounter'
-SCAN_LOCK = False
 count_defs = counts.SENSOR_COUNT_DEFINITIONS
 DEFAULT_COUNT_START = None
 DEFAULT_COUNT_END = None
+COUNT_INDEX = count_index.CountIndex()
+SCHEDULER = None
+COUNT_STORE = None
+VIEW_CACHE = count_views.ViewCache()
+# Caps on concurrent filesystem and PSQL counts across all count workers
+FS_SLOTS = threading.BoundedSemaphore(int(os.getenv('COUNTER_FS_CONCURRENCY', 8)))
+PSQL_SLOTS = threading.BoundedSemaphore(int(os.getenv('COUNTER_PSQL_CONCURRENCY', 4)))
 
 CLOWDER_HOST = "https://terraref.ncsa.illinois.edu/clowder/"
 CLOWDER_KEY = os.getenv('CLOWDER_KEY', False)
 CONN = Connector("", {}, mounted_paths={"/home/clowder/sites":"/home/clowder/sites"})
+RESOLVER = resubmitter.ClowderResolver(CLOWDER_HOST, CLOWDER_KEY)
 
 
 # UTILITIES ----------------------------
@@ -210,11 +221,39 @@ def connect_to_psql():
 
     return psql_conn
 
+def get_season_counts(sensor_name, season):
+    """Return counts of a season without dates lacking raw data, with percentages out of 100, and the raw data column."""
+    (start, end) = get_season_dates(season)
+    df_season = COUNT_STORE.dataframe(sensor_name, start, end)
+
+    # Omit rows with zero count in raw_data
+    primary_sensor = None
+    for sensorname in ['stereoTop', 'flirIrCamera', 'scanner3DTop', 'ps2Top', 'EnvironmentLogger']:
+        if sensorname in df_season.columns:
+            df_season = df_season[df_season[sensorname] != 0]
+            primary_sensor = sensorname
+
+    percent_columns = get_percent_columns(df_season)
+    for each in percent_columns:
+        df_season[each] = df_season[each].mul(100).astype(int)
+
+    return df_season, primary_sensor
+
+def cached_view(view_name, sensor_name, params, render_fn):
+    """Return response of a rendered view, rendering it only if counts of the sensor changed since it was cached."""
+    key = (view_name, sensor_name, params, COUNT_STORE.version(sensor_name))
+    etag, html = VIEW_CACHE.get(key, render_fn)
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        response = make_response(html)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
 # FLASK COMPONENTS ----------------------------
 def create_app(test_config=None):
 
-    pipeline_csv = os.path.join(config['csv_path'], "{}.csv")
-
     sensor_names = count_defs.keys()
 
     # create and configure the app
@@ -256,87 +295,68 @@ def create_app(test_config=None):
 
     @app.route('/download/<sensor_name>')
     def download(sensor_name):
-        current_csv = pipeline_csv.format(sensor_name)
-        current_csv_name = os.path.basename(current_csv)
-        return send_file(current_csv,
-                         mimetype='text/csv',
-                         attachment_filename=current_csv_name,
-                         as_attachment=True)
+        df = COUNT_STORE.dataframe(sensor_name)
+        response = make_response(df.to_csv(index=False))
+        response.headers['Content-Type'] = 'text/csv'
+        response.headers['Content-Disposition'] = 'attachment; filename=%s.csv' % sensor_name
+        return response
 
     @app.route('/showcsv/<sensor_name>', defaults={'days': 14})
     @app.route('/showcsv/<sensor_name>/<int:days>')
     def showcsv(sensor_name, days):
-        # data = dataset.html
-        current_csv = pipeline_csv.format(sensor_name)
-        if not os.path.isfile(current_csv):
-            return "File does not exist"
-        df = pd.read_csv(current_csv, index_col=False)
-        if days == 0:
-            percent_columns = get_percent_columns(df)
-            for each in percent_columns:
-                df[each] = df[each].mul(100).astype(int)
-            dfs = df.style
-            dfs.applymap(color_percents, subset=percent_columns).set_table_attributes("border=1")
-            my_html = dfs.render()
-            return my_html
-        else:
-            return df.tail(days).to_html()
+        def render():
+            df = COUNT_STORE.dataframe(sensor_name, last_days=days)
+            if df.empty:
+                return "No counts for %s" % sensor_name
+            if days == 0:
+                percent_columns = get_percent_columns(df)
+                for each in percent_columns:
+                    df[each] = df[each].mul(100).astype(int)
+                return count_views.render_count_table(df, percent_columns)
+            else:
+                return df.to_html()
+
+        return cached_view('showcsv', sensor_name, (days,), render)
 
     @app.route('/showcsvbyseason/<sensor_name>', defaults={'season': 6})
     @app.route('/showcsvbyseason/<sensor_name>/<int:season>')
     def showcsvbyseason(sensor_name, season):
-        (start, end) = get_season_dates(season)
-        current_csv = pipeline_csv.format(sensor_name)
-        df = pd.read_csv(current_csv, index_col=False)
-        df_season = df.loc[(df['date'] >= start) & (df['date'] <= end)]
+        page = request.args.get('page', 1, type=int)
 
-        # Omit rows with zero count in raw_data
-        for sensorname in ['stereoTop', 'flirIrCamera', 'scanner3DTop', 'ps2Top', 'EnvironmentLogger']:
-            if sensorname in df_season.columns:
-                df_season = df_season[df[sensorname] != 0]
+        def render():
+            df_season = get_season_counts(sensor_name, season)[0]
+            df_page, current_page, pages = count_views.paginate(df_season, page)
+            percent_columns = get_percent_columns(df_page)
+            return count_views.render_count_table(df_page, percent_columns) + \
+                   count_views.render_page_links(request.path, current_page, pages)
 
-        percent_columns = get_percent_columns(df_season)
-        for each in percent_columns:
-            df_season[each] = df_season[each].mul(100).astype(int)
-
-        dfs = df_season.style
-        dfs.applymap(color_percents, subset=percent_columns).set_table_attributes("border=1")
-        html = dfs.render()
-        return html
+        return cached_view('showcsvbyseason', sensor_name, (season, page), render)
 
     @app.route('/resubmitbyseason/<sensor_name>', defaults={'season': 6})
     @app.route('/resubmitbyseason/<sensor_name>/<int:season>')
     def resubmitbyseason(sensor_name, season):
-        (start, end) = get_season_dates(season)
-        current_csv = pipeline_csv.format(sensor_name)
-        df = pd.read_csv(current_csv, index_col=False)
-        df_season = df.loc[(df['date'] >= start) & (df['date'] <= end)]
-
-        # Omit rows with zero count in raw_data
-        primary_sensor = None
-        for sensorname in ['stereoTop', 'flirIrCamera', 'scanner3DTop', 'ps2Top', 'EnvironmentLogger']:
-            if sensorname in df_season.columns:
-                df_season = df_season[df[sensorname] != 0]
-                primary_sensor = sensorname
-
-        percent_columns = get_percent_columns(df_season)
-        for each in percent_columns:
-            df_season[each] = df_season[each].mul(100).astype(int)
-
-        # Create header and key
-        html = "<h1>Seasonal Counts: %s</h1><div>" % primary_sensor
-        html += '<a style="%s">%s</a></br>' % (color_percents(100),' 100% coverage')
-        html += '<a style="%s">%s</a></br>' % (color_percents(99), '>=99% coverage')
-        html += '<a style="%s">%s</a></br>' % (color_percents(98), '>=95% coverage')
-        html += '<a style="%s">%s</a></br></br>' % (color_percents(0),  ' <95% coverage')
-
-        # Create daily entries
-        cols = list(df_season.columns.values)
-        for index, row in df_season.iterrows():
-            html += render_date_entry(primary_sensor, cols, row, index)
-        html += "</div>"
-
-        return html
+        page = request.args.get('page', 1, type=int)
+
+        def render():
+            df_season, primary_sensor = get_season_counts(sensor_name, season)
+            df_page, current_page, pages = count_views.paginate(df_season, page)
+
+            # Create header and key
+            html = "<h1>Seasonal Counts: %s</h1><div>" % primary_sensor
+            html += '<a style="%s">%s</a></br>' % (color_percents(100),' 100% coverage')
+            html += '<a style="%s">%s</a></br>' % (color_percents(99), '>=99% coverage')
+            html += '<a style="%s">%s</a></br>' % (color_percents(98), '>=95% coverage')
+            html += '<a style="%s">%s</a></br></br>' % (color_percents(0),  ' <95% coverage')
+            html += count_views.render_page_links(request.path, current_page, pages)
+
+            # Create daily entries
+            cols = list(df_page.columns.values)
+            for index, row in df_page.iterrows():
+                html += render_date_entry(primary_sensor, cols, row, index)
+            html += "</div>"
+            return html
+
+        return cached_view('resubmitbyseason', sensor_name, (season, page), render)
 
     @app.route('/submitmissing/<sensor_name>/<target>/<date>')
     @utils.requires_user("admin")
@@ -346,6 +366,7 @@ def create_app(test_config=None):
         extractorname = targetdef["extractor"]
         submitted = []
         notfound = []
+        failed = []
 
         if "parent" in targetdef:
             # Count expected parent counts & actual current progress counts from filesystem
@@ -359,21 +380,17 @@ def create_app(test_config=None):
                 target_timestamps = []
 
             disp_name = Sensors("", "ua-mac").get_display_name(targetdef["parent"])
-            missing = list(set(parent_timestamps)-set(target_timestamps))
-            for ts in missing:
-                if ts.find("-") > -1 and ts.find("__") > -1:
-                    dataset_name = disp_name+" - "+ts
-                    raw_dsid = get_dsid_by_name(dataset_name)
-                    if raw_dsid:
-                        submit_extraction(CONN, CLOWDER_HOST, CLOWDER_KEY, raw_dsid, extractorname)
-                        submitted.append({"name": dataset_name, "id": raw_dsid})
-                    else:
-                        notfound.append({"name": dataset_name})
+            dataset_names = [disp_name+" - "+ts for ts in
+                             resubmitter.missing_timestamps(parent_timestamps, target_timestamps)]
+            submitted, notfound, failed = resubmitter.submit_datasets(
+                RESOLVER, dataset_names,
+                lambda raw_dsid: submit_extraction(CONN, CLOWDER_HOST, CLOWDER_KEY, raw_dsid, extractorname))
 
         return json.dumps({
             "extractor": extractorname,
             "datasets submitted": submitted,
-            "datasets not found": notfound
+            "datasets not found": notfound,
+            "datasets failed": failed
         })
 
     @app.route('/submitrulecheck/<sensor_name>/<target>/<date>')
@@ -415,6 +432,7 @@ def create_app(test_config=None):
         extractorname = targetdef["extractor"]
         submitted = []
         notfound = []
+        failed = []
 
         if "parent" in targetdef:
             # Count expected parent counts from filesystem
@@ -426,28 +444,23 @@ def create_app(test_config=None):
             psql_conn = connect_to_psql()
 
             target_timestamps = []
-            query_string = targetdef["query_list"] % date
             curs = psql_conn.cursor()
-            curs.execute(query_string)
+            curs.execute(targetdef["query_list"], (date,))
             for result in curs:
                 target_timestamps.append(result[0].split("/")[-2])
 
             disp_name = Sensors("", "ua-mac").get_display_name(targetdef["parent"])
-            missing = list(set(parent_timestamps)-set(target_timestamps))
-            for ts in missing:
-                if ts.find("-") > -1 and ts.find("__") > -1:
-                    dataset_name = disp_name+" - "+ts
-                    raw_dsid = get_dsid_by_name(dataset_name)
-                    if raw_dsid:
-                        submit_extraction(CONN, CLOWDER_HOST, CLOWDER_KEY, raw_dsid, extractorname)
-                        submitted.append({"name": dataset_name, "id": raw_dsid})
-                    else:
-                        notfound.append({"name": dataset_name})
+            dataset_names = [disp_name+" - "+ts for ts in
+                             resubmitter.missing_timestamps(parent_timestamps, target_timestamps)]
+            submitted, notfound, failed = resubmitter.submit_datasets(
+                RESOLVER, dataset_names,
+                lambda raw_dsid: submit_extraction(CONN, CLOWDER_HOST, CLOWDER_KEY, raw_dsid, extractorname))
 
         return json.dumps({
             "extractor": extractorname,
             "datasets submitted": submitted,
-            "datasets not found": notfound
+            "datasets not found": notfound,
+            "datasets failed": failed
         })
 
     @app.route('/submitmissingregex/<sensor_name>/<target>/<date>')
@@ -458,6 +471,7 @@ def create_app(test_config=None):
         extractorname = targetdef["extractor"]
         submitted = []
         notfound = []
+        failed = []
 
         if "parent" in targetdef:
             # Count expected parent counts from filesystem
@@ -465,34 +479,37 @@ def create_app(test_config=None):
             parent_dir = os.path.join(parentdef["path"], date)
 
             if parentdef["type"] == "regex" and parentdef["path"] == targetdef["path"]:
-                for file in os.listdir(parent_dir):
-                    if re.match(parentdef["regex"], file):
-                        expected_output = file.replace(targetdef["parent_replacer_check"][1],
-                                                       targetdef["parent_replacer_check"][0])
-                        if not os.path.isfile(os.path.join(parent_dir, expected_output)):
-                            # Find the file ID of the parent file and submit it
-                            dataset_name = parentdef["dispname"]+" - "+date
-                            dsid = get_dsid_by_name(dataset_name)
-                            if dsid:
-                                parent_id = None
-                                dsfiles = get_file_list(CONN, CLOWDER_HOST, CLOWDER_KEY, dsid)
-                                matchfile = file.replace("_thumb.tif", ".tif")
-                                for dsfile in dsfiles:
-                                    if dsfile["filename"] == matchfile:
-                                        parent_id = dsfile["id"]
-                                        break
-                                if parent_id:
-                                    submit_file_extraction(CONN, CLOWDER_HOST, CLOWDER_KEY, parent_id, extractorname)
-                                    submitted.append({"name": matchfile, "id": parent_id})
-                                else:
-                                    notfound.append({"name": matchfile})
+                # Parent files whose expected output is missing, from one listing of the directory
+                parent_regex = COUNT_INDEX.regexes[parentdef["regex"]]
+                dir_files = set(os.listdir(parent_dir))
+                missing = [file for file in sorted(dir_files) if parent_regex.match(file) and
+                           file.replace(targetdef["parent_replacer_check"][1],
+                                        targetdef["parent_replacer_check"][0]) not in dir_files]
+
+                if missing:
+                    # Find the file IDs of the parent files in one file list and submit them
+                    dataset_name = parentdef["dispname"]+" - "+date
+                    dsid = RESOLVER.dataset_ids_by_name([dataset_name])[dataset_name]
+                    if dsid:
+                        file_ids = RESOLVER.file_ids_by_name(dsid)
+                        matches = []
+                        for file in missing:
+                            matchfile = file.replace("_thumb.tif", ".tif")
+                            if matchfile in file_ids:
+                                matches.append({"name": matchfile, "id": file_ids[matchfile]})
                             else:
-                                notfound.append({"name": dataset_name})
+                                notfound.append({"name": matchfile})
+                        submitted, failed = resubmitter.submit_all(
+                            RESOLVER, matches,
+                            lambda parent_id: submit_file_extraction(CONN, CLOWDER_HOST, CLOWDER_KEY, parent_id, extractorname))
+                    else:
+                        notfound.append({"name": dataset_name})
 
         return json.dumps({
             "extractor": extractorname,
             "datasets submitted": submitted,
-            "datasets not found": notfound
+            "datasets not found": notfound,
+            "datasets failed": failed
         })
 
     @app.route('/submitmissingplots/<sensor_name>/<target>/<date>')
@@ -540,15 +557,10 @@ def create_app(test_config=None):
         sensor_list = count_defs.keys()
         current_time_stamp = str(datetime.datetime.now()).replace(' ', '_')
         for sensor in sensor_list:
-            output_file = os.path.join(config['csv_path'], sensor + ".csv")
-            if os.path.exists(output_file):
+            if COUNT_STORE.has_counts(sensor):
                 archived_file = os.path.join(config['csv_path'], sensor + '_' + current_time_stamp + ".csv")
-                os.rename(output_file, archived_file)
-                if os.path.exists(output_file):
-                    try:
-                        os.remove(output_file)
-                    except OSError as e:
-                        logging.info(e)
+                COUNT_STORE.dataframe(sensor).to_csv(archived_file, index=False)
+                COUNT_STORE.delete(sensor)
         message = "Archived existing count csvs"
         logging.info("Archived existing count csvs")
         return redirect(url_for('sensors', message=message))
@@ -557,20 +569,25 @@ def create_app(test_config=None):
     @utils.requires_user("admin")
     def schedule_count(sensor, start_range, end_range):
         dates_in_range = generate_dates_in_range(start_range, end_range)
-        psql_conn = connect_to_psql()
-        thread.start_new_thread(update_file_count_csvs, (sensor, dates_in_range, psql_conn))
+        job_id = SCHEDULER.submit(sensor, dates_in_range)
 
-        message = "Custom scan scheduled for %s on %s dates" % (sensor, len(dates_in_range))
+        message = "Custom scan scheduled for %s on %s dates (job %s)" % (sensor, len(dates_in_range), job_id)
         return redirect(url_for('sensors', message=message))
 
+    @app.route('/jobs', defaults={'job_id': None})
+    @app.route('/jobs/<job_id>')
+    def job_status(job_id):
+        status = SCHEDULER.status(job_id)
+        if status is None:
+            return make_response(json.dumps({"error": "unknown job %s" % job_id}), 404)
+        return json.dumps(status)
+
     return app
 
 
 # COUNTING COMPONENTS ----------------------------
 def run_regular_update(use_defaults=False):
     """Perform regular update of previous two weeks for all sensors"""
-    psql_conn = connect_to_psql()
-
     while True:
         # Determine two weeks before current date, or by defaults
         if use_defaults:
@@ -586,168 +603,87 @@ def run_regular_update(use_defaults=False):
 
         logging.info("Checking counts for all sensors for dates %s - %s" % (start_date_string, dates_to_check[-1]))
 
-        for s in count_defs.keys():
-            psql_conn = update_file_count_csvs(s, dates_to_check, psql_conn)
+        # All sensors are counted at the same time; wait for them before sleeping
+        job_ids = [SCHEDULER.submit(s, dates_to_check) for s in count_defs.keys()]
+        SCHEDULER.wait(job_ids)
 
         # Wait 1 hour for next iteration
         time.sleep(3600)
 
-def retrive_single_count(target_count, target_def, date, psql_conn):
+def count_psql_range(sensor, dates, psql_conn):
+    """Return counts of every grouped psql target of a sensor by date, with one query per target."""
+    psql_counts = {}
+    targets = count_defs[sensor]
+    for target_count in targets:
+        target_def = targets[target_count]
+        if target_def["type"] == "psql" and "query_grouped" in target_def and dates:
+            logging.info("   [%s] querying PSQL records for %s - %s" % (target_count, dates[0], dates[-1]))
+            with PSQL_SLOTS:
+                curs = psql_conn.cursor()
+                curs.execute(target_def["query_grouped"], (dates[0], dates[-1]))
+                psql_counts[target_count] = dict(curs.fetchall())
+    return psql_counts, psql_conn
+
+def retrive_single_count(target_count, target_def, date, psql_conn, psql_counts=None):
     """Return count of specified type (see counts.py for types)"""
     count = 0
 
-    if target_def["type"] == "timestamp":
-        date_dir = os.path.join(target_def["path"], date)
-        if os.path.exists(date_dir):
-            logging.info("   [%s] counting timestamps in %s" % (target_count, date_dir))
-            # TODO: Only count non-empty directories
-            """count = 0
-            for sub in os.listdir(date_dir):
-                if os.listdir(os.path.join(date_dir, sub)):
-                    count += 1"""
-            count = len(os.listdir(date_dir))
-        else:
-            logging.info("   [%s] directory not found: %s" % (target_count, date_dir))
-
-    elif target_def["type"] == "plot":
+    if target_def["type"] in ["timestamp", "plot", "regex"]:
+        # Directories are only listed again if they changed since the last count
         date_dir = os.path.join(target_def["path"], date)
-        if os.path.exists(date_dir):
-            logging.info("   [%s] counting plots in %s" % (target_count, date_dir))
-            # TODO: Only count non-empty directories
-            """count = 0
-            for sub in os.listdir(date_dir):
-                if os.listdir(os.path.join(date_dir, sub)):
-                    count += 1"""
-            count = len(os.listdir(date_dir))
+        with FS_SLOTS:
+            indexed_count = COUNT_INDEX.count(target_count, target_def, date)
+        if indexed_count is not None:
+            logging.info("   [%s] counted %s in %s" % (target_count, target_def["type"], date_dir))
+            count = indexed_count
         else:
             logging.info("   [%s] directory not found: %s" % (target_count, date_dir))
 
-    elif target_def["type"] == "regex":
-        date_dir = os.path.join(target_def["path"], date)
-        if os.path.exists(date_dir):
-            logging.info("   [%s] matching regex against %s" % (target_count, date_dir))
-            for date_content in os.listdir(date_dir):
-                if os.path.isdir(date_content):
-                    # This is timestamp-level search
-                    ts_dir = os.path.join(date_dir, date_content)
-                    for file in os.listdir(ts_dir):
-                        if re.match(target_def["regex"], file):
-                            count += 1
-                else:
-                    # No timestamp (e.g. fullfield)
-                    if re.match(target_def["regex"], date_content):
-                        count += 1
-        else:
-            logging.info("   [%s] directory not found: %s" % (target_count, date_dir))
+    elif target_def["type"] == "psql" and psql_counts and target_count in psql_counts:
+        # Already counted for the whole range by count_psql_range
+        count = psql_counts[target_count].get(date, 0)
 
     elif target_def["type"] == "psql":
         logging.info("   [%s] querying PSQL records for %s" % (target_count, date))
-        query_string = target_def["query_count"] % date
-        curs = psql_conn.cursor()
-        curs.execute(query_string)
-        for result in curs:
-            count = result[0]
+        with PSQL_SLOTS:
+            curs = psql_conn.cursor()
+            curs.execute(target_def["query_count"], (date,))
+            for result in curs:
+                count = result[0]
 
     return count
 
-def update_file_count_csvs(sensor, dates_to_check, psql_conn):
-    """Perform necessary counting on specified dates to update CSV for all sensors."""
-    global SCAN_LOCK
-
-    while SCAN_LOCK:
-        logging.info("Another thread currently locking database; waiting 60 seconds to retry")
-        time.sleep(60)
-
-    logging.info("Locking scan for %s on %s dates" % (sensor, len(dates_to_check)))
-    SCAN_LOCK = True
-
-    output_file = os.path.join(config['csv_path'], sensor+".csv")
-    logging.info("Updating counts for %s into %s" % (sensor, output_file))
+def count_date(sensor, current_date, psql_conn, psql_counts=None):
+    """Return counts and percentages (if applicable) of each target count of a sensor for one date."""
+    logging.info("[%s] %s" % (sensor, current_date))
     targets = count_defs[sensor]
-    cols = ["date"]
+    counts = {}
+    percentages = {}
     for target_count in targets:
         target_def = targets[target_count]
-        cols.append(target_count)
-        if "parent" in target_def:
-            cols.append(target_count + '%')
 
-    # Load data frame from existing CSV or create a new one
-    if os.path.exists(output_file):
-        logging.info("csv exists for %s" % output_file)
         try:
-            df = pd.read_csv(output_file)
-        except Exception as e:
-            logging.info(e)
-            logging.info('CSV exists, could not read as dataframe')
-            cols = ["date"]
-            df = pd.DataFrame(columns=cols)
-            logging.info("CSV existed but could not be read, created dataframe for %s " % sensor)
-        df_columns = list(df.columns.values)
-        if df_columns != cols:
-            logging.info("CSV existed but had malformed columns, created dataframe for %s " % sensor)
-            df = pd.DataFrame(columns=cols)
-    else:
-        logging.info("output file for %s does not exist" % sensor)
-        df = pd.DataFrame(columns=cols)
-        logging.info("CSV did not exist, created dataframe for %s " % sensor)
-
-    # Populate count and percentage (if applicable) for each target count
-    logging.info("the columns of the csv are %s " % str(df.columns.values))
-    for current_date in dates_to_check:
-        logging.info("[%s] %s" % (sensor, current_date))
-        counts = {}
-        percentages = {}
-        for target_count in targets:
-            target_def = targets[target_count]
-
-            try:
-                counts[target_count] = retrive_single_count(target_count, target_def, current_date, psql_conn)
-            except:
-                psql_conn = connect_to_psql()
-                counts[target_count] = retrive_single_count(target_count, target_def, current_date, psql_conn)
-
-            if "parent" in target_def:
-                if target_def["parent"] not in counts:
-                    counts[target_def["parent"]] = retrive_single_count(targets[target_def["parent"]], current_date, psql_conn)
-                if counts[target_def["parent"]] > 0:
-                    percentages[target_count] = (counts[target_count]*1.0)/(counts[target_def["parent"]]*1.0)
-                else:
-                    percentages[target_count] = 0.0
-
-        # If this date already has a row, just update
-        if current_date in df['date'].values:
-            logging.info("Already have data for date %s " % current_date)
-            updated_entry = [current_date]
-            for target_count in targets:
-                target_def = targets[target_count]
-                updated_entry.append(counts[target_count])
-                if "parent" in target_def:
-                    updated_entry.append(percentages[target_count])
-            df.loc[df['date'] == current_date] = updated_entry
-        # If not, create a new row
-        else:
-            logging.info("No data for date %s adding to dataframe" % current_date)
-            new_entry = [current_date]
-            indices = ["date"]
-
-            for target_count in targets:
-                target_def = targets[target_count]
-
-                indices.append(target_count)
-                new_entry.append(counts[target_count])
-                if "parent" in target_def:
-                    indices.append(target_count+'%')
-                    new_entry.append(percentages[target_count])
-            df = df.append(pd.Series(new_entry, index=indices), ignore_index=True)
-
-    logging.info("Writing %s" % output_file)
-    df['date'] = pd.to_datetime(df['date'], format='%Y-%m-%d')
-    df.sort_values(by=['date'], inplace=True, ascending=True)
-    df.to_csv(output_file, index=False)
-
-    SCAN_LOCK = False
-    return psql_conn
+            counts[target_count] = retrive_single_count(target_count, target_def, current_date, psql_conn, psql_counts)
+        except:
+            psql_conn = connect_to_psql()
+            counts[target_count] = retrive_single_count(target_count, target_def, current_date, psql_conn, psql_counts)
+
+        if "parent" in target_def:
+            if target_def["parent"] not in counts:
+                counts[target_def["parent"]] = retrive_single_count(target_def["parent"], targets[target_def["parent"]],
+                                                                    current_date, psql_conn, psql_counts)
+            if counts[target_def["parent"]] > 0:
+                percentages[target_count] = (counts[target_count]*1.0)/(counts[target_def["parent"]]*1.0)
+            else:
+                percentages[target_count] = 0.0
 
+    return (counts, percentages), psql_conn
+
+def store_counts(sensor, rows):
+    """Upsert counts and percentages by date, as returned by count_date, into the count store."""
+    logging.info("Storing counts of %s for %s dates" % (sensor, len(rows)))
+    COUNT_STORE.upsert(sensor, rows)
+    COUNT_INDEX.save()
 
 if __name__ == '__main__':
 
@@ -779,6 +715,17 @@ if __name__ == '__main__':
             open(main_log_file, 'a').close()
         logging.config.dictConfig(log_config)
 
+    COUNT_INDEX = count_index.CountIndex(os.path.join(config['csv_path'], "count_index.json"))
+    COUNT_STORE = count_store.CountStore(config.get("count_db", os.path.join(app_dir, "data/counts.sqlite")))
+    for sensor in count_defs.keys():
+        # Counts of earlier versions were kept in one CSV per sensor
+        sensor_csv = os.path.join(config['csv_path'], sensor + ".csv")
+        if not COUNT_STORE.has_counts(sensor) and os.path.isfile(sensor_csv):
+            COUNT_STORE.import_csv(sensor, sensor_csv)
+
+    SCHEDULER = count_scheduler.CountScheduler(count_date, store_counts, connect_to_psql,
+                                               prepare_fn=count_psql_range, workers=int(os.getenv('COUNTER_WORKERS', 8)))
+
     thread.start_new_thread(run_regular_update, (True,))
 
     apiIP = os.getenv('COUNTER_API_IP', "0.0.0.0")
@@ -0,0 +1,8 @@
+-- Expression index backing the per-date rulechecker counts of the filecounter
+-- (query_count, query_grouped and query_list in counts.py filter on output->>'date').
+-- Built concurrently so the rulechecker can keep writing; run outside of a transaction:
+--   psql -h <host> -U <user> -d rulemonitor -f 001_extractor_ids_date_index.sql
+CREATE INDEX CONCURRENTLY IF NOT EXISTS extractor_ids_output_date_idx
+    ON extractor_ids ((output->>'date'));
+
+ANALYZE extractor_ids;
@@ -0,0 +1,151 @@
+import time
+import logging
+import threading
+from multiprocessing.pool import ThreadPool
+import requests
+
+"""
+Resolution of missing outputs to Clowder IDs and their concurrent resubmission.
+
+Clowder has no endpoint resolving many dataset names at once, so names are looked up
+concurrently and kept in a cache shared by all requests; file lists are fetched once per
+dataset and indexed by filename. Submissions go out on a pool of threads, rate limited so a
+bad day doesn't flood Clowder and RabbitMQ.
+"""
+
+# Concurrent Clowder requests of one resubmission
+WORKERS = 8
+
+# Clowder requests per second of all resubmissions
+RATE = 20
+
+# Seconds dataset IDs and file lists are cached; names that weren't found are looked up again
+CACHE_TTL = 3600
+
+
+class RateLimiter(object):
+    def __init__(self, rate=RATE):
+        self.interval = 1.0 / rate
+        self.next_slot = time.time()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """Block until the next request is allowed."""
+        with self.lock:
+            now = time.time()
+            delay = self.next_slot - now
+            self.next_slot = max(now, self.next_slot) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class ClowderResolver(object):
+    def __init__(self, host, key, workers=WORKERS, rate=RATE, ttl=CACHE_TTL):
+        self.host = host
+        self.key = key
+        self.workers = workers
+        self.ttl = ttl
+        self.limiter = RateLimiter(rate)
+        self.session = requests.Session()
+        self.dataset_ids = {}   # dataset name -> (time, id)
+        self.file_ids = {}      # dataset id -> (time, {filename: file id})
+        self.lock = threading.Lock()
+
+    def run_concurrently(self, fn, items):
+        """Return results of fn on every item, run on a pool of rate limited threads."""
+        if not items:
+            return []
+
+        def limited(item):
+            self.limiter.wait()
+            return fn(item)
+
+        pool = ThreadPool(min(self.workers, len(items)))
+        try:
+            return pool.map(limited, items)
+        finally:
+            pool.close()
+            pool.join()
+
+    def _cached(self, cache, key):
+        with self.lock:
+            entry = cache.get(key)
+        if entry and time.time() - entry[0] < self.ttl:
+            return entry[1]
+        return None
+
+    def _lookup_dataset(self, name):
+        url = "%sapi/datasets" % self.host
+        result = self.session.get(url, params={"key": self.key, "title": name, "exact": "true"})
+        result.raise_for_status()
+        found = result.json()
+        return found[0]['id'] if len(found) > 0 else None
+
+    def dataset_ids_by_name(self, names):
+        """Return dict of dataset names to Clowder IDs (None if not found), looking up uncached names concurrently."""
+        ids = {}
+        unknown = []
+        for name in set(names):
+            dsid = self._cached(self.dataset_ids, name)
+            if dsid:
+                ids[name] = dsid
+            else:
+                unknown.append(name)
+
+        now = time.time()
+        for name, dsid in zip(unknown, self.run_concurrently(self._lookup_dataset, unknown)):
+            ids[name] = dsid
+            if dsid:
+                with self.lock:
+                    self.dataset_ids[name] = (now, dsid)
+
+        logging.info("Resolved %s dataset names, %s from cache" % (len(ids), len(ids) - len(unknown)))
+        return ids
+
+    def file_ids_by_name(self, dsid):
+        """Return dict of filenames to Clowder file IDs of a dataset, fetching its file list once."""
+        files = self._cached(self.file_ids, dsid)
+        if files is None:
+            self.limiter.wait()
+            url = "%sapi/datasets/%s/files" % (self.host, dsid)
+            result = self.session.get(url, params={"key": self.key})
+            result.raise_for_status()
+            files = {dsfile["filename"]: dsfile["id"] for dsfile in result.json()}
+            with self.lock:
+                self.file_ids[dsid] = (time.time(), files)
+        return files
+
+
+def missing_timestamps(parent_timestamps, target_timestamps):
+    """Return sorted timestamps present for the parent but not the target, ignoring non-timestamp entries."""
+    return sorted(ts for ts in set(parent_timestamps) - set(target_timestamps)
+                  if ts.find("-") > -1 and ts.find("__") > -1)
+
+def submit_all(resolver, submissions, submit_fn):
+    """Call submit_fn(id) concurrently for every {"name", "id"} submission.
+
+    Returns lists of the submitted and the failed submissions.
+    """
+    def submit(submission):
+        try:
+            submit_fn(submission["id"])
+            return True
+        except Exception as e:
+            logging.error("Failed to submit %s: %s" % (submission["name"], e))
+            return False
+
+    results = resolver.run_concurrently(submit, submissions)
+    submitted = [sub for sub, ok in zip(submissions, results) if ok]
+    failed = [sub for sub, ok in zip(submissions, results) if not ok]
+    return submitted, failed
+
+def submit_datasets(resolver, dataset_names, submit_fn):
+    """Resolve dataset names and call submit_fn(dsid) concurrently on those found.
+
+    Returns lists of submitted ({"name", "id"}), not found ({"name"}) and failed datasets.
+    """
+    ids = resolver.dataset_ids_by_name(dataset_names)
+    found = [{"name": name, "id": ids[name]} for name in dataset_names if ids.get(name)]
+    notfound = [{"name": name} for name in dataset_names if not ids.get(name)]
+    submitted, failed = submit_all(resolver, found, submit_fn)
+    return submitted, notfound, failed
@@ -11,7 +11,7 @@ This script works with both Python 2.7+ and 3+, depending on the netCDF4 module
 Thanks for the advice from Professor Zender and sample data from Dr. LeBauer.
 ----------------------------------------------------------------------------------------
 Usage (commandline):
-python hyperspectral_metadata.py dbg=yes fmt=4 ftn=no filePath1 filePath2
+python hyperspectral_metadata.py dbg=yes fmt=4 ftn=no ovr=resume filePath1 filePath2
 
 where
 hyperspectral_metadata.py is where this script located
@@ -19,6 +19,8 @@ filePath1 is source data file
 filePath2 is user's desired output file
 fmt (format) is the format of the output file; it can be netCDF4 or netCDF3 ("3" or "4")
 ftn (flatten) is whether flatten the output file; if yes, all the variables and attributes will be in root groups ("yes" or "no")
+ovr (overwrite) is what to do when the output file already exists ("skip", "overwrite" or "resume"); resume, the default,
+    only rewrites the output when the input files changed since it was written. The script never prompts.
 
 Please note that since netCDF3 does NOT support individual groups, the execution with fmt=3 will be flatten no matter the option for ftn
 
@@ -40,6 +42,13 @@ If pointed to a directory rather than a file, hyperspectral_metadata.py will aut
 ----------------------------------------------------------------------------------------
 UPDATE LOG (reverse chronological order):
 
+Update 20261019:
+The interactive Skip/Overwrite/Append prompt is replaced by the ovr= option (see hyperspectral_output.py).
+Output is written to a temporary file and renamed into place, so a failed run never destroys an existing file.
+Scalar metadata and georeferencing variables are described by declarative schemas (_GEO_SCHEMA etc.) and written
+with one setncatts call per variable. The 16 per-corner scalars (lat_img_se, x_img_nw, ...) are packed into the
+vectors lat_img, lon_img, x_img and y_img along the new img_corner dimension (order: SE, SW, NE, NW).
+
 Update 20160901:
 Rename from JsonDealer.py to hyperspectral_metadata.py
 
@@ -84,6 +93,7 @@ import struct
 from datetime import date, datetime
 from netCDF4 import Dataset, stringtochar
 from hyperspectral_calculation import pixel2Geographic, REFERENCE_POINT
+from hyperspectral_output import OutputManager, POLICIES
 
 _UNIT_DICTIONARY = {'m':   'meter',
                     's':   'second', 
@@ -109,6 +119,62 @@ _TIMESTAMP        = lambda: time.strftime("%a %b %d %H:%M:%S %Y",  time.localtim
 
 _WARN_MSG         = "{msg}"
 
+##### Declarative schema of the variables written next to the metadata groups #####
+# Each entry is (name, dimensions, attributes); the values are supplied when the schema is written
+# by _write_variables, which sets all the attributes of a variable with a single setncatts call.
+_REFERENCE_POINT_PROVENANCE = "https://github.com/terraref/reference-data/issues/32 by Dr. David LeBauer"
+
+_IMAGE_CORNERS = ("southeast", "southwest", "northeast", "northwest")
+
+_Y_PIXEL_SIZE = 0.98526434004512529576754637665e-3
+
+_X_PIXEL_SIZE = {"SWIR": (1.025e-3,       "x coordinate length of a single pixel in SWIR images"),
+                 "VNIR": (1.930615052e-3, "x coordinate length of a single pixel in VNIR images")}
+
+_WAVELENGTH_SCHEMA = (("wavelength", ("wavelength",), {"long_name": "Hyperspectral Wavelength",
+                                                       "units":     "nanometers"}),)
+
+_FRAMETIME_SCHEMA = (("frametime", ("time",), {"units":    "days since 1970-01-01 00:00:00",
+                                               "calender": "gregorian",
+                                               "notes":    "Each time of the scanline of the y taken"}),)
+
+_GEO_SCHEMA = (("x",                   ("x",),          {"units":           "meters",
+                                                         "reference_point": "Southeast corner of field",
+                                                         "long_name":       "North-south offset from southeast corner of field"}),
+               ("y",                   ("y",),          {"units":           "meters",
+                                                         "reference_point": "Southeast corner of field",
+                                                         "long_name":       "Distance west of the southeast corner of the field"}),
+               ("lat_reference_point", (),              {"units":           "degrees_north",
+                                                         "long_name":       "Latitude of the master reference point at southeast corner of field",
+                                                         "provenance":      _REFERENCE_POINT_PROVENANCE}),
+               ("lon_reference_point", (),              {"units":           "degrees_east",
+                                                         "long_name":       "Longitude of the master reference point at southeast corner of field",
+                                                         "provenance":      _REFERENCE_POINT_PROVENANCE}),
+               ("x_reference_point",   (),              {"units":           "meters",
+                                                         "long_name":       "x of the master reference point at southeast corner of field",
+                                                         "provenance":      _REFERENCE_POINT_PROVENANCE}),
+               ("y_reference_point",   (),              {"units":           "meters",
+                                                         "long_name":       "y of the master reference point at southeast corner of field",
+                                                         "provenance":      _REFERENCE_POINT_PROVENANCE}),
+               ("lat_img",             ("img_corner",), {"units":           "degrees_north",
+                                                         "long_name":       "Latitude of image corners",
+                                                         "corners":         " ".join(_IMAGE_CORNERS)}),
+               ("lon_img",             ("img_corner",), {"units":           "degrees_east",
+                                                         "long_name":       "Longitude of image corners",
+                                                         "corners":         " ".join(_IMAGE_CORNERS)}),
+               ("x_img",               ("img_corner",), {"units":           "meters",
+                                                         "long_name":       "Image corners, north distance to reference point",
+                                                         "corners":         " ".join(_IMAGE_CORNERS)}),
+               ("y_img",               ("img_corner",), {"units":           "meters",
+                                                         "long_name":       "Image corners, west distance to reference point",
+                                                         "corners":         " ".join(_IMAGE_CORNERS)}),
+               ("y_pxl_sz",            (),              {"units":           "meters",
+                                                         "notes":           "y coordinate length of a single pixel in pictures captured by SWIR and VNIR camera"}))
+
+_BAND_INDEX_SCHEMA = (("red_band_index",   (), {"long_name": "Index of red band used for RGB composite"}),
+                      ("green_band_index", (), {"long_name": "Index of green band used for RGB composite"}),
+                      ("blue_band_index",  (), {"long_name": "Index of blue band used for RGB composite"}))
+
 
 class DataContainer(object):
     '''
@@ -130,45 +196,35 @@ class DataContainer(object):
         if param in self.__dict__:
             return self.__dict__[param]
 
-    def writeToNetCDF(self, inputFilePath, outputFilePath, commandLine, format, flatten=False, _debug=True):
-        # weird, but useful to check whether the HeaderInfo id in the netCDF
-        # file
-        setattr(self, "header_info", None)
-        netCDFHandler = _file_existence_check(outputFilePath, format, self)
-        delattr(self, "header_info")
+    def writeToNetCDF(self, inputFilePath, outputFilePath, commandLine, format, flatten=False, _debug=True, policy="resume", outputManager=None):
+        # A caller passing its outputManager has applied the overwrite policy already
+        if outputManager is None:
+            outputManager = OutputManager(outputFilePath, input_file_group(inputFilePath), policy, format)
+            if outputManager.should_skip():
+                if _debug:
+                    print >> sys.stderr, _WARN_MSG.format(msg="".join(("--> ", outputManager.outputFilePath, " is up to date; skipped (policy: ", policy, ")")))
+                return
 
+        with outputManager.open() as netCDFHandler:
+            self._writeContents(netCDFHandler, inputFilePath, commandLine, format, flatten, _debug)
+
+    def _writeContents(self, netCDFHandler, inputFilePath, commandLine, format, flatten=False, _debug=True):
         #### default camera is SWIR, but will see based on the number of wavelengths
         camera_opt = "SWIR"
 
         ##### Write the data from metadata to netCDF #####
         for key, data in self.__dict__.items():
             tempGroup = netCDFHandler.createGroup(key) if not flatten else netCDFHandler
-            for subkey, subdata in data.items():
-                if not _IS_DIGIT(subdata): #Case for letter variables
-
-                    ##### For date variables #####
-                    if 'date' in subkey and subkey != "date of installation" and subkey != "date of handover":
-                        assert subdata != "todo", '"todo" is not a legal value for the keys'
+            groupAttributes, schema, values = _section_schema(data)
 
-                        tempVariable = tempGroup.createVariable(_reformat_string(subkey), 'f8')
-                        tempVariable[...] = translate_time(subdata)
-                        setattr(tempVariable, "units",     "days since 1970-01-01 00:00:00")
-                        setattr(tempVariable, "calender", "gregorian")
+            if any(_IS_DIGIT(subdata) for subdata in data.values()):
+                if "time" in data:
+                    yearMonthDate = data["time"]
+                elif "Time" in data:
+                    yearMonthDate = data["Time"]
 
-                    setattr(tempGroup, _reformat_string(subkey), subdata)
-
-                else: #Case for digits variables
-                    if "time" in data:
-                        yearMonthDate = data["time"]
-                    elif "Time" in data:
-                        yearMonthDate = data["Time"]
-                    setattr(tempGroup, _reformat_string(subkey), subdata)
-
-                    short_name, attributes = _generate_attr(subkey)
-                    tempVariable = tempGroup.createVariable(short_name, 'f8')
-                    for name, value in attributes.items():
-                        setattr(tempVariable, name, value)
-                    tempVariable[...] = float(subdata)
+            tempGroup.setncatts(groupAttributes)
+            _write_variables(tempGroup, schema, values)
 
         ##### Write data from header files to netCDF #####
         wavelength = get_wavelength(inputFilePath)
@@ -179,10 +235,7 @@ class DataContainer(object):
 
         camera_opt = 'VNIR' if len(wavelength) == 955 else 'SWIR' # Choose appropriate camera by counting the number of wavelengths.
 
-        tempWavelength = netCDFHandler.createVariable("wavelength", 'f8', 'wavelength')
-        setattr(tempWavelength, 'long_name', 'Hyperspectral Wavelength')
-        setattr(tempWavelength, 'units', 'nanometers')
-        tempWavelength[...] = wavelength
+        _write_variables(netCDFHandler, _WAVELENGTH_SCHEMA, {"wavelength": wavelength})
         write_header_file(inputFilePath, netCDFHandler, flatten, _debug)
 
         ##### Write the data from frameIndex files to netCDF #####
@@ -191,12 +244,8 @@ class DataContainer(object):
 
         # Check if the frame time information is correctly collected
         assert len(tempFrameTime), "ERROR: Failed to collect frame time information from " + ''.join((inputFilePath.strip("raw"), "frameIndex.txt")) + ". Please check the file."
-       
-        frameTime      = netCDFHandler.createVariable("frametime", "f8", ("time",))
-        frameTime[...] = tempFrameTime
-        setattr(frameTime, "units",    "days since 1970-01-01 00:00:00")
-        setattr(frameTime, "calender", "gregorian")
-        setattr(frameTime, "notes",    "Each time of the scanline of the y taken")
+
+        _write_variables(netCDFHandler, _FRAMETIME_SCHEMA, {"frametime": tempFrameTime})
 
         ########################### Adding geographic positions ###########################
 
@@ -205,136 +254,33 @@ class DataContainer(object):
 
         # Check if the image width and height are correctly collected.
         assert len(xPixelsLocation) > 0 and len(yPixelsLocation) > 0, "ERROR: Failed to collect the image size metadata from " + "".join((inputFilePath,'.hdr')) + ". Please check the file."
-        
-        netCDFHandler.createDimension("x", len(xPixelsLocation))
-        x    = netCDFHandler.createVariable("x", "f8", ("x",))
-        x[...] = xPixelsLocation
-        setattr(netCDFHandler.variables["x"], "units", "meters")
-        setattr(netCDFHandler.variables['x'], 'reference_point', 'Southeast corner of field')
-        setattr(netCDFHandler.variables['x'], "long_name", "North-south offset from southeast corner of field")
 
+        netCDFHandler.createDimension("x", len(xPixelsLocation))
         netCDFHandler.createDimension("y", len(yPixelsLocation))
-        y    = netCDFHandler.createVariable("y", "f8", ("y",))
-        y[...] = yPixelsLocation
-        setattr(netCDFHandler.variables["y"], "units", "meters")
-        setattr(netCDFHandler.variables['y'], 'reference_point', 'Southeast corner of field')
-        setattr(netCDFHandler.variables['y'], "long_name", "Distance west of the southeast corner of the field")
+        netCDFHandler.createDimension("img_corner", len(_IMAGE_CORNERS))
 
         lat_pt, lon_pt = REFERENCE_POINT
 
-        lat_pt_var = netCDFHandler.createVariable("lat_reference_point", "f8")
-        lat_pt_var[...] = lat_pt
-        setattr(netCDFHandler.variables["lat_reference_point"], "units", "degrees_north")
-        setattr(netCDFHandler.variables["lat_reference_point"], "long_name", "Latitude of the master reference point at southeast corner of field")
-        setattr(netCDFHandler.variables["lat_reference_point"], "provenance", "https://github.com/terraref/reference-data/issues/32 by Dr. David LeBauer")
-
-        lon_pt_var = netCDFHandler.createVariable("lon_reference_point", "f8")
-        lon_pt_var[...] = lon_pt
-        setattr(netCDFHandler.variables["lon_reference_point"], "units", "degrees_east")
-        setattr(netCDFHandler.variables["lon_reference_point"], "long_name", "Longitude of the master reference point at southeast corner of field")
-        setattr(netCDFHandler.variables["lon_reference_point"], "provenance", "https://github.com/terraref/reference-data/issues/32 by Dr. David LeBauer")
-
-        x_ref_pt = netCDFHandler.createVariable("x_reference_point", "f8")
-        x_ref_pt[...] = 0
-        setattr(netCDFHandler.variables["x_reference_point"], "units", "meters")
-        setattr(netCDFHandler.variables["x_reference_point"], "long_name", "x of the master reference point at southeast corner of field")
-        setattr(netCDFHandler.variables["x_reference_point"], "provenance", "https://github.com/terraref/reference-data/issues/32 by Dr. David LeBauer")
-
-        y_ref_pt = netCDFHandler.createVariable("y_reference_point", "f8")
-        y_ref_pt[...] = 0
-        setattr(netCDFHandler.variables["y_reference_point"], "units", "meters")
-        setattr(netCDFHandler.variables["y_reference_point"], "long_name", "y of the master reference point at southeast corner of field")
-        setattr(netCDFHandler.variables["y_reference_point"], "provenance", "https://github.com/terraref/reference-data/issues/32 by Dr. David LeBauer")
-
-        # Write latitude and longitude of bounding box
-        SE, SW, NE, NW = boundingBox[0], boundingBox[1], boundingBox[2], boundingBox[3]
-        lat_se, lon_se = tuple(SE.split(", "))
-        lat_sw, lon_sw = tuple(SW.split(", "))
-        lat_ne, lon_ne = tuple(NE.split(", "))
-        lat_nw, lon_nw = tuple(NW.split(", "))
-
-        latSe = netCDFHandler.createVariable("lat_img_se", "f8")
-        latSe[...] = float(lat_se)
-        setattr(netCDFHandler.variables["lat_img_se"], "units", "degrees_north")
-        setattr(netCDFHandler.variables["lat_img_se"], "long_name", "Latitude of southeast corner of image")
-
-        # have a "x_y_img_se" in meters, double
-        lonSe = netCDFHandler.createVariable("lon_img_se", "f8")
-        lonSe[...] = float(lon_se)
-        setattr(netCDFHandler.variables["lon_img_se"], "units", "degrees_east")
-        setattr(netCDFHandler.variables["lon_img_se"], "long_name", "Longitude of southeast corner of image")
-
-        latSw = netCDFHandler.createVariable("lat_img_sw", "f8")
-        latSw[...] = float(lat_sw)
-        setattr(netCDFHandler.variables["lat_img_sw"], "units", "degrees_north")
-        setattr(netCDFHandler.variables["lat_img_sw"], "long_name", "Latitude of southwest corner of image")
-
-        lonSw = netCDFHandler.createVariable("lon_img_sw", "f8")
-        lonSw[...] = float(lon_sw)
-        setattr(netCDFHandler.variables["lon_img_sw"], "units", "degrees_east")
-        setattr(netCDFHandler.variables["lon_img_sw"], "long_name", "Longitude of southwest corner of image")
-
-        latNe = netCDFHandler.createVariable("lat_img_ne", "f8")
-        latNe[...] = float(lat_ne)
-        setattr(netCDFHandler.variables["lat_img_ne"], "units", "degrees_north")
-        setattr(netCDFHandler.variables["lat_img_ne"], "long_name", "Latitude of northeast corner of image")
-
-        lonNe = netCDFHandler.createVariable("lon_img_ne", "f8")
-        lonNe[...] = float(lon_ne)
-        setattr(netCDFHandler.variables["lon_img_ne"], "units", "degrees_east")
-        setattr(netCDFHandler.variables["lon_img_ne"], "long_name", "Longitude of northeast corner of image")
-
-        latNw = netCDFHandler.createVariable("lat_img_nw", "f8")
-        latNw[...] = float(lat_nw)
-        setattr(netCDFHandler.variables["lat_img_nw"], "units", "degrees_north")
-        setattr(netCDFHandler.variables["lat_img_nw"], "long_name", "Latitude of northwest corner of image")
-
-        lonNw = netCDFHandler.createVariable("lon_img_nw", "f8")
-        lonNw[...] = float(lon_nw)
-        setattr(netCDFHandler.variables["lon_img_nw"], "units", "degrees_east")
-        setattr(netCDFHandler.variables["lon_img_nw"], "long_name", "Longitude of northwest corner of image")
-
-        xSe = netCDFHandler.createVariable("x_img_se", "f8")
-        xSe[...] = float(x[-1])
-        setattr(netCDFHandler.variables["x_img_se"], "units", "meters")
-        setattr(netCDFHandler.variables["x_img_se"], "long_name", "Southeast corner of image, north distance to reference point")
-
-        # have a "x_y_img_se" in meters, double
-        ySe = netCDFHandler.createVariable("y_img_se", "f8")
-        ySe[...] = float(y[-1])
-        setattr(netCDFHandler.variables["y_img_se"], "units", "meters")
-        setattr(netCDFHandler.variables["y_img_se"], "long_name", "Southeast corner of image, west distance to reference point")
-
-        xSw = netCDFHandler.createVariable("x_img_sw", "f8")
-        xSw[...] = float(x[0])
-        setattr(netCDFHandler.variables["x_img_sw"], "units", "meters")
-        setattr(netCDFHandler.variables["x_img_sw"], "long_name", "Southwest corner of image, north distance to reference point")
-
-        ySw = netCDFHandler.createVariable("y_img_sw", "f8")
-        ySw[...] = float(y[-1])
-        setattr(netCDFHandler.variables["y_img_sw"], "units", "meters")
-        setattr(netCDFHandler.variables["y_img_sw"], "long_name", "Southwest corner of image, west distance to reference point")
-
-        xNe = netCDFHandler.createVariable("x_img_ne", "f8")
-        xNe[...] = float(x[-1])
-        setattr(netCDFHandler.variables["x_img_ne"], "units", "meters")
-        setattr(netCDFHandler.variables["x_img_ne"], "long_name", "Northeast corner of image, north distance to reference point")
-
-        yNe = netCDFHandler.createVariable("y_img_ne", "f8")
-        yNe[...] = float(y[0])
-        setattr(netCDFHandler.variables["y_img_ne"], "units", "meters")
-        setattr(netCDFHandler.variables["y_img_ne"], "long_name", "Northeast corner of image, west distance to reference point")
-
-        xNw = netCDFHandler.createVariable("x_img_nw", "f8")
-        xNw[...] = float(x[0])
-        setattr(netCDFHandler.variables["x_img_nw"], "units", "meters")
-        setattr(netCDFHandler.variables["x_img_nw"], "long_name", "Northwest corner of image, north distance to reference point")
-
-        yNw = netCDFHandler.createVariable("y_img_nw", "f8")
-        yNw[...] = float(y[0])
-        setattr(netCDFHandler.variables["y_img_nw"], "units", "meters")
-        setattr(netCDFHandler.variables["y_img_nw"], "long_name", "Northwest corner of image, west distance to reference point")
-        
+        # Latitude and longitude of bounding box, in the order of _IMAGE_CORNERS (SE, SW, NE, NW)
+        cornerLatLon = [[float(coordinate) for coordinate in corner.split(", ")] for corner in boundingBox[:4]]
+
+        x_pxl_sz, x_pxl_sz_notes = _X_PIXEL_SIZE[camera_opt]
+        geoSchema = _GEO_SCHEMA + (("x_pxl_sz", (), {"units": "meters", "notes": x_pxl_sz_notes}),)
+
+        _write_variables(netCDFHandler, geoSchema,
+                         {"x":                   xPixelsLocation,
+                          "y":                   yPixelsLocation,
+                          "lat_reference_point": lat_pt,
+                          "lon_reference_point": lon_pt,
+                          "x_reference_point":   0,
+                          "y_reference_point":   0,
+                          "lat_img":             [lat for lat, lon in cornerLatLon],
+                          "lon_img":             [lon for lat, lon in cornerLatLon],
+                          "x_img":               [xPixelsLocation[-1], xPixelsLocation[0], xPixelsLocation[-1], xPixelsLocation[0]],
+                          "y_img":               [yPixelsLocation[-1], yPixelsLocation[-1], yPixelsLocation[0], yPixelsLocation[0]],
+                          "y_pxl_sz":            _Y_PIXEL_SIZE,
+                          "x_pxl_sz":            x_pxl_sz})
+
         if format == "NETCDF3_CLASSIC":
             netCDFHandler.createDimension("length of Google Map String", len(googleMapAddress))
             googleMapView = netCDFHandler.createVariable("Google_Map_View", "S1", ("length of Google Map String",))
@@ -345,31 +291,12 @@ class DataContainer(object):
             googleMapView = netCDFHandler.createVariable("Google_Map_View", str)
             googleMapView[...] = googleMapAddress
 
-        setattr(netCDFHandler.variables["Google_Map_View"], "usage", "copy and paste to your web browser")
-        setattr(netCDFHandler.variables["Google_Map_View"], 'reference_point', 'Southeast corner of field')
-
-        y_pxl_sz = netCDFHandler.createVariable("y_pxl_sz", "f8")
-        y_pxl_sz[...] = 0.98526434004512529576754637665e-3
-        setattr(netCDFHandler.variables["y_pxl_sz"], "units", "meters")
-        setattr(netCDFHandler.variables["y_pxl_sz"], "notes", "y coordinate length of a single pixel in pictures captured by SWIR and VNIR camera")
-
-        if camera_opt == "SWIR":
-            x_pxl_sz = netCDFHandler.createVariable("x_pxl_sz", "f8")
-            x_pxl_sz[...] = 1.025e-3
-            setattr(netCDFHandler.variables["x_pxl_sz"], "units", "meters")
-            setattr(netCDFHandler.variables["x_pxl_sz"], "notes", "x coordinate length of a single pixel in SWIR images")
-
-        else:
-            x_pxl_sz = netCDFHandler.createVariable("x_pxl_sz", "f8")
-            x_pxl_sz[...] = 1.930615052e-3
-            setattr(netCDFHandler.variables["x_pxl_sz"], "units", "meters")
-            setattr(netCDFHandler.variables["x_pxl_sz"], "notes", "x coordinate length of a single pixel in VNIR images")
+        googleMapView.setncatts({"usage":           "copy and paste to your web browser",
+                                 "reference_point": "Southeast corner of field"})
 
         ##### Write the history to netCDF #####
         netCDFHandler.history = ''.join((_TIMESTAMP(), ': python ', commandLine))
 
-        netCDFHandler.close()
-
 def getDimension(fileName, _debug=True):
     '''
     Acquire dimensions from related HDR file; these dimensions are:
@@ -414,34 +341,41 @@ def get_header_info(fileName):
         return infoDictionary
 
 
-def _file_existence_check(filePath, fmt, dataContainer):
+def _write_variables(group, schema, values, dataType='f8'):
     '''
-    This method will check wheter the filePath has the same variable name as the dataContainer has. If so,
-    user will decide whether skip or overwrite it (no append,
-    since netCDF does not support the repeating variable names)
+    Write every variable of the schema to the group; the attributes of each variable
+    are set in one batch instead of one setattr call (one HDF5 metadata operation) each
     '''
-    userPrompt = _WARN_MSG.format(msg='--> Output file already exists; skip it or overwrite or append? (\033[4;31mS\033[0;31mkip, \033[4;31mO\033[0;31mverwrite, \033[4;31mA\033[0;31mppend)\033[0m')
+    for name, dimensions, attributes in schema:
+        tempVariable = group.createVariable(name, dataType, dimensions)
+        tempVariable.setncatts(attributes)
+        tempVariable[...] = values[name]
 
-    if os.path.isdir(filePath):
-        filePath += "".join(("/", filePath.split("/")[-1], ".nc"))
+def _section_schema(data):
+    '''
+    Translate a lemnatec_measurement_metadata section into its group attributes and the
+    schema and values of its scalar variables (numeric fields and dates)
+    '''
+    groupAttributes, schema, values = dict(), list(), dict()
 
-    if os.path.exists(filePath):
-        netCDFHandler = Dataset(filePath, 'r', format=fmt)
-        if set([x.encode('utf-8') for x in netCDFHandler.groups]) - \
-           set([x for x in dataContainer.__dict__]) != set([x.encode('utf-8') for x in netCDFHandler.groups]):
+    for subkey, subdata in data.items():
+        groupAttributes[_reformat_string(subkey)] = subdata
 
-            while True:
-                userChoice = str(raw_input(userPrompt))
+        if not _IS_DIGIT(subdata): #Case for letter variables
+            ##### For date variables #####
+            if 'date' in subkey and subkey != "date of installation" and subkey != "date of handover":
+                assert subdata != "todo", '"todo" is not a legal value for the keys'
 
-                if userChoice is 'S':
-                    print >> sys.stderr, "Exit due to the skipping"
-                    exit()
-                elif userChoice in ('O', 'A'):
-                    os.remove(filePath)
-                    return Dataset(filePath, 'w', format=fmt)
-        else:
-            os.remove(filePath)
-    return Dataset(filePath, 'w', format=fmt)
+                schema.append((_reformat_string(subkey), (), {"units":    "days since 1970-01-01 00:00:00",
+                                                              "calender": "gregorian"}))
+                values[_reformat_string(subkey)] = translate_time(subdata)
+
+        else: #Case for digits variables
+            short_name, attributes = _generate_attr(subkey)
+            schema.append((short_name, (), attributes))
+            values[short_name] = float(subdata)
+
+    return groupAttributes, schema, values
 
 def _reformat_string(string):
     '''
@@ -549,6 +483,15 @@ def frame_index_parser(fileName, yearMonthDate):
         return [translate_time(yearMonthDate, dataMembers.split()[1]) for dataMembers in fileHandler.readlines()[1:]]
 
 
+def input_file_group(filePath):
+    '''
+    Return the paths of every file the conversion of filePath (the *_raw file) reads
+    '''
+    return [filePath,
+            "".join((filePath, ".hdr")),
+            "".join((filePath[:-4], "_metadata.json")),
+            "".join((filePath[:-4], "_frameIndex.txt"))]
+
 def file_dependency_check(filePath):
     '''
     Check if the input location has all 
@@ -616,34 +559,21 @@ def write_header_file(fileName, netCDFHandler, flatten=False, _debug=True):
     for members in hdrInfo:
         if members == 'default bands':
             threeColorBands = [int(bands) for bands in eval(hdrInfo[members])]
-        setattr(headerInfo, _reformat_string(members), hdrInfo[members])
+    headerInfo.setncatts({_reformat_string(members): hdrInfo[members] for members in hdrInfo})
 
     try:
-        headerInfo.createVariable('red_band_index', 'u2')[...]   = threeColorBands[0]
-        setattr(netCDFHandler.groups['header_info'].variables['red_band_index'],
-                'long_name', 'Index of red band used for RGB composite')
-
-        headerInfo.createVariable('green_band_index', 'u2')[...] = threeColorBands[1]
-        setattr(netCDFHandler.groups['header_info'].variables['green_band_index'],
-                'long_name', 'Index of green band used for RGB composite')
-
-        headerInfo.createVariable('blue_band_index', 'u2')[...]  = threeColorBands[2]
-        setattr(netCDFHandler.groups['header_info'].variables['blue_band_index'],
-                'long_name', 'Index of blue band used for RGB composite')
-
-        setattr(netCDFHandler.groups['sensor_variable_metadata'].variables[
-                'exposure'], 'red_band_index',   threeColorBands[0])
-        setattr(netCDFHandler.groups['sensor_variable_metadata'].variables[
-                'exposure'], 'green_band_index', threeColorBands[1])
-        setattr(netCDFHandler.groups['sensor_variable_metadata'].variables[
-                'exposure'], 'blue_band_index',  threeColorBands[2])
+        _write_variables(headerInfo, _BAND_INDEX_SCHEMA, dict(zip(("red_band_index", "green_band_index", "blue_band_index"), threeColorBands)), 'u2')
+
+        netCDFHandler.groups['sensor_variable_metadata'].variables['exposure'].setncatts({"red_band_index":   threeColorBands[0],
+                                                                                         "green_band_index": threeColorBands[1],
+                                                                                         "blue_band_index":  threeColorBands[2]})
         # blue_band_index long_name = 'Index of blue band used for RGB composite'
         
     except:
         pass
 
 def _argument_parser(*args):
-    assert len(args) >= 3, "Please make sure you have enough arguments! (sourcefile, [debug_option,], [format_option], [flatten_option], fileInput, fileoutput)"
+    assert len(args) >= 3, "Please make sure you have enough arguments! (sourcefile, [debug_option,], [format_option], [flatten_option], [overwrite_option], fileInput, fileoutput)"
 
     source   = args[0]
     input_f  = args[-2]
@@ -651,10 +581,12 @@ def _argument_parser(*args):
     format   = 4
     flatten  = "yes"
     debug    = "yes"
+    policy   = "resume"
 
     format_regex  = r"fmt=(3|4)"
     debug_regex   = r"dbg=(yes|no)"
     flatten_regex = r"ftn=(yes|no)"
+    policy_regex  = r"ovr=(%s)" % "|".join(POLICIES)
 
     for members in args:
         if re.match(format_regex, members):
@@ -663,17 +595,19 @@ def _argument_parser(*args):
             flatten = re.match(flatten_regex, members).groups(1)[0]
         elif re.match(debug_regex, members):
             debug = re.match(debug_regex, members).groups(1)[0]
+        elif re.match(policy_regex, members):
+            policy = re.match(policy_regex, members).groups(1)[0]
           
     flatten = True if flatten == "yes" else False
     flatten = True if format == 3 else flatten
     debug   = True if debug == "yes" else False
     format  = "NETCDF4" if format == 4 else "NETCDF3_CLASSIC"
 
-    return source, input_f, output_f, format, flatten, debug
+    return source, input_f, output_f, format, flatten, debug, policy
 
 
 def main():
-    source_file, file_input, file_output, format, flatten, debug = _argument_parser(*sys.argv[1:])
+    source_file, file_input, file_output, format, flatten, debug, policy = _argument_parser(*sys.argv[1:])
 
     missing_files = file_dependency_check(file_input)
 
@@ -684,8 +618,16 @@ def main():
             print >> sys.stderr, "".join((missing_file," is missing"))
         exit()
 
+    # Decide before parsing anything, so converted scans cost only a few stat() calls
+    outputManager = OutputManager(file_output, input_file_group(file_input), policy, format)
+    if outputManager.should_skip():
+        if debug:
+            print >> sys.stderr, _WARN_MSG.format(msg="".join(("--> Output for ", file_input, " is up to date; skipped (policy: ", policy, ")")))
+        return
+
     testCase = jsonHandler(file_input, debug)
-    testCase.writeToNetCDF(file_input, file_output, " ".join((file_input, file_output)), format, flatten, debug)
+    testCase.writeToNetCDF(file_input, file_output, " ".join((file_input, file_output)), format, flatten, debug, policy,
+                           outputManager)
 
 
 if __name__ == '__main__':
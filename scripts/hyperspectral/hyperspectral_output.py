@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+'''
+hyperspectral_output.py
+
+----------------------------------------------------------------------------------------
+This module manages the netCDF output of hyperspectral_metadata.py so batch runs
+never block on a prompt and never lose an existing good file.
+----------------------------------------------------------------------------------------
+Overwrite policies:
+skip      -> leave any existing output alone
+overwrite -> always regenerate the output
+resume    -> regenerate only when the inputs changed since the last conversion (default)
+
+Whether the output is up to date is decided from a small sidecar file
+(.<output name>.inputs.json) holding the mtime and size of every input, taken
+before the conversion starts, so already-converted scans are skipped without
+opening the netCDF file and inputs changed during a conversion are converted again.
+
+New output is written to a temporary file in the output directory and renamed
+over the final path only after it has been closed successfully; it gets the
+permissions a newly created file would get (0666 less the umask).
+----------------------------------------------------------------------------------------
+'''
+
+import os
+import json
+import tempfile
+from contextlib import contextmanager
+from netCDF4 import Dataset
+
+POLICIES = ("skip", "overwrite", "resume")
+
+_SIDECAR_SUFFIX = ".inputs.json"
+
+
+def input_fingerprint(inputFilePaths):
+    '''
+    Collect (mtime, size) of every input file; missing inputs are recorded as None
+    '''
+    fingerprint = dict()
+    for inputFilePath in inputFilePaths:
+        try:
+            fileStat = os.stat(inputFilePath)
+            fingerprint[os.path.basename(inputFilePath)] = [fileStat.st_mtime, fileStat.st_size]
+        except OSError:
+            fingerprint[os.path.basename(inputFilePath)] = None
+    return fingerprint
+
+
+def _set_default_mode(filePath):
+    '''
+    mkstemp creates files readable only by the owner; give them the usual 0666 & ~umask
+    '''
+    umask = os.umask(0)
+    os.umask(umask)
+    os.chmod(filePath, 0o666 & ~umask)
+
+
+class OutputManager(object):
+    '''
+    Decide whether an output has to be (re)written and write it atomically
+    '''
+
+    def __init__(self, outputFilePath, inputFilePaths, policy="resume", format="NETCDF4"):
+        assert policy in POLICIES, "Unknown overwrite policy %s (expected one of %s)" % (policy, ", ".join(POLICIES))
+
+        if os.path.isdir(outputFilePath):
+            outputFilePath = os.path.join(outputFilePath, "".join((os.path.basename(outputFilePath.rstrip("/")), ".nc")))
+
+        self.outputFilePath = outputFilePath
+        self.inputFilePaths = list(inputFilePaths)
+        self.policy         = policy
+        self.format         = format
+
+    @property
+    def sidecarFilePath(self):
+        outputDirectory, outputFileName = os.path.split(self.outputFilePath)
+        return os.path.join(outputDirectory, "".join((".", outputFileName, _SIDECAR_SUFFIX)))
+
+    def is_up_to_date(self):
+        '''
+        True if the output exists and its recorded input fingerprint matches the inputs on disk.
+        Only stat() calls and the sidecar read are needed; the netCDF file is never opened.
+        '''
+        if not os.path.isfile(self.outputFilePath) or not os.path.isfile(self.sidecarFilePath):
+            return False
+
+        try:
+            with open(self.sidecarFilePath) as fileHandler:
+                recorded = json.load(fileHandler)
+        except (IOError, ValueError):
+            return False
+
+        return recorded == input_fingerprint(self.inputFilePaths)
+
+    def should_skip(self):
+        '''
+        Apply the overwrite policy to the current state of the output
+        '''
+        if self.policy == "skip":
+            return os.path.exists(self.outputFilePath)
+        elif self.policy == "resume":
+            return self.is_up_to_date()
+        return False
+
+    @contextmanager
+    def open(self):
+        '''
+        Yield a writable Dataset on a temporary path; on success it is renamed over the output.
+        If anything fails, the temporary file is removed and the existing output is left untouched.
+        '''
+        outputDirectory = os.path.dirname(os.path.abspath(self.outputFilePath))
+        if not os.path.isdir(outputDirectory):
+            os.makedirs(outputDirectory)
+
+        # Inputs modified while converting must not be recorded as converted
+        fingerprint = input_fingerprint(self.inputFilePaths)
+
+        fileDescriptor, temporaryFilePath = tempfile.mkstemp(suffix=".tmp", dir=outputDirectory,
+                                                             prefix="".join((".", os.path.basename(self.outputFilePath), ".")))
+        os.close(fileDescriptor)
+
+        try:
+            netCDFHandler = Dataset(temporaryFilePath, 'w', format=self.format)
+            try:
+                yield netCDFHandler
+            finally:
+                if netCDFHandler.isopen():
+                    netCDFHandler.close()
+
+            _set_default_mode(temporaryFilePath)
+            os.rename(temporaryFilePath, self.outputFilePath)
+        except BaseException:
+            if os.path.exists(temporaryFilePath):
+                os.remove(temporaryFilePath)
+            raise
+
+        self._write_sidecar(fingerprint)
+
+    def _write_sidecar(self, fingerprint):
+        fileDescriptor, temporaryFilePath = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(self.sidecarFilePath) or ".",
+                                                             prefix=os.path.basename(self.sidecarFilePath))
+        with os.fdopen(fileDescriptor, 'w') as fileHandler:
+            json.dump(fingerprint, fileHandler)
+        _set_default_mode(temporaryFilePath)
+        os.rename(temporaryFilePath, self.sidecarFilePath)
@@ -2,8 +2,39 @@
 
 
 import os
+import argparse
 import logging
 import psycopg2
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+"""
+The dump is parsed into tab-separated rows and streamed into Postgres with COPY in chunks.
+
+A full load fills a new table in one transaction, builds its indexes and then replaces the old
+filesystem table, so queries keep using the old one until the load is done. An incremental load
+(--incremental) copies the dump into a temporary table and only deletes, updates and inserts the
+rows that differ from the previous dump already in the filesystem table.
+
+Usage:
+        python load_file_list.py [-f all-files.txt] [--incremental]
+"""
+
+TABLE = "filesystem"
+
+COLUMNS = ["filepath", "filename", "filesize", "create_time", "change_time", "mod_time", "access_time",
+           "gid", "uid", "dataset_dir"]
+
+TABLE_SCHEMA = "(filepath TEXT, filename TEXT, filesize BIGINT, create_time INT, change_time INT, mod_time INT, " \
+               "access_time INT, gid TEXT, uid TEXT, dataset_dir TEXT)"
+
+# Indexed columns, by index name suffix
+INDEXES = [("filepath_idx", "filepath"), ("dataset_dir_idx", "dataset_dir"), ("mod_time_idx", "mod_time")]
+
+# Columns compared to find the files that changed between dumps
+COMPARED_COLUMNS = ["filesize", "create_time", "change_time", "mod_time", "access_time", "gid", "uid"]
 
 
 def connectToPostgres():
@@ -27,8 +58,8 @@ def parse_line(linestr):
     # 1114061470 593171087 0  7968 8147712 54 54 254 54 202 47852 -- /terraref/sites/ua-mac/raw_data/stereoTop/2017-05-22/2017-05-22__14-47-17-826/d83f0811-de9d-4406-8707-26fabfd2e845_right.bin
     # 1114061482 84336251 0  7968 8147712 54 54 160 54 202 47852 -- /terraref/sites/ua-mac/raw_data/stereoTop/2017-08-24/2017-08-24__12-40-01-916/ef0b016f-3069-4f00-90fb-95475cb581f6_right.bin
 
-    (data, filepath) = linestr.split("--")
-    filepath = filepath.strip().replace("/terraref/sites/ua-mac/", "/sites/ua-mac")
+    (data, _, filepath) = linestr.partition(" -- ")
+    filepath = filepath.strip().replace("/terraref/sites/ua-mac/", "/sites/ua-mac/")
     sub = data.split(" ")
 
     return {
@@ -39,37 +70,119 @@ def parse_line(linestr):
         "change_time": sub[7],
         "mod_time": sub[8],
         "access_time": sub[9],
-        "GID": sub[10],
-        "UID": sub[11]
+        "gid": sub[10],
+        "uid": sub[11],
+        "dataset_dir": os.path.dirname(filepath)
     }
 
-def post_line(curs, linedata):
-    q_insert = "INSERT INTO filesystem VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s);"
-    q_data = (linedata["filepath"], linedata["filename"], linedata["filesize"], linedata["create_time"], linedata["change_time"],
-        linedata["mod_time"], linedata["access_time"], linedata["GID"], linedata["UID"])
-    curs.execute(q_insert, q_data)
+def copy_value(value):
+    # Escape the characters with a meaning in the COPY text format
+    return value.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+def format_row(linedata):
+    return "\t".join(copy_value(linedata[col]) for col in COLUMNS) + "\n"
+
+def copy_dump(curs, table, input_file, chunk_lines):
+    """COPY the lines of a dump into a table, chunk_lines at a time. Returns the number of rows and skipped lines."""
+    q_copy = "COPY %s (%s) FROM STDIN" % (table, ", ".join(COLUMNS))
+    rows = 0
+    skipped = 0
+    buffered = 0
+    buf = StringIO()
+
+    with open(input_file) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                buf.write(format_row(parse_line(line)))
+            except IndexError:
+                skipped += 1
+                continue
+            buffered += 1
+
+            if buffered == chunk_lines:
+                buf.seek(0)
+                curs.copy_expert(q_copy, buf)
+                rows += buffered
+                logging.info("copied %s lines" % rows)
+                buffered = 0
+                buf = StringIO()
+
+    if buffered > 0:
+        buf.seek(0)
+        curs.copy_expert(q_copy, buf)
+        rows += buffered
+    return rows, skipped
+
+def table_columns(curs, table):
+    curs.execute("SELECT column_name FROM information_schema.columns WHERE table_name = %s", (table,))
+    return set(row[0] for row in curs.fetchall())
+
+def full_load(conn, input_file, chunk_lines):
+    """Load the dump into a new table and replace the filesystem table with it."""
+    load_table = TABLE + "_load"
+    curs = conn.cursor()
+    curs.execute("DROP TABLE IF EXISTS %s" % load_table)
+    curs.execute("CREATE TABLE %s %s" % (load_table, TABLE_SCHEMA))
+    rows, skipped = copy_dump(curs, load_table, input_file, chunk_lines)
+
+    logging.info("building indexes")
+    for index_name, column in INDEXES:
+        curs.execute("CREATE INDEX %s_%s ON %s (%s)" % (load_table, index_name, load_table, column))
+    curs.execute("ANALYZE %s" % load_table)
+
+    curs.execute("DROP TABLE IF EXISTS %s" % TABLE)
+    curs.execute("ALTER TABLE %s RENAME TO %s" % (load_table, TABLE))
+    for index_name, _ in INDEXES:
+        curs.execute("ALTER INDEX %s_%s RENAME TO %s_%s" % (load_table, index_name, TABLE, index_name))
+    conn.commit()
+    curs.close()
+    logging.info("loaded %s lines, skipped %s unparseable lines" % (rows, skipped))
+
+def incremental_load(conn, input_file, chunk_lines):
+    """Apply the differences between the dump and the filesystem table to the table."""
+    dump_table = TABLE + "_dump"
+    curs = conn.cursor()
+    curs.execute("CREATE TEMP TABLE %s %s ON COMMIT DROP" % (dump_table, TABLE_SCHEMA))
+    rows, skipped = copy_dump(curs, dump_table, input_file, chunk_lines)
+    curs.execute("CREATE INDEX ON %s (filepath)" % dump_table)
+    curs.execute("ANALYZE %s" % dump_table)
+
+    curs.execute("DELETE FROM %s f WHERE NOT EXISTS (SELECT 1 FROM %s d WHERE d.filepath = f.filepath)" %
+                 (TABLE, dump_table))
+    deleted = curs.rowcount
+    curs.execute("UPDATE %s f SET %s FROM %s d WHERE f.filepath = d.filepath AND (%s) IS DISTINCT FROM (%s)" % (
+        TABLE, ", ".join("%s = d.%s" % (col, col) for col in COMPARED_COLUMNS), dump_table,
+        ", ".join("f." + col for col in COMPARED_COLUMNS), ", ".join("d." + col for col in COMPARED_COLUMNS)))
+    updated = curs.rowcount
+    curs.execute("INSERT INTO %s (%s) SELECT %s FROM %s d WHERE NOT EXISTS (SELECT 1 FROM %s f WHERE f.filepath = d.filepath)" % (
+        TABLE, ", ".join(COLUMNS), ", ".join("d." + col for col in COLUMNS), dump_table, TABLE))
+    inserted = curs.rowcount
+    conn.commit()
+    curs.close()
+    logging.info("compared %s lines (skipped %s unparseable): %s deleted, %s updated, %s inserted" % (
+        rows, skipped, deleted, updated, inserted))
 
 
-input_file = "/home/mburnet2/filedb/all-files.txt"
+parser = argparse.ArgumentParser()
+parser.add_argument('-f', '--input', help="file dump to load", default="/home/mburnet2/filedb/all-files.txt")
+parser.add_argument('-i', '--incremental', help="only apply differences to the previously loaded dump",
+                    default=False, action='store_true')
+parser.add_argument('-c', '--chunk', help="lines per COPY", type=int, default=500000)
+args = parser.parse_args()
 
-"""
-CREATE TABLE filesystem (filepath TEXT, filename TEXT, filesize BIGINT, create_time INT, change_time INT, mod_time INT, access_time INT, gid TEXT, uid TEXT);
-"""
+logging.basicConfig(level=logging.INFO)
 
 conn = connectToPostgres()
 curs = conn.cursor()
-lines = 0
-with open(input_file) as f:
-    curr_line = f.readline()
-    while curr_line:
-        curr_line = f.readline()
-        line_data = parse_line(curr_line)
-        post_line(curs, line_data)
-        lines += 1
-
-        if lines % 10000 == 0:
-            logging.info("inserted %s lines" % lines)
-            conn.commit()
-
-    conn.commit()
-curs.close()
\ No newline at end of file
+existing_columns = table_columns(curs, TABLE)
+curs.close()
+
+if args.incremental and set(COLUMNS) <= existing_columns:
+    incremental_load(conn, args.input, args.chunk)
+else:
+    if args.incremental:
+        logging.info("no %s table with the current columns yet, loading the full dump" % TABLE)
+    full_load(conn, args.input, args.chunk)
+conn.close()
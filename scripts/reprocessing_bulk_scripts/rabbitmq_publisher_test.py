@@ -0,0 +1,96 @@
+import unittest
+
+import rabbitmq_publisher
+from rabbitmq_publisher import BulkPublisher, QueueNotFound, StubChannel, dataset_message
+
+"""
+Tests of the direct RabbitMQ publisher against the in-memory StubChannel.
+
+Usage:
+        python rabbitmq_publisher_test.py
+"""
+
+
+class ThrottledChannel(StubChannel):
+    """StubChannel whose queue depth drops below the limit after a number of checks."""
+    def __init__(self, queues, checks_over_limit):
+        StubChannel.__init__(self, queues)
+        self.checks = 0
+        self.checks_over_limit = checks_over_limit
+
+    def queue_declare(self, queue, passive=False, durable=False):
+        self.checks += 1
+        self.depths[queue] = 1000 if self.checks <= self.checks_over_limit else 0
+        return StubChannel.queue_declare(self, queue, passive, durable)
+
+
+class BulkPublisherTest(unittest.TestCase):
+    def setUp(self):
+        self.throttle_wait = rabbitmq_publisher.THROTTLE_WAIT
+        rabbitmq_publisher.THROTTLE_WAIT = 0
+
+    def tearDown(self):
+        rabbitmq_publisher.THROTTLE_WAIT = self.throttle_wait
+
+    def publish_all(self, publisher, count, extractor="terra.plotclipper"):
+        committed = []
+        for i in range(count):
+            body = dataset_message(extractor, "ds%s" % i, "https://clowder/", "key")
+            committed.extend(publisher.publish(extractor, body, i))
+        committed.extend(publisher.flush())
+        return committed
+
+    def test_commits_in_batches(self):
+        channel = StubChannel(["terra.plotclipper"])
+        publisher = BulkPublisher(batch_size=3, channel=channel)
+
+        committed = []
+        for i in range(4):
+            committed.extend(publisher.publish("terra.plotclipper", {"id": i}, i))
+            # Nothing is enqueued until a batch is full
+            self.assertEqual(len(channel.queues["terra.plotclipper"]), len(committed))
+        self.assertEqual(committed, [0, 1, 2])
+
+        self.assertEqual(publisher.flush(), [3])
+        self.assertEqual([body["id"] for body in channel.queues["terra.plotclipper"]], [0, 1, 2, 3])
+        self.assertEqual(publisher.published, 4)
+
+    def test_builds_dataset_messages(self):
+        channel = StubChannel(["terra.plotclipper"])
+        self.publish_all(BulkPublisher(channel=channel), 2)
+
+        body = channel.queues["terra.plotclipper"][1]
+        self.assertEqual(body["datasetId"], "ds1")
+        self.assertEqual(body["id"], "ds1")
+        self.assertEqual(body["resource_type"], "dataset")
+        self.assertEqual(body["routing_key"], "extractors.terra.plotclipper")
+        self.assertNotEqual(body["msgid"], channel.queues["terra.plotclipper"][0]["msgid"])
+
+    def test_waits_while_queue_is_too_deep(self):
+        # The first check is the existence check, then two checks find the queue too deep
+        channel = ThrottledChannel(["terra.plotclipper"], checks_over_limit=3)
+        publisher = BulkPublisher(batch_size=2, max_queue_depth=100, channel=channel)
+
+        self.assertEqual(self.publish_all(publisher, 2), [0, 1])
+        self.assertEqual(channel.checks, 4)
+        self.assertEqual(len(channel.queues["terra.plotclipper"]), 2)
+
+    def test_dry_run_publishes_nothing(self):
+        publisher = BulkPublisher(batch_size=2, dry_run=True)
+
+        self.assertEqual(self.publish_all(publisher, 3), [0, 1, 2])
+        self.assertIsNone(publisher.channel)
+        self.assertEqual(publisher.published, 3)
+
+    def test_missing_queue_is_not_committed(self):
+        channel = StubChannel(["terra.plotclipper"])
+        publisher = BulkPublisher(channel=channel)
+
+        publisher.publish("terra.plotclippr", {"id": 0}, 0)
+        self.assertRaises(QueueNotFound, publisher.flush)
+        self.assertEqual(publisher.published, 0)
+        self.assertEqual(channel.queues, {"terra.plotclipper": []})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,15 +1,31 @@
+import os
+import time
 import argparse
 import logging
-import requests
+import threading
+try:
+    from Queue import PriorityQueue
+except ImportError:
+    from queue import PriorityQueue
 
 from pyclowder.connectors import Connector
 from pyclowder.datasets import submit_extraction
 
+from rabbitmq_publisher import BulkPublisher, QueueNotFound, dataset_message, DEFAULT_BATCH_SIZE
+
 """
 This script will consume a CSV generated by get_dataset_ids_SENSOR.js and submit them to a desired extractor.
 The -d flag is commonly used when submitting GeoTIFFs to rulechecker that have previously been recorded in order
 to trigger a fieldmosaic process.
 
+Submissions are sent by a pool of threads (-w), limited to a rate of requests per second (-r, with bursts of up
+to -b requests), and retried with exponential backoff. Every successful submission is recorded in a checkpoint
+file (INPUT.checkpoint by default) so an interrupted run can be started again and will skip those. The -e flag
+can be repeated as EXTRACTOR[:PRIORITY]; submissions to higher priority extractors are sent first.
+
+With --rabbitmq the extraction messages are published straight to the extractor queues in batches instead of
+being submitted through Clowder, see rabbitmq_publisher.py; --dry-run only logs what would be published.
+
 Usage:
         python submit_datasets_by_list.py -k CLOWDERKEY -f list_SENSOR_YEAR.csv -e terra.stereo-rgb.bin2tif
 
@@ -24,27 +40,157 @@ Sensor -> extractor reference:
     EnvironmentLogger netCDFs   -> terra.environmental.envlog2netcdf
 """
 
-parser = argparse.ArgumentParser()
+# -h is the Clowder host, so help is only available as --help
+parser = argparse.ArgumentParser(conflict_handler='resolve')
 parser.add_argument('-k', '--key', help="Clowder key", default="")
 parser.add_argument('-f', '--input', help="input CSV file")
-parser.add_argument('-e', '--extractor', help="extractor to use", default="")
+parser.add_argument('-e', '--extractor', help="extractor to use, as EXTRACTOR[:PRIORITY]; can be repeated",
+                    action='append', default=[])
 parser.add_argument('-s', '--sites', help="where /sites is mounted", default="/home/clowder/sites")
 parser.add_argument('-h', '--host', help="Clowder host URL", default="https://terraref.ncsa.illinois.edu/clowder/")
 parser.add_argument('-d', '--daily', help="only submit one dataset per day", default=False, action='store_true')
 parser.add_argument('-t', '--test', help="only submit one dataset then exit", default=False, action='store_true')
+parser.add_argument('-w', '--workers', help="number of concurrent submissions", type=int, default=8)
+parser.add_argument('-r', '--rate', help="maximum submissions per second", type=float, default=20.0)
+parser.add_argument('-b', '--burst', help="maximum submissions sent at once after a pause", type=int, default=20)
+parser.add_argument('--retries', help="attempts per submission before giving up", type=int, default=5)
+parser.add_argument('-c', '--checkpoint', help="checkpoint file of completed submissions (default INPUT.checkpoint)",
+                    default=None)
+parser.add_argument('--rabbitmq', help="RabbitMQ URI to publish to directly instead of submitting through Clowder",
+                    default=None)
+parser.add_argument('--exchange', help="RabbitMQ exchange to publish to", default="")
+parser.add_argument('--batch', help="messages per published batch", type=int, default=DEFAULT_BATCH_SIZE)
+parser.add_argument('--max-queue-depth', help="pause publishing while an extractor queue has this many messages",
+                    type=int, default=None)
+parser.add_argument('--dry-run', help="don't publish, only log the messages", default=False, action='store_true')
 args = parser.parse_args()
 
+
+class TokenBucket(object):
+    """Allows rate requests per second on average, and up to burst requests at once."""
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.last = time.time()
+        self.lock = threading.Lock()
+
+    def take(self):
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class Checkpoint(object):
+    """Records completed (dataset ID, extractor) submissions, one per line, to resume a run."""
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        if os.path.isfile(path):
+            with open(path, 'r') as f:
+                for line in f:
+                    if line.strip():
+                        self.done.add(tuple(line.strip().split(",")))
+        self.out = open(path, 'a')
+        self.lock = threading.Lock()
+
+    def record(self, ds_id, extractor):
+        with self.lock:
+            self.done.add((ds_id, extractor))
+            self.out.write("%s,%s\n" % (ds_id, extractor))
+            self.out.flush()
+
+    def close(self):
+        self.out.close()
+
+
+def is_retryable(e):
+    # Client errors other than rate limiting won't succeed on a retry
+    response = getattr(e, 'response', None)
+    if response is not None and 400 <= response.status_code < 500 and response.status_code != 429:
+        return False
+    return True
+
+def submit_with_retry(ds_id, extractor):
+    for attempt in range(args.retries):
+        BUCKET.take()
+        try:
+            submit_extraction(CONN, args.host, args.key, ds_id, extractor)
+            return True
+        except Exception as e:
+            if not is_retryable(e) or attempt == args.retries - 1:
+                logging.info("failed to submit %s to %s [%s]" % (ds_id, extractor, e))
+                return False
+            backoff = min(60, 2 ** attempt)
+            logging.debug("retrying %s to %s in %ss [%s]" % (ds_id, extractor, backoff, e))
+            time.sleep(backoff)
+
+def worker():
+    while True:
+        _, _, ds_id, extractor = QUEUE.get()
+        if ds_id is None:
+            QUEUE.task_done()
+            return
+        if submit_with_retry(ds_id, extractor):
+            CHECKPOINT.record(ds_id, extractor)
+            with STATS_LOCK:
+                STATS["submitted"] += 1
+                if STATS["submitted"] % 1000 == 0:
+                    logging.info("submitted %s datasets" % STATS["submitted"])
+        else:
+            with STATS_LOCK:
+                STATS["failed"] += 1
+        QUEUE.task_done()
+
+def publish_all():
+    """Publish the queued submissions directly to RabbitMQ, recording each committed batch."""
+    publisher = BulkPublisher(args.rabbitmq, args.exchange, args.batch, args.max_queue_depth, args.dry_run)
+
+    def record(tags):
+        if not args.dry_run:
+            for ds_id, extractor in tags:
+                CHECKPOINT.record(ds_id, extractor)
+        STATS["submitted"] += len(tags)
+        if tags:
+            logging.info("published %s datasets" % STATS["submitted"])
+
+    while not QUEUE.empty():
+        _, _, ds_id, extractor = QUEUE.get()
+        body = dataset_message(extractor, ds_id, args.host, args.key)
+        record(publisher.publish(extractor, body, (ds_id, extractor)))
+    record(publisher.flush())
+
+
 logging.basicConfig(filename="submit_%s.log" % args.input, level=logging.DEBUG)
 
 CONN = Connector(None, mounted_paths={"/home/clowder/sites":args.sites})
+BUCKET = TokenBucket(args.rate, args.burst)
+CHECKPOINT = Checkpoint(args.checkpoint or args.input + ".checkpoint")
+QUEUE = PriorityQueue()
+STATS = {"submitted": 0, "failed": 0}
+STATS_LOCK = threading.Lock()
+
+# Extractors by priority, higher first
+extractors = []
+for e in args.extractor:
+    name, _, priority = e.partition(":")
+    extractors.append((name, int(priority) if priority else 0))
+if not extractors:
+    parser.error("at least one extractor (-e) is required")
 
 logging.info("attempting to parse %s" % args.input)
-sess = requests.Session()
 
-if args.daily:
-    seen_days = []
+seen_days = set()
+queued = 0
+skipped = 0
 with open(args.input, 'r') as csv:
-    i = 0
     for line in csv:
         ds_id, ds_name = line.replace("\n", "").split(",")
         if len(ds_id) > 0:
@@ -53,15 +199,34 @@ with open(args.input, 'r') as csv:
                 if day in seen_days:
                     continue
                 else:
-                    seen_days.append(day)
-            try:
-                submit_extraction(CONN, args.host, args.key, ds_id, args.extractor)
-            except Exception as e:
-                logging.info("failed to submit %s [%s]" % (ds_id, e))
-        i+=1
-        if (i % 1000 == 0):
-            logging.info("submitted %s files" % i)
-        if args.test:
-            logging.info("submitted %s" % ds_id)
-            break
-logging.info("processing completed")
\ No newline at end of file
+                    seen_days.add(day)
+            for extractor, priority in extractors:
+                if (ds_id, extractor) in CHECKPOINT.done:
+                    skipped += 1
+                    continue
+                # Lower sorts first; the line order is kept within a priority
+                QUEUE.put((-priority, queued, ds_id, extractor))
+                queued += 1
+            if args.test and queued > 0:
+                logging.info("submitting %s" % ds_id)
+                break
+logging.info("queued %s submissions, skipped %s already in %s" % (queued, skipped, CHECKPOINT.path))
+
+if args.rabbitmq or args.dry_run:
+    try:
+        publish_all()
+    except QueueNotFound as e:
+        # Batches committed before are in the checkpoint; the rest can be resubmitted once the queue exists
+        logging.error("stopped publishing: %s" % e)
+else:
+    threads = []
+    for i in range(max(1, args.workers)):
+        QUEUE.put((float('inf'), queued + i, None, None))
+        t = threading.Thread(target=worker)
+        t.start()
+        threads.append(t)
+    for t in threads:
+        t.join()
+CHECKPOINT.close()
+
+logging.info("processing completed: %s submitted, %s failed" % (STATS["submitted"], STATS["failed"]))